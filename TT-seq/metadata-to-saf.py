@@ -4,53 +4,181 @@
 
 This script takes input the metadata json file and creates a SAF file for featureCounts
 
-"""
-
-import json, sys
-
-print(sys.argv)
-
-with open(sys.argv[1],'r') as json_file:
-	json_object=json.load(json_file)
-
-print(json_object)
-
-
-print("metadata.gene_name: %s" %(json_object['metadata.gene_name'][0]))
-print("metadata.chromosome: %s" %(json_object['metadata.chromosome'][0]))
-
-gene_name = json_object['metadata.gene_name'][0]
+Each metadata json holds arrays (metadata.gene_name, metadata.chromosome, metadata.start,
+metadata.end, metadata.strand); every element of the arrays is one gene, written as a
+sense feature (GENE) and an antisense feature (GENEanti, on the other strand).
 
-gene_chromosome = json_object['metadata.chromosome'][0]
+	Usage:	python3 metadata-to-saf.py metadata.json                  ->  <gene>.saf
+		python3 metadata-to-saf.py META_DIR_OR_JSON ... -o features.saf [--workers 8]
 
-gene_start = json_object['metadata.start'][0]
+With several metadata files (or a directory of them, or -o), the files are read in
+parallel and all features go to one SAF file, sorted by chromosome and coordinates,
+without duplicate rows, so featureCounts runs once across all genes.
 
-gene_end = json_object['metadata.end'][0]
-
-gene_strand = ""
-gene_anti_sense = ""
-if json_object['metadata.strand'][0] > 0:
-	gene_strand = "+"
-	gene_anti_sense = "-"
-else:
-	gene_strand = "-"
-	gene_anti_sense = "+"
-
-print(f"gene_name: {gene_name} chromosome: {gene_chromosome} gene_start: {gene_start} gene_end: {gene_end} gene_strand: {gene_strand}")
-
-# Create SAF file: the file name will be the gene name
-
-filename=f"{gene_name}.saf"
-print(filename)
-
-SAF_file = open(filename, "w")
-
-header = "GeneID\tChr\tStart\tEnd\tStrand\n"
-SAF_file.write(header)
-
-gene_feature = f"{gene_name}\t{gene_chromosome}\t{gene_start}\t{gene_end}\t{gene_strand}\n"
-gene_feature_anti = f"{gene_name}anti\t{gene_chromosome}\t{gene_start}\t{gene_end}\t{gene_anti_sense}\n"
-SAF_file.write(gene_feature)
-SAF_file.write(gene_feature_anti)
+"""
 
-SAF_file.close()
\ No newline at end of file
+import os
+import sys
+import json
+import re
+
+
+METADATA_FIELDS = ['metadata.gene_name', 'metadata.chromosome', 'metadata.start', 'metadata.end', 'metadata.strand']
+SAF_HEADER = "GeneID\tChr\tStart\tEnd\tStrand\n"
+DEFAULT_SAF_FILE = "features.saf"
+
+
+def strand_symbols(strand):
+	"""
+	Sense and antisense strand of a metadata.strand value (1 / -1, or '+' / '-')
+	Output: (gene_strand, gene_anti_sense)
+	"""
+	if strand in ('+', '-'):
+		return ('+', '-') if strand == '+' else ('-', '+')
+	if float(strand) > 0:
+		return ('+', '-')
+	return ('-', '+')
+
+
+def read_metadata_features(json_file):
+	"""
+	SAF features of every gene of one metadata json file
+	Input: json_file, metadata json whose fields are arrays of one or more elements
+	Output: list of (GeneID, Chr, Start, End, Strand) tuples, sense then anti for each gene
+	"""
+	with open(json_file, 'r') as f:
+		json_object = json.load(f)
+
+	columns = []
+	for field in METADATA_FIELDS:
+		if field not in json_object:
+			raise ValueError(f"{json_file} has no {field}")
+		value = json_object[field]
+		columns.append(value if isinstance(value, list) else [value])
+
+	n_genes = len(columns[0])
+	if any(len(column) != n_genes for column in columns):
+		raise ValueError(f"{json_file}: the metadata arrays differ in length ({', '.join(str(len(c)) for c in columns)})")
+
+	features = []
+	for gene_name, gene_chromosome, gene_start, gene_end, strand in zip(*columns):
+		gene_strand, gene_anti_sense = strand_symbols(strand)
+		features.append((str(gene_name), str(gene_chromosome), int(gene_start), int(gene_end), gene_strand))
+		features.append((f"{gene_name}anti", str(gene_chromosome), int(gene_start), int(gene_end), gene_anti_sense))
+	return features
+
+
+def chromosome_key(chromosome):
+	"""
+	Natural sort key for chromosome names: chr2 before chr10
+	"""
+	return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', chromosome)]
+
+
+def feature_key(feature):
+	"""
+	Sort key of a SAF feature: chromosome, start, end, strand, GeneID
+	"""
+	gene_id, chromosome, start, end, strand = feature
+	return (chromosome_key(chromosome), start, end, strand, gene_id)
+
+
+def merge_features(feature_lists):
+	"""
+	Merged SAF features: duplicate rows dropped, sorted by chromosome and coordinates
+	Output: list of (GeneID, Chr, Start, End, Strand) tuples
+	"""
+	merged = set()
+	for features in feature_lists:
+		merged.update(features)
+	return sorted(merged, key=feature_key)
+
+
+def write_saf(features, filename):
+	"""
+	Writes SAF features, with header, to filename
+	Output: number of features written
+	"""
+	with open(filename, "w") as SAF_file:
+		SAF_file.write(SAF_HEADER)
+		for feature in features:
+			SAF_file.write("\t".join(str(value) for value in feature) + "\n")
+	return len(features)
+
+
+def list_metadata_files(inputs):
+	"""
+	Metadata json files of the inputs: json files as given, directories expanded to their *.json files
+	"""
+	json_files = []
+	for path in inputs:
+		if os.path.isdir(path):
+			json_files.extend(sorted(
+				os.path.join(path, name) for name in os.listdir(path) if name.endswith('.json')))
+		else:
+			json_files.append(path)
+	return json_files
+
+
+def read_all_metadata(json_files, workers=8):
+	"""
+	Reads the metadata json files in a pool of threads
+	Output: (feature_lists, failed), the features of each file read and a list of (json_file, error)
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+
+	feature_lists = []
+	failed = []
+	with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+		futures = [executor.submit(read_metadata_features, json_file) for json_file in json_files]
+		for json_file, future in zip(json_files, futures):
+			try:
+				feature_lists.append(future.result())
+			except Exception as e:
+				failed.append((json_file, f"{type(e).__name__}: {e}"))
+	return (feature_lists, failed)
+
+
+def main(argv=None):
+	"""
+	Command-line entry point, see `python3 metadata-to-saf.py --help`
+	"""
+	import argparse
+
+	parser = argparse.ArgumentParser(description="SAF annotation file for featureCounts from metadata json files")
+	parser.add_argument("metadata", nargs="+", help="metadata json files, or directories of metadata json files")
+	parser.add_argument("-o", "--output", default=None,
+						help=f"merged SAF file (default: <gene>.saf for a single json file, else {DEFAULT_SAF_FILE})")
+	parser.add_argument("--workers", type=int, default=8, help="number of threads the json files are read with")
+	args = parser.parse_args(argv)
+
+	json_files = list_metadata_files(args.metadata)
+	if not json_files:
+		print(f"No metadata json files in {' '.join(args.metadata)}")
+		return 1
+
+	feature_lists, failed = read_all_metadata(json_files, args.workers)
+	for json_file, error in failed:
+		print(f"Error reading metadata {json_file}: {error}")
+	if not feature_lists:
+		return 1
+
+	features = merge_features(feature_lists)
+	if not features:
+		print(f"No genes in the metadata of {' '.join(args.metadata)}")
+		return 1
+
+	# Create SAF file: for a single metadata json the file name will be the (first) gene name
+	if args.output:
+		filename = args.output
+	elif len(json_files) == 1:
+		filename = f"{feature_lists[0][0][0]}.saf"
+	else:
+		filename = DEFAULT_SAF_FILE
+	n_features = write_saf(features, filename)
+	print(f"{n_features} features of {len(json_files) - len(failed)} metadata files saved to {filename}")
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
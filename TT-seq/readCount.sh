@@ -8,22 +8,24 @@
 # 13-09-2023 KKS
 # TT-seq.sh: This modules creates a SAF annotation file and runs featureCounts
 # Counts number of reads for each feature in SAF
+# Usage: readCount.sh METADATA_JSON_OR_DIR [...]   (one metadata json, several, or directories of them)
 
-metadata=$1
+saf=features.saf
 
 export MODULEPATH=/share/ClusterShare/Modules/modulefiles/contrib/centos7.8:$MODULEPATH
 
 
 echo "----------------------------------------------------------------------------------------------------------"
-echo "CREATE SAF FILE FROM METADATA.JSON THEN RUN FEATURECOUNTS. OUTPUT IS out_featureCounts.txt"
+echo "CREATE SAF FILE FROM METADATA JSON FILES THEN RUN FEATURECOUNTS. OUTPUT IS out_featureCounts.txt"
 echo "----------------------------------------------------------------------------------------------------------"
 
-# "STEP 1: create SAF file using metadata json"
+# "STEP 1: create one merged SAF file from all metadata json files"
 echo "STEP 1: create SAF file using metadata json"
 
-# cat $metadata
-
-python3 metadata_to_saf.py $metadata
+# metadata files that cannot be read are reported; the genes of the others are still counted
+rm -f $saf
+python3 metadata-to-saf.py "$@" -o $saf
+[ -s $saf ] || exit 1
 
 
 # STEP 2: run featureCounts with SAF file on BAM files (can be unsorted)
@@ -38,7 +40,7 @@ do
 	bamfile=${file}/*Aligned.out.bam
 	echo $bamfile
 	
-	$featureCounts -p --countReadPairs -T 10 -s 2 -F SAF -a HBB.saf -f \
+	$featureCounts -p --countReadPairs -T 10 -s 2 -F SAF -a $saf -f \
 	-o counts.txt ${bamfile}
 	
 	# append counts.txt to out_featureCounts.txt
@@ -0,0 +1,73 @@
+"""
+Cache writes and pooled batch runs shared by gc_profile, heatmap and hairpins_rnalfold
+
+    atomic_write(file, write)                    cache entry or manifest, never read half-written
+    run_pooled(func, jobs, names, workers)       one summary dict per job, over a process pool
+    write_summary_tsv(summary, fields, file)     per-item summary table of a batch
+
+Batch functions (gc_profile_target_summary, run_experiment, fold_record_summary)
+report their own failures in their summary dict instead of raising; run_pooled only
+has to fill in a summary when the worker process itself fails.
+"""
+
+import csv
+import os
+
+
+def atomic_write(file, write, suffix=''):
+    """
+    Writes file through a temporary file in the same directory, then renames it,
+    so parallel workers and runs never read a partial file
+    Input: write, called with the temporary file name, writes the content there
+           suffix, appended to the temporary file name (for writers that add an extension, e.g. '.npz')
+    Errors (OSError) are raised to the caller; the temporary file is removed
+    """
+    directory = os.path.dirname(file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_file = f'{file}.{os.getpid()}.tmp{suffix}'
+    try:
+        write(tmp_file)
+        os.replace(tmp_file, file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+
+def run_pooled(func, jobs, names, workers=1, name_field="name"):
+    """
+    Runs func(*job) for every job, in a pool of worker processes when workers > 1
+    Input: func, module-level function returning a summary dict (with "status" and "error")
+           jobs, list of argument tuples
+           names, name of each job, for the summary of a job whose worker process failed
+           name_field, key of the name in the summary dicts
+    Output: list of summary dicts, in job order
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [func(*job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(func, *job) for job in jobs]
+        for name, future in zip(names, futures):
+            try:
+                summary.append(future.result())
+            except Exception as e:
+                summary.append({name_field: name, "status": "failed", "error": str(e)})
+    return summary
+
+
+def write_summary_tsv(summary, fields, file):
+    """
+    Writes the summary dicts of a batch as a tsv file, one row per item
+    (fields missing from a summary, e.g. of a failed worker, are left empty)
+    """
+    with open(file, 'w', newline='') as summary_file:
+        summary_writer = csv.DictWriter(summary_file, fields, delimiter="\t", extrasaction="ignore")
+        summary_writer.writeheader()
+        summary_writer.writerows(summary)
@@ -6,23 +6,32 @@ Version history
 
 GC Profile
 
-    Input:  json target file: SEQ_FILE
+    Input:  json target file: SEQ_FILE (or FASTA / plain sequence file in streaming mode)
             which strand: WHICH_STRAND
             window size: WINDOW
 
     Output: plot of GC content in window-sized subseq at each position of SEQ
             csv file of GC content in window-sized subseq at each position of SEQ
+
+    Usage:  python gc_profile.py SEQ_FILE WHICH_STRAND WINDOW THRESHOLD [--no-plot] [--outdir DIR] ...
+            (see python gc_profile.py --help)
 """
 
-from curses import window
 import os
-import json
+import gzip
+import hashlib
 import numpy
-import pandas as pd
-import matplotlib.pyplot as plt
-from Bio.SeqUtils import gc_fraction
 import csv
 
+from batch_runner import atomic_write, run_pooled, write_summary_tsv
+from target_json import load_json_key
+from run_report import NORMAL, QUIET, VERBOSE, STAGES, log, reset_run_report, set_verbosity, stage, write_run_report
+
+# pandas and matplotlib are imported inside the functions that need them,
+# so a run that writes no plots does not pay for importing matplotlib
+
+DEFAULT_OUT_DIR = './gc_out'
+
 
 def open_json_file(json_file, which_strand):
     """
@@ -32,24 +41,318 @@ def open_json_file(json_file, which_strand):
 
     """
     try:
-        #open json file
-        data = json.load(open(json_file))
-
-        #initialise sequence variable
-        seq = ''
-
-        #check which strand to use
+        #check which strand to use; only that key is read from the json file
         if which_strand == 'sequence':
-            print("Using sequence strand")
-            return data['sequence']
+            log("Using sequence strand")
+            return load_json_key(json_file, 'sequence')
 
         else:
-            print("Using sequence_rc strand")
-            return data['sequence_rc']
+            log("Using sequence_rc strand")
+            # sequence_rc is optional: derive it from sequence when absent
+            try:
+                return load_json_key(json_file, 'sequence_rc')
+            except KeyError:
+                return reverse_complement(load_json_key(json_file, 'sequence'))
 
     except Exception as e:
-        print(f"Error loading input json file: {e}")
-        return None
+        log(f"Error loading input json file: {e}", level=QUIET)
+        raise
+
+
+# lookup tables used to encode a sequence once into a byte array
+# (same base classes as Bio.SeqUtils.gc_fraction with ambiguous="remove")
+GC_BASES = b"CGScgs"
+COUNTED_BASES = GC_BASES + b"ATWUatwu"
+
+GC_LOOKUP = numpy.zeros(256, dtype=numpy.int8)
+GC_LOOKUP[numpy.frombuffer(GC_BASES, dtype=numpy.uint8)] = 1
+
+COUNTED_LOOKUP = numpy.zeros(256, dtype=numpy.int8)
+COUNTED_LOOKUP[numpy.frombuffer(COUNTED_BASES, dtype=numpy.uint8)] = 1
+
+
+def encode_sequence(input_sequence):
+    """
+    Encode a sequence once into a uint8 byte array
+    Input: input_sequence, the sequence strand (str, bytes or PackedSequence)
+    Output: numpy uint8 array with one byte per base
+    """
+    if isinstance(input_sequence, PackedSequence):
+        return input_sequence.encoded()
+    if isinstance(input_sequence, str):
+        input_sequence = input_sequence.encode("ascii")
+    return numpy.frombuffer(input_sequence, dtype=numpy.uint8)
+
+
+# 2-bit codes of the packed sequence representation; anything else is stored as an exception run
+ACGT_CODES = numpy.full(256, 255, dtype=numpy.uint8)
+for code, bases in enumerate((b"Aa", b"Cc", b"Gg", b"Tt")):
+    ACGT_CODES[numpy.frombuffer(bases, dtype=numpy.uint8)] = code
+ACGT_BYTES = numpy.frombuffer(b"ACGT", dtype=numpy.uint8)
+
+UPPER_LOOKUP = numpy.arange(256, dtype=numpy.uint8)
+UPPER_LOOKUP[ord('a'):ord('z') + 1] -= 32
+
+COMPLEMENT_LOOKUP = numpy.arange(256, dtype=numpy.uint8)
+for base, complement in zip(b"ACGTURYKMBVDHacgturykmbvdh", b"TGCAAYRMKVBHDtgcaayrmkvbhd"):
+    COMPLEMENT_LOOKUP[base] = complement
+
+
+def reverse_complement(input_sequence):
+    """
+    Reverse complement of a sequence string, through a lookup table
+    (case and IUPAC ambiguity codes are kept)
+    """
+    return COMPLEMENT_LOOKUP[encode_sequence(input_sequence)[::-1]].tobytes().decode("ascii")
+
+
+def value_runs(values):
+    """
+    Runs of equal, non-zero values
+    Input: values, numpy uint8 array
+    Output: (starts, ends, run_values) numpy arrays, ends exclusive
+    """
+    padded = numpy.zeros(len(values) + 2, dtype=values.dtype)
+    padded[1:-1] = values
+    bounds = numpy.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = bounds[:-1], bounds[1:]
+    run_values = padded[starts + 1]
+    keep = run_values != 0
+    return (starts[keep], ends[keep], run_values[keep])
+
+
+def run_positions(starts, ends):
+    """
+    All positions covered by the runs [starts, ends), as one numpy array
+    """
+    lengths = ends - starts
+    offsets = numpy.repeat(starts - numpy.concatenate(([0], numpy.cumsum(lengths)[:-1])), lengths)
+    return numpy.arange(lengths.sum()) + offsets
+
+
+class PackedSequence:
+    """
+    Compact sequence: 2 bits per A/C/G/T base, plus run-length lists of the
+    other bases (N, ambiguity codes) and of soft-masked (lowercase) stretches
+    GC counting and windowing work directly on the packed codes; the text is
+    only rebuilt for the slices that are asked for.
+    """
+
+    def __init__(self, packed, length, exception_runs, lower_runs):
+        self.packed = packed
+        self.length = length
+        self.exception_runs = exception_runs
+        self.lower_runs = lower_runs
+
+    @classmethod
+    def from_string(cls, input_sequence):
+        """
+        Pack a sequence string (or bytes)
+        """
+        encoded = encode_sequence(input_sequence)
+        codes = ACGT_CODES[encoded]
+        exceptions = codes == 255
+        codes[exceptions] = 0
+
+        upper = UPPER_LOOKUP[encoded]
+        exception_runs = value_runs(numpy.where(exceptions, upper, 0).astype(numpy.uint8))
+        lower_runs = value_runs((upper != encoded).astype(numpy.uint8))[:2]
+        return cls(cls.pack_codes(codes), len(encoded), exception_runs, lower_runs)
+
+    @staticmethod
+    def pack_codes(codes):
+        """
+        Pack 2-bit codes four to a byte
+        """
+        padded = numpy.zeros(-(-len(codes) // 4) * 4, dtype=numpy.uint8)
+        padded[:len(codes)] = codes
+        quads = padded.reshape(-1, 4)
+        return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+    def codes(self):
+        """
+        Unpacked 2-bit codes, one uint8 per base (exception bases read as 0)
+        """
+        shifts = numpy.array([6, 4, 2, 0], dtype=numpy.uint8)
+        return ((self.packed[:, None] >> shifts) & 3).reshape(-1)[:self.length]
+
+    def base_codes(self):
+        """
+        Per-base codes A=0, C=1, G=2, T=3, anything else 4 (as BASE_CODES)
+        """
+        codes = self.codes()
+        codes[run_positions(*self.exception_runs[:2])] = 4
+        return codes
+
+    def gc_indicators(self):
+        """
+        Per-base GC and countable-base indicators, as GC_LOOKUP / COUNTED_LOOKUP
+        """
+        codes = self.codes()
+        gc = ((codes == 1) | (codes == 2)).astype(numpy.int8)
+        counted = numpy.ones(self.length, dtype=numpy.int8)
+
+        starts, ends, bases = self.exception_runs
+        positions = run_positions(starts, ends)
+        run_bases = numpy.repeat(bases, ends - starts)
+        gc[positions] = GC_LOOKUP[run_bases]
+        counted[positions] = COUNTED_LOOKUP[run_bases]
+        return (gc, counted)
+
+    def encoded(self):
+        """
+        The sequence text as a uint8 byte array, as encode_sequence()
+        """
+        encoded = ACGT_BYTES[self.codes()]
+        starts, ends, bases = self.exception_runs
+        encoded[run_positions(starts, ends)] = numpy.repeat(bases, ends - starts)
+        encoded[run_positions(*self.lower_runs)] += 32
+        return encoded
+
+    def reverse_complement(self):
+        """
+        Reverse complement, computed on the packed form when asked for
+        """
+        def mirror(starts, ends):
+            return (self.length - ends[::-1], self.length - starts[::-1])
+
+        starts, ends, bases = self.exception_runs
+        return PackedSequence(
+            self.pack_codes(3 - self.codes()[::-1]),
+            self.length,
+            mirror(starts, ends) + (COMPLEMENT_LOOKUP[bases[::-1]],),
+            mirror(*self.lower_runs))
+
+    def circularised(self, window_len):
+        """
+        Sequence with its first window_len bases appended to the end
+        """
+        return PackedSequence.from_string(str(self) + self[:window_len])
+
+    def __len__(self):
+        return self.length
+
+    def __bytes__(self):
+        return self.encoded().tobytes()
+
+    def __str__(self):
+        return bytes(self).decode("ascii")
+
+    def __getitem__(self, index):
+        """
+        Slices return the sequence text of that slice only
+        """
+        if not isinstance(index, slice):
+            return str(self[index:index + 1 or None])
+        start, stop, step = index.indices(self.length)
+        if step != 1 or stop <= start:
+            return str(self)[index]
+
+        # decode whole bytes of the packed array around the slice
+        byte_start = start // 4
+        partial = PackedSequence(self.packed[byte_start:-(-stop // 4)], stop - byte_start * 4, *(
+            clip_runs(runs, byte_start * 4, stop) for runs in (self.exception_runs, self.lower_runs)))
+        return bytes(partial)[start - byte_start * 4:].decode("ascii")
+
+
+def clip_runs(runs, start, stop):
+    """
+    Runs restricted to [start, stop) and shifted to start at 0
+    """
+    starts, ends = runs[0], runs[1]
+    keep = (ends > start) & (starts < stop)
+    clipped = (numpy.maximum(starts[keep], start) - start, numpy.minimum(ends[keep], stop) - start)
+    return clipped + tuple(values[keep] for values in runs[2:])
+
+
+def prepare_sequence(input_sequence):
+    """
+    Sequence in a form the GC engine reads directly: a PackedSequence is used as is,
+    anything else is encoded with encode_sequence()
+    """
+    if isinstance(input_sequence, PackedSequence):
+        return input_sequence
+    return encode_sequence(input_sequence)
+
+
+def circularise(input_sequence, window_len):
+    """
+    Append the first window_len bases to the end of the sequence (str or PackedSequence)
+    """
+    if isinstance(input_sequence, PackedSequence):
+        return input_sequence.circularised(window_len)
+    return input_sequence + input_sequence[:window_len]
+
+
+def prefix_sums(per_base_counts):
+    """
+    Cumulative sum of per-base counts, with a leading zero
+    Input: per_base_counts, numpy array with one count per base
+    Output: numpy int64 array of length len(per_base_counts) + 1
+    """
+    cumulative = numpy.zeros(len(per_base_counts) + 1, dtype=numpy.int64)
+    numpy.cumsum(per_base_counts, out=cumulative[1:])
+    return cumulative
+
+
+def gc_prefix_sums(encoded_sequence):
+    """
+    Prefix sums of GC bases and of countable bases, shared by every window size
+    Input: encoded_sequence, output of encode_sequence(), or a PackedSequence
+    Output: (gc_cumulative, counted_cumulative), see prefix_sums()
+    """
+    if isinstance(encoded_sequence, PackedSequence):
+        return tuple(prefix_sums(indicator) for indicator in encoded_sequence.gc_indicators())
+    return (prefix_sums(GC_LOOKUP[encoded_sequence]), prefix_sums(COUNTED_LOOKUP[encoded_sequence]))
+
+
+def gc_percentages_from_prefix(gc_cumulative, counted_cumulative, window_len):
+    """
+    Calculate GC percentage of the window-sized subseq at each position
+    Input: gc_cumulative, counted_cumulative, output of gc_prefix_sums()
+           window_len, the window size
+    Output: numpy float64 array of GC percentages, one per window start
+    """
+    if window_len < 1 or len(gc_cumulative) <= window_len:
+        return numpy.zeros(0, dtype=numpy.float64)
+
+    gc_counts = gc_cumulative[window_len:] - gc_cumulative[:-window_len]
+    counted = counted_cumulative[window_len:] - counted_cumulative[:-window_len]
+
+    # windows with no countable bases have GC content 0 (as gc_fraction does)
+    gc_perc = numpy.zeros(len(gc_counts), dtype=numpy.float64)
+    nonzero = counted > 0
+    gc_perc[nonzero] = gc_counts[nonzero] / counted[nonzero]
+    gc_perc *= 100
+    return gc_perc
+
+
+def gc_percentages(encoded_sequence, window_len):
+    """
+    Calculate GC percentage of the window-sized subseq at each position
+    Input: encoded_sequence, output of prepare_sequence()
+           window_len, the window size
+    Output: numpy float64 array of GC percentages, one per window start
+    """
+    return gc_percentages_from_prefix(*gc_prefix_sums(encoded_sequence), window_len)
+
+
+def find_high_gc_regions(gc_perc, threshold):
+    """
+    Find start and end of regions where GC content is above threshold
+    A region starts at the first window >= threshold and ends at the first
+    following window < threshold. A region still open at the end of the
+    sequence is not reported.
+    Input: gc_perc, numpy array of GC percentages
+           threshold, the minimum percentage of GC content
+    Output: (starts, ends), two numpy int64 arrays of equal length
+    """
+    above = numpy.zeros(len(gc_perc) + 1, dtype=numpy.int8)
+    above[1:] = gc_perc >= threshold
+    edges = numpy.diff(above)
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1)
+    return (starts[:len(ends)], ends)
 
 
 def gc_profile_calc(input_sequence, window_len, threshold):
@@ -57,213 +360,1378 @@ def gc_profile_calc(input_sequence, window_len, threshold):
     Calculate GC content in window-sized subseq at each position of the sequence
     Input: input_sequence, the sequence strand
     Output: gc_values, a list of GC content in window-sized subseq at each position of the sequence
+            high_gc_regions, a list of (start, end) of regions above threshold
     """
     try:
-        # initialise gc_values list
-        gc_values = []
+        # encode sequence once and calculate gc content from a cumulative sum
+        gc_perc = gc_percentages(prepare_sequence(input_sequence), window_len)
 
-        # initialise high_gc_regions list
-        high_gc_regions = []
-        region_start = None
-        region_end = None
+        # get start and end of regions that are above threshold
+        starts, ends = find_high_gc_regions(gc_perc, threshold)
+        high_gc_regions = list(zip(starts.tolist(), ends.tolist()))
 
-        # loop through sequence to calculate gc content
-        for i in range(len(input_sequence) - window_len + 1):
-            # extract subsequence (i to i + window_len)
-            subseq = input_sequence[i : i + window_len]
+        return (gc_perc.tolist(), high_gc_regions)
 
-            # calculate gc percentage of subsequence
-            gc_content_subseq = gc_fraction(subseq)
-            gc_perc_subseq = gc_content_subseq * 100
+    except Exception as e:
+        log(f"Error calculating GC content: {e}", level=QUIET)
+        raise
 
-            # append gc content to gc_values list
-            gc_values.append(gc_perc_subseq)
 
-            # get start and end of regions that are above threshold
-            if region_start is None and gc_perc_subseq >= threshold:
-                region_start = i
-                region_end = None
+# base codes used by the composition engine (case-insensitive, anything else is N)
+BASE_CODES = numpy.full(256, 4, dtype=numpy.uint8)
+for code, bases in enumerate((b"Aa", b"Cc", b"Gg", b"Tt")):
+    BASE_CODES[numpy.frombuffer(bases, dtype=numpy.uint8)] = code
 
-            if region_end is None and region_start is not None and gc_perc_subseq < threshold:
-                region_end = i   # or end = i + window_len ?
-                high_gc_regions.append((region_start, region_end))
-                region_start = None
+COMPOSITION_METRICS = ('gc', 'gc_skew', 'at_skew', 'cpg_oe', 'n_frac')
 
-        # print(gc_values)
-        # print(f'high_gc_regions: {high_gc_regions}')
-        return (gc_values, high_gc_regions)
 
-    except Exception as e:
-        print(f"Error calculating GC content: {e}")
+def ratio_or_zero(numerator, denominator):
+    """
+    Element-wise numerator / denominator, 0 where the denominator is 0
+    """
+    result = numpy.zeros(len(numerator), dtype=numpy.float64)
+    nonzero = denominator != 0
+    result[nonzero] = numerator[nonzero] / denominator[nonzero]
+    return result
+
+
+def composition_profile(input_sequence, window_len, metrics=COMPOSITION_METRICS):
+    """
+    Calculate several composition metrics of the window-sized subseq at each position
+    The sequence is encoded once and every metric is derived from shared
+    per-base cumulative counts (A, C, G, T, N and CpG dinucleotides), so
+    asking for several metrics costs about the same as asking for one.
+    Metrics:
+        gc       GC percentage, as gc_profile_calc
+        gc_skew  (G - C) / (G + C)
+        at_skew  (A - T) / (A + T)
+        cpg_oe   CpG observed/expected, CpG * (A + C + G + T) / (C * G)
+        n_frac   fraction of bases in the window that are not A/C/G/T
+    Input: input_sequence, the sequence strand
+           window_len, the window size
+           metrics, names of the metrics to calculate
+    Output: numpy structured array with a target_start field and one float64 field per metric
+    """
+    unknown = set(metrics) - set(COMPOSITION_METRICS)
+    if unknown:
+        raise ValueError(f"unknown composition metrics: {sorted(unknown)}")
+
+    encoded = prepare_sequence(input_sequence)
+    n_values = max(len(encoded) - window_len + 1, 0)
+    table = numpy.zeros(n_values, dtype=[('target_start', numpy.int64)] + [(metric, numpy.float64) for metric in metrics])
+    table['target_start'] = numpy.arange(n_values)
+    if n_values == 0:
+        return table
+
+    codes = encoded.base_codes() if isinstance(encoded, PackedSequence) else BASE_CODES[encoded]
+    counts = {}
+
+    def count(base):
+        # windowed count of one base code ('A', 'C', 'G', 'T', 'N') or 'CpG', computed once
+        if base not in counts:
+            if base == 'CpG':
+                cumulative = prefix_sums((codes[:-1] == 1) & (codes[1:] == 2))
+                counts[base] = cumulative[window_len - 1:] - cumulative[:len(cumulative) - window_len + 1]
+            else:
+                cumulative = prefix_sums(codes == 'ACGTN'.index(base))
+                counts[base] = cumulative[window_len:] - cumulative[:-window_len]
+        return counts[base]
+
+    for metric in metrics:
+        if metric == 'gc':
+            table[metric] = gc_percentages(encoded, window_len)
+        elif metric == 'gc_skew':
+            table[metric] = ratio_or_zero(count('G') - count('C'), count('G') + count('C'))
+        elif metric == 'at_skew':
+            table[metric] = ratio_or_zero(count('A') - count('T'), count('A') + count('T'))
+        elif metric == 'cpg_oe':
+            acgt = count('A') + count('C') + count('G') + count('T')
+            table[metric] = ratio_or_zero(count('CpG') * acgt, count('C') * count('G'))
+        elif metric == 'n_frac':
+            table[metric] = count('N') / window_len
+    return table
+
+
+def create_composition_csv_file(table, which_strand, window_len, file):
+    """
+    Creates and stores a composition_profile table to a CSV file
+    Output: a csv file with target_start, strand, window_length and one column per metric
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(table)
+    df.insert(1, 'strand', which_strand)
+    df.insert(2, 'window_length', window_len)
+    df.to_csv(file + '.csv', index=False, float_format='%.4f')
+
+
+# rolling k-mer spectrum of each window, to flag low-complexity and repeat-rich regions
+MAX_KMER_K = 8
+
+
+def kmer_codes(base_codes, k):
+    """
+    2-bit code of the k-mer starting at each position (A=0, C=1, G=2, T=3, first base most significant)
+    Input: base_codes, per-base codes as BASE_CODES (4 for N and other bases)
+           k, the k-mer length
+    Output: numpy int64 array of length len(base_codes) - k + 1; -1 for k-mers containing an N
+    """
+    n_kmers = max(len(base_codes) - k + 1, 0)
+    codes = numpy.zeros(n_kmers, dtype=numpy.int64)
+    for offset in range(k):
+        codes <<= 2
+        codes |= base_codes[offset:offset + n_kmers] & 3
+    n_cumulative = prefix_sums(base_codes == 4)
+    codes[(n_cumulative[k:] - n_cumulative[:len(n_cumulative) - k]) > 0] = -1
+    return codes
+
+
+def x_log2_x(counts):
+    """
+    Element-wise c * log2(c), 0 where c is 0
+    """
+    counts = numpy.asarray(counts, dtype=numpy.float64)
+    result = numpy.zeros(len(counts), dtype=numpy.float64)
+    nonzero = counts > 0
+    result[nonzero] = counts[nonzero] * numpy.log2(counts[nonzero])
+    return result
+
+
+def kmer_profile(input_sequence, window_len, k, circular=False):
+    """
+    Shannon entropy and dominant k-mer of the k-mers in the window-sized subseq at each position
+    The sequence is encoded once into 2-bit k-mer codes. Sliding the window by one
+    base removes one k-mer and adds one, so the entropy is updated from the counts
+    of just those two k-mers (found with a binary search over the sorted k-mer
+    occurrences) instead of recounting the window. The dominant k-mer is tracked
+    in the same single pass. K-mers containing an N are not counted.
+    Input: input_sequence, the sequence strand
+           window_len, the window size
+           k, the k-mer length (1 to MAX_KMER_K, at most window_len)
+           circular, append the first window_len bases first (as the GC profile does)
+    Output: numpy structured array with fields target_start, kmer_entropy (bits, 0 to 2k),
+            dominant_kmer (most frequent k-mer, ties to the first in ACGT order; '' if none)
+            and dominant_count
+    """
+    if not 1 <= k <= min(MAX_KMER_K, window_len):
+        raise ValueError(f"k must be between 1 and {min(MAX_KMER_K, window_len)}, not {k}")
+    if circular:
+        input_sequence = circularise(input_sequence, window_len)
+
+    encoded = prepare_sequence(input_sequence)
+    n_values = max(len(encoded) - window_len + 1, 0)
+    table = numpy.zeros(n_values, dtype=[('target_start', numpy.int64), ('kmer_entropy', numpy.float64),
+                                         ('dominant_kmer', f'U{k}'), ('dominant_count', numpy.int64)])
+    table['target_start'] = numpy.arange(n_values)
+    if n_values == 0:
+        return table
+
+    codes = kmer_codes(encoded.base_codes() if isinstance(encoded, PackedSequence) else BASE_CODES[encoded], k)
+    n_kmers = len(codes)
+    kmers_per_window = window_len - k + 1
+    valid = codes >= 0
+
+    # every valid k-mer occurrence as one sorted key (code, position):
+    # occurrences of a code in a position range are then two binary searches
+    positions = numpy.flatnonzero(valid)
+    occurrence_keys = numpy.sort(codes[positions] * n_kmers + positions)
+
+    def occurrences(kmer, first, last):
+        # number of occurrences of each kmer in positions [first, last]
+        return (numpy.searchsorted(occurrence_keys, kmer * n_kmers + last, side='right')
+                - numpy.searchsorted(occurrence_keys, kmer * n_kmers + first, side='left'))
+
+    # sum of c * log2(c) over the k-mer counts c of each window:
+    # the first window counted directly, then one k-mer leaves and one enters per step
+    first_counts = numpy.bincount(codes[:kmers_per_window][valid[:kmers_per_window]], minlength=4**k)
+    leaving = codes[:n_values - 1]
+    entering = codes[kmers_per_window:kmers_per_window + n_values - 1]
+    steps = numpy.arange(1, n_values)
+
+    leaving_count = occurrences(leaving, steps - 1, steps + kmers_per_window - 2)
+    entering_count = occurrences(entering, steps, steps + kmers_per_window - 2)
+    change = (numpy.where(leaving >= 0, x_log2_x(leaving_count - 1) - x_log2_x(leaving_count), 0)
+              + numpy.where(entering >= 0, x_log2_x(entering_count + 1) - x_log2_x(entering_count), 0))
+    sum_x_log2_x = numpy.concatenate(([x_log2_x(first_counts).sum()], change)).cumsum()
+
+    valid_cumulative = prefix_sums(valid)
+    n_valid = valid_cumulative[kmers_per_window:] - valid_cumulative[:n_kmers + 1 - kmers_per_window]
+    entropy = numpy.zeros(n_values, dtype=numpy.float64)
+    nonzero = n_valid > 0
+    entropy[nonzero] = numpy.log2(n_valid[nonzero]) - sum_x_log2_x[nonzero] / n_valid[nonzero]
+    table['kmer_entropy'] = numpy.maximum(entropy, 0)
+
+    # dominant k-mer: a k-mer entering can only overtake the current one, and the
+    # counts only have to be searched again when the dominant k-mer itself leaves
+    counts = first_counts.copy()
+    dominant = int(numpy.argmax(counts))
+    dominants = numpy.empty(n_values, dtype=numpy.int64)
+    dominants[0] = dominant
+    for step, (out_code, in_code) in enumerate(zip(leaving.tolist(), entering.tolist()), start=1):
+        if out_code != in_code:
+            if out_code >= 0:
+                counts[out_code] -= 1
+            if in_code >= 0:
+                counts[in_code] += 1
+            if out_code == dominant:
+                dominant = int(numpy.argmax(counts))
+            elif in_code >= 0 and (counts[in_code] > counts[dominant]
+                                   or (counts[in_code] == counts[dominant] and in_code < dominant)):
+                dominant = in_code
+        dominants[step] = dominant
+
+    dominant_count = occurrences(dominants, table['target_start'], table['target_start'] + kmers_per_window - 1)
+    table['dominant_count'] = numpy.where(n_valid > 0, dominant_count, 0)
+    letters = ACGT_BYTES[(dominants[:, None] >> (2 * numpy.arange(k - 1, -1, -1))) & 3]
+    table['dominant_kmer'] = numpy.where(n_valid > 0, letters.view(f'S{k}').ravel().astype(f'U{k}'), '')
+    return table
+
+
+def create_kmer_csv_file(table, which_strand, window_len, k, file):
+    """
+    Creates and stores a kmer_profile table to a CSV file
+    Output: a csv file with target_start, strand, window_length, k and the k-mer columns
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(table)
+    df.insert(1, 'strand', which_strand)
+    df.insert(2, 'window_length', window_len)
+    df.insert(3, 'k', k)
+    df.to_csv(file + '.csv', index=False, float_format='%.4f')
+
+
+# content-addressed cache of GC profiles, so reruns with new thresholds skip the GC calculation
+DEFAULT_CACHE_DIR = './gc_cache'
+DEFAULT_CACHE_MAX_BYTES = 1 << 30
+
+
+def gc_cache_key(input_sequence, which_strand, window_len, circular):
+    """
+    Hash of everything the GC values depend on
+    Output: hex digest used as the cache file name
+    """
+    digest = hashlib.sha256()
+    digest.update(input_sequence.encode("ascii") if isinstance(input_sequence, str) else bytes(input_sequence))
+    digest.update(f"|{which_strand}|{window_len}|{bool(circular)}".encode())
+    return digest.hexdigest()
+
+
+def evict_gc_cache(cache_dir, max_bytes):
+    """
+    Delete least recently used cache entries until the cache fits in max_bytes
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.npy'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+
+def clear_gc_cache(cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Delete every entry of the GC profile cache
+    """
+    if os.path.isdir(cache_dir):
+        evict_gc_cache(cache_dir, 0)
+
+
+def gc_cache_file(input_sequence, which_strand, window_len, circular, cache_dir):
+    """
+    Path of the cache entry of one GC profile
+    """
+    return os.path.join(cache_dir, gc_cache_key(input_sequence, which_strand, window_len, circular) + '.npy')
+
+
+def load_gc_cache_entry(cache_file):
+    """
+    GC percentages of a cache entry, or None when there is no (readable) entry
+    """
+    try:
+        gc_perc = numpy.load(cache_file)
+        os.utime(cache_file)  # mark as recently used
+        return gc_perc
+    except (OSError, ValueError):
         return None
 
 
+def save_gc_cache_entry(cache_file, gc_perc, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    Store GC percentages as a cache entry, then evict old entries above cache_max_bytes
+    """
+    def write(tmp_file):
+        with open(tmp_file, 'wb') as tmp:
+            numpy.save(tmp, gc_perc)
+
+    try:
+        atomic_write(cache_file, write)
+        evict_gc_cache(os.path.dirname(cache_file), cache_max_bytes)
+    except OSError as e:
+        log(f"Could not write GC profile cache entry {cache_file}: {e}", level=QUIET)
+
+
+def cached_gc_percentages(input_sequence, which_strand, window_len, circular,
+                          cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    GC percentages of input_sequence, read from the cache when available
+    Input: input_sequence, the (circularised) sequence strand
+           which_strand, window_len, circular, part of the cache key
+           cache_dir, cache directory, or None to disable the cache
+           cache_max_bytes, size above which least recently used entries are evicted
+    Output: numpy float64 array of GC percentages, as gc_percentages()
+    """
+    if cache_dir is None:
+        return gc_percentages(prepare_sequence(input_sequence), window_len)
+
+    cache_file = gc_cache_file(input_sequence, which_strand, window_len, circular, cache_dir)
+    gc_perc = load_gc_cache_entry(cache_file)
+    if gc_perc is None:
+        gc_perc = gc_percentages(prepare_sequence(input_sequence), window_len)
+        save_gc_cache_entry(cache_file, gc_perc, cache_max_bytes)
+    return gc_perc
+
+
+def gc_profile_ladder(input_sequence, window_lens, threshold, circular=False, which_strand='sequence',
+                      cache_dir=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    Calculate GC profiles for several window sizes in one pass
+    The sequence is encoded and prefix-summed once; each window size then
+    only costs one O(n) subtraction.
+    Input: input_sequence, the sequence strand
+           window_lens, list of window sizes
+           threshold, the minimum percentage of GC content
+           circular, if True the first window-sized subseq wraps around to the end
+           which_strand, cache_dir, cache_max_bytes, as cached_gc_percentages; the
+           entries are shared with single-window runs, only missing windows are computed
+    Output: dict {window_len: (gc_perc, (starts, ends))} of numpy arrays
+    """
+    window_lens = sorted(set(window_lens))
+    seq_len = len(input_sequence)
+
+    profiles = {}
+    cache_files = {}
+    if cache_dir is not None:
+        for window_len in window_lens:
+            key_sequence = circularise(input_sequence, window_len) if circular else input_sequence
+            cache_files[window_len] = gc_cache_file(key_sequence, which_strand, window_len, circular, cache_dir)
+            gc_perc = load_gc_cache_entry(cache_files[window_len])
+            if gc_perc is not None:
+                profiles[window_len] = gc_perc
+
+    missing = [window_len for window_len in window_lens if window_len not in profiles]
+    if missing:
+        # circularise once with the largest window; smaller windows use a prefix of it
+        sequence = circularise(input_sequence, missing[-1]) if circular else input_sequence
+        gc_cumulative, counted_cumulative = gc_prefix_sums(prepare_sequence(sequence))
+
+        for window_len in missing:
+            gc_perc = gc_percentages_from_prefix(gc_cumulative, counted_cumulative, window_len)
+            if circular:
+                gc_perc = gc_perc[:seq_len + 1]
+            profiles[window_len] = gc_perc
+            if cache_dir is not None:
+                save_gc_cache_entry(cache_files[window_len], gc_perc, cache_max_bytes)
+
+    return {
+        window_len: (profiles[window_len], find_high_gc_regions(profiles[window_len], threshold))
+        for window_len in window_lens
+    }
+
+
+# streaming mode: sequence is read in fixed-size chunks so memory stays flat
+DEFAULT_CHUNK_SIZE = 1 << 22
+WHITESPACE = b" \t\r\n"
+
+
+def read_fasta_chunks(fasta_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read the first record of a FASTA file (plain or .gz) in fixed-size chunks
+    Input: fasta_file, path of the FASTA file
+           chunk_size, number of bytes read at a time
+    Output: generator of encoded sequence chunks (numpy uint8 arrays)
+    """
+    opener = gzip.open if fasta_file.endswith('.gz') else open
+    with opener(fasta_file, 'rb') as handle:
+        in_header = False
+        at_line_start = True
+        seen_record = False
+        finished = False
+
+        while not finished:
+            block = handle.read(chunk_size)
+            if not block:
+                break
+
+            pieces = []
+            pos = 0
+            while pos < len(block):
+                if in_header:
+                    # skip the rest of the header line
+                    newline = block.find(b'\n', pos)
+                    if newline == -1:
+                        break
+                    in_header = False
+                    at_line_start = True
+                    pos = newline + 1
+                elif at_line_start and block[pos:pos + 1] == b'>':
+                    # only the first record is used
+                    if seen_record:
+                        finished = True
+                        break
+                    seen_record = True
+                    in_header = True
+                else:
+                    next_header = block.find(b'\n>', pos)
+                    end = len(block) if next_header == -1 else next_header + 1
+                    pieces.append(block[pos:end])
+                    at_line_start = block[end - 1:end] == b'\n'
+                    pos = end
+
+            chunk = b''.join(pieces).translate(None, WHITESPACE)
+            if chunk:
+                yield encode_sequence(chunk)
+
+
+def read_fasta_records(fasta_file):
+    """
+    Read every record of a multi-record FASTA file (plain or .gz)
+    Input: fasta_file, path of the FASTA file
+    Output: generator of (name, sequence) strings; the name is the first word of the header
+    """
+    opener = gzip.open if fasta_file.endswith('.gz') else open
+    with opener(fasta_file, 'rt') as handle:
+        name = None
+        pieces = []
+        for line in handle:
+            if line.startswith('>'):
+                if name is not None:
+                    yield (name, ''.join(pieces))
+                name = (line[1:].split() or [''])[0]
+                pieces = []
+            elif name is not None:
+                pieces.append(line.strip())
+        if name is not None:
+            yield (name, ''.join(pieces))
+
+
+def is_fasta_file(seq_file):
+    """
+    FASTA files are recognised by their extension (.fa, .fasta, .fna, optionally .gz)
+    """
+    name = seq_file[:-3] if seq_file.endswith('.gz') else seq_file
+    return name.endswith(('.fa', '.fasta', '.fna'))
+
+
+def read_memmap_chunks(seq_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read a plain sequence file through a memory map in fixed-size chunks
+    Input: seq_file, path of a file holding only sequence text
+           chunk_size, number of bytes read at a time
+    Output: generator of encoded sequence chunks (numpy uint8 arrays)
+    """
+    if os.path.getsize(seq_file) == 0:
+        return
+    mapped = numpy.memmap(seq_file, dtype=numpy.uint8, mode='r')
+    for chunk_start in range(0, len(mapped), chunk_size):
+        chunk = mapped[chunk_start:chunk_start + chunk_size].tobytes().translate(None, WHITESPACE)
+        if chunk:
+            yield encode_sequence(chunk)
+
+
+def read_reverse_complement_chunks(seq_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read the reverse complement strand of an uncompressed FASTA (first record) or plain
+    sequence file, through a memory map from the end of the sequence backwards
+    Input: seq_file, path of the sequence file (compressed files cannot be read backwards)
+           chunk_size, number of bytes read at a time
+    Output: generator of encoded, complemented sequence chunks (numpy uint8 arrays)
+    """
+    if seq_file.endswith('.gz'):
+        raise ValueError(f"The sequence_rc strand of {seq_file} cannot be streamed from a compressed file")
+    if os.path.getsize(seq_file) == 0:
+        return
+
+    import mmap
+
+    with open(seq_file, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start, end = 0, len(mapped)
+        if is_fasta_file(seq_file) or mapped[:1] == b'>':
+            # the first record: from the end of its header line to the next header
+            header_end = mapped.find(b'\n', max(mapped.find(b'>'), 0))
+            start = end if header_end == -1 else header_end + 1
+            next_header = mapped.find(b'\n>', start)
+            end = end if next_header == -1 else next_header + 1
+
+        for chunk_end in range(end, start, -chunk_size):
+            chunk = mapped[max(chunk_end - chunk_size, start):chunk_end][::-1].translate(None, WHITESPACE)
+            if chunk:
+                yield COMPLEMENT_LOOKUP[encode_sequence(chunk)]
+
+
+def read_sequence_chunks(seq_file, chunk_size=DEFAULT_CHUNK_SIZE, which_strand='sequence'):
+    """
+    Pick the chunk reader from the file extension and strand
+    FASTA (.fa, .fasta, .fna, optionally .gz) is parsed, anything else is memory-mapped;
+    the sequence_rc strand is read backwards (see read_reverse_complement_chunks)
+    """
+    if which_strand != 'sequence':
+        return read_reverse_complement_chunks(seq_file, chunk_size)
+    if seq_file.endswith('.gz') or is_fasta_file(seq_file):
+        return read_fasta_chunks(seq_file, chunk_size)
+    return read_memmap_chunks(seq_file, chunk_size)
+
+
+def gc_profile_stream(sequence_chunks, window_len, threshold, circular=False):
+    """
+    Calculate GC content chunk by chunk, carrying a window-length overlap
+    Only the last window_len - 1 bases (and, if circular, the first window_len
+    bases) are kept between chunks, so memory does not grow with the sequence.
+    Input: sequence_chunks, iterable of encoded sequence chunks
+           window_len, the window size
+           threshold, the minimum percentage of GC content
+           circular, if True the first window-sized subseq wraps around to the end
+    Output: generator of (first_target_start, gc_perc, high_gc_regions) per chunk,
+            high_gc_regions being the (start, end) regions closed within that chunk
+    """
+    overlap = numpy.zeros(0, dtype=numpy.uint8)
+    first_window = numpy.zeros(0, dtype=numpy.uint8)
+    seq_len = 0
+    previous_above = 0
+    region_start = None
+
+    def windows(encoded, first_target_start):
+        nonlocal previous_above, region_start
+
+        gc_perc = gc_percentages(encoded, window_len)
+        if len(gc_perc) == 0:
+            return (first_target_start, gc_perc, [])
+
+        above = numpy.empty(len(gc_perc) + 1, dtype=numpy.int8)
+        above[0] = previous_above
+        above[1:] = gc_perc >= threshold
+        edges = numpy.diff(above)
+        starts = (numpy.flatnonzero(edges == 1) + first_target_start).tolist()
+        ends = (numpy.flatnonzero(edges == -1) + first_target_start).tolist()
+        previous_above = above[-1]
+
+        # a region left open by the previous chunk is closed by the first end
+        high_gc_regions = []
+        if region_start is not None and ends:
+            high_gc_regions.append((region_start, ends.pop(0)))
+            region_start = None
+        high_gc_regions.extend(zip(starts, ends))
+        if len(starts) > len(ends):
+            region_start = starts[-1]
+
+        return (first_target_start, gc_perc, high_gc_regions)
+
+    for chunk in sequence_chunks:
+        if circular and len(first_window) < window_len:
+            first_window = numpy.concatenate((first_window, chunk[:window_len - len(first_window)]))
+
+        encoded = numpy.concatenate((overlap, chunk))
+        first_target_start = seq_len - len(overlap)
+        seq_len += len(chunk)
+        overlap = encoded[max(len(encoded) - window_len + 1, 0):].copy()
+
+        yield windows(encoded, first_target_start)
+
+    # wrap-around windows use the stored first chunk, not the whole sequence
+    if circular:
+        yield windows(numpy.concatenate((overlap, first_window)), seq_len - len(overlap))
+
+
+def create_ladder_csv_file(ladder, which_strand, file):
+    """
+    Creates and stores the GC values of every window size to one CSV file
+    Input: ladder, output of gc_profile_ladder()
+            which_strand, the strand used
+    Output: a csv file with one GC_% column per window size (empty past the last window)
+    """
+    import pandas as pd
+
+    n_rows = max(len(gc_perc) for gc_perc, _ in ladder.values())
+    columns = {
+        'target_start': numpy.arange(n_rows),
+        'strand': which_strand,
+    }
+    for window_len, (gc_perc, _) in ladder.items():
+        column = numpy.full(n_rows, numpy.nan)
+        column[:len(gc_perc)] = gc_perc
+        columns[f'GC_%_w{window_len}'] = column
+
+    pd.DataFrame(columns).to_csv(file + '.csv', index=False, float_format='%.1f')
+
+
+def gc_values_offsets(n_values, seq_len, window_len, offset, circular):
+    """
+    Offset of each window, as written to the GC values output
+    The offset counts up from the given offset; for a circular sequence it
+    restarts at 0 once it passes the last window start (len(seq) - window_len).
+    Input: n_values, number of GC values
+           seq_len, length of the (circularised) sequence
+    Output: numpy int64 array of offsets
+    """
+    offsets = numpy.arange(offset, offset + n_values, dtype=numpy.int64)
+    if circular:
+        wrap = max(seq_len - window_len + 1 - offset, 0)
+        if wrap < n_values:
+            offsets[wrap:] = numpy.arange(n_values - wrap)
+    return offsets
+
+
 def create_csv_file(seq, list_of_gc_values, window_len, which_strand, offset, circular, file):
     """
     Creates and stores GC values to a CSV file
-    Input: list_of_gc_values, a list of GC content in window-sized subseq at each position of the sequence
+    Rows are written as they are generated, never held in memory all at once.
+    Input: list_of_gc_values, GC content in window-sized subseq at each position of the sequence
+            (numpy array or list)
             window_len, the window size
             which_strand, the strand used
             offset
             circular, true or false
     Output: a csv file with GC values
     """
+    header = ['sub_sequence', 'target_start', 'offset', 'strand', 'window_length', 'GC_%']
 
-    csv_filename = file + '.csv'
-    csv_file = open(csv_filename, 'w')
-    csv_file_writer = csv.writer(csv_file)
+    # subsequences are sliced on every row, so unpack a PackedSequence once;
+    # round() of python floats keeps the legacy csv text
+    seq = str(seq)
+    list_of_gc_values = numpy.asarray(list_of_gc_values).tolist()
+    offsets = gc_values_offsets(len(list_of_gc_values), len(seq), window_len, offset, circular)
+    rows = (
+        [seq[target_start : target_start + window_len], target_start, item_offset, which_strand, window_len, round(item, 1)]
+        for target_start, (item_offset, item) in enumerate(zip(offsets.tolist(), list_of_gc_values))
+    )
 
-    header = ['sub_sequence', 'target_start', 'offset', 'strand', 'window_length', 'GC_%']
+    with open(file + '.csv', 'w') as csv_file:
+        csv_file_writer = csv.writer(csv_file)
+        csv_file_writer.writerow(header)
+        csv_file_writer.writerows(rows)
+
+
+def create_columnar_file(seq, gc_values, window_len, which_strand, offset, circular, file, output_format='npz'):
+    """
+    Creates and stores GC values as typed columns instead of per-row text
+    The window subsequence is not stored: rebuild it on demand with gc_values_subsequences().
+    Input: as create_csv_file
+           output_format, 'npz', or 'parquet' (needs pyarrow; falls back to npz without it)
+    Output: file.npz or file.parquet with columns target_start, offset, strand, window_length, GC_%
+    """
+    gc_values = numpy.asarray(gc_values, dtype=numpy.float32)
+    target_start = numpy.arange(len(gc_values), dtype=numpy.int64)
+    offsets = gc_values_offsets(len(gc_values), len(seq), window_len, offset, circular)
+
+    if output_format == 'parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            log('pyarrow is not installed, writing GC values as .npz instead', level=QUIET)
+        else:
+            table = pyarrow.table({
+                'target_start': target_start,
+                'offset': offsets,
+                'strand': pyarrow.DictionaryArray.from_arrays(
+                    numpy.zeros(len(gc_values), dtype=numpy.int8), [which_strand]),
+                'window_length': numpy.full(len(gc_values), window_len, dtype=numpy.int32),
+                'GC_%': gc_values,
+            })
+            pyarrow.parquet.write_table(table, file + '.parquet')
+            return file + '.parquet'
+
+    # strand and window length are the same on every row, so stored once
+    numpy.savez(
+        file + '.npz',
+        target_start=target_start,
+        offset=offsets,
+        strand=numpy.array(which_strand),
+        window_length=numpy.array(window_len, dtype=numpy.int32),
+        gc_perc=gc_values)
+    return file + '.npz'
+
+
+def load_columnar_file(file):
+    """
+    Load GC values written by create_columnar_file
+    Input: file, path of the .npz or .parquet file
+    Output: dict of numpy arrays (target_start, offset, strand, window_length, gc_perc)
+    """
+    if file.endswith('.parquet'):
+        import pyarrow.parquet
 
-    gc_values_csv_list = []
-    target_start = 0
-    for item in list_of_gc_values:
-        if circular and offset > len(seq)-window_len: offset = 0
-        gc_value_csv = [
-            seq[target_start : target_start + window_len],
-            target_start,
-            offset,
-            which_strand,
-            window_len,
-            round(item, 1)
-        ]
-        target_start += 1
-        offset += 1
-        gc_values_csv_list.append(gc_value_csv)
+        table = pyarrow.parquet.read_table(file)
+        return {
+            'target_start': table['target_start'].to_numpy(),
+            'offset': table['offset'].to_numpy(),
+            'strand': numpy.array(table['strand'][0].as_py() if len(table) else ''),
+            'window_length': numpy.array(table['window_length'][0].as_py() if len(table) else 0),
+            'gc_perc': table['GC_%'].to_numpy(),
+        }
+    with numpy.load(file) as columns:
+        return {key: columns[key] for key in columns.files}
 
-    csv_file_writer.writerow(header)
-    csv_file_writer.writerows(gc_values_csv_list)
+
+def gc_values_subsequences(seq, target_starts, window_len):
+    """
+    Rebuild the window subsequences of selected GC values from the sequence
+    Input: seq, the (circularised) sequence strand
+           target_starts, iterable of target_start values
+    Output: generator of subsequence strings
+    """
+    for target_start in target_starts:
+        yield seq[target_start : target_start + window_len]
 
 
-def plot_gc_profile(list_of_gc_values, input_sequence, window_len, which_strand, file):
+def decimate_min_max(values, n_bins):
+    """
+    Reduce a profile to at most 2 * n_bins points, keeping the min and max of each bin
+    Peaks and troughs stay visible, while the drawing cost no longer grows with sequence length.
+    Input: values, numpy array of GC values
+           n_bins, number of bins (about the plot width in pixels)
+    Output: (x, y), numpy arrays of positions and values, in position order
+    """
+    values = numpy.asarray(values)
+    if len(values) <= 2 * n_bins:
+        return (numpy.arange(len(values)), values)
+
+    bin_len = -(-len(values) // n_bins)
+    n_full = len(values) // bin_len
+    full = values[:n_full * bin_len].reshape(n_full, bin_len)
+    base = numpy.arange(n_full) * bin_len
+    positions = [base + full.argmin(axis=1), base + full.argmax(axis=1)]
+
+    # last, partial bin
+    if n_full * bin_len < len(values):
+        rest = values[n_full * bin_len:]
+        positions.append(numpy.array([rest.argmin(), rest.argmax()]) + n_full * bin_len)
+
+    x = numpy.unique(numpy.concatenate(positions))
+    return (x, values[x])
+
+
+def decimate_spans(spans, n_values, n_bins):
+    """
+    Project (start, end) spans onto the bins of decimate_min_max, merging spans that share a bin
+    Spans narrower than a bin (about a pixel) are widened to their bins, so the number of
+    spans drawn is at most n_bins whatever the sequence length.
+    Input: spans, (start, end) pairs (0-based, half-open), e.g. a HighGCClusterIndex
+           n_values, length of the profile the spans are drawn over
+           n_bins, number of bins (about the plot width in pixels)
+    Output: (starts, ends), numpy arrays of merged, non-overlapping spans in position order
+    """
+    spans = numpy.asarray(list(spans), dtype=numpy.int64).reshape(-1, 2)
+    bin_len = -(-n_values // n_bins) if n_values > 2 * n_bins else 1
+    n_total_bins = max(-(-n_values // bin_len), 1)
+
+    # +1 at the first bin of each span, -1 after its last: covered bins have a positive sum
+    first_bins = numpy.clip(spans[:, 0] // bin_len, 0, n_total_bins)
+    end_bins = numpy.clip(-(-spans[:, 1] // bin_len), 0, n_total_bins)
+    keep = end_bins > first_bins
+    coverage = numpy.zeros(n_total_bins + 1, dtype=numpy.int64)
+    numpy.add.at(coverage, first_bins[keep], 1)
+    numpy.add.at(coverage, end_bins[keep], -1)
+    covered = numpy.concatenate(([False], numpy.cumsum(coverage[:-1]) > 0, [False]))
+
+    edges = numpy.flatnonzero(covered[1:] != covered[:-1])
+    starts = edges[0::2] * bin_len
+    ends = numpy.minimum(edges[1::2] * bin_len, n_values)
+    return (starts, ends)
+
+
+def new_figure():
+    """
+    Create an explicit Agg figure, independent of pyplot's global figure
+    Output: (figure, axes)
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    return (figure, figure.add_subplot())
+
+
+def save_figure(figure, file):
+    """
+    Save figure as png and pdf, then release it
+    """
+    figure.savefig(file + ".png", format="png")
+    figure.savefig(file + ".pdf", format="pdf")
+    figure.clear()
+
+
+def plot_gc_profile(list_of_gc_values, input_sequence, window_len, which_strand, file, high_gc_clusters=()):
     """
     Plot GC profile of input sequence
-    Input: list_of_gc_values, a list of GC content in window-sized subseq at each position of the sequence
+    Input: list_of_gc_values, GC content in window-sized subseq at each position of the sequence
+           (numpy array or list)
            input_sequence, the sequence strand
            window_len, the window size
            which_strand, the strand used
+           high_gc_clusters, (start, end) of clustered high GC regions, drawn as shaded spans
     Output: a plot of GC profile of input sequence
 
     """
+    figure, axes = new_figure()
+    n_bins = int(figure.get_figwidth() * figure.dpi)
 
-    plt.plot(list_of_gc_values)
-    plt.title("GC Profile of '%s' with window size = %i" % (input_sequence[:20] + "...", window_len))
-    plt.xlabel(f"{which_strand}")
-    plt.ylabel("GC percentage %")
-    plt.grid()
-    #plt.show()
+    axes.plot(*decimate_min_max(list_of_gc_values, n_bins))
+    starts, ends = decimate_spans(high_gc_clusters, len(list_of_gc_values), n_bins)
+    if len(starts):
+        # one collection for all clusters, spanning the full height of the axes
+        axes.broken_barh(list(zip(starts.tolist(), (ends - starts).tolist())), (0, 1),
+                         transform=axes.get_xaxis_transform(), color="orange", alpha=0.3, linewidth=0)
+    axes.set_title("GC Profile of '%s' with window size = %i" % (input_sequence[:20] + "...", window_len))
+    axes.set_xlabel(f"{which_strand}")
+    axes.set_ylabel("GC percentage %")
+    axes.grid()
 
-    plt.savefig(file + ".png", format="png")
-    plt.savefig(file + ".pdf", format="pdf")
+    save_figure(figure, file)
 
 
-def cluster_high_gc_regions(high_gc_regions, window_len, threshold, file):
+def plot_gc_ladder(ladder, input_sequence, which_strand, file):
     """
-    Get list of start and end of regions that are above threshold. 
-    Merge regions that are within 100 bases from each other.
-    Add 100 bases to the extreme ends of clusters.
-    Input: high_gc_regions, a list of start and ends where GC content is above threshold
-            window_len, the window siz
-            threshold, the minimum percentage of GC content
-    Output: a .... file of ..........
+    Plot the GC profile of every window size on one figure
+    Input: ladder, output of gc_profile_ladder()
+           input_sequence, the sequence strand
+           which_strand, the strand used
+    Output: a plot of GC profiles of input sequence
     """
-    try:
+    figure, axes = new_figure()
+    n_bins = int(figure.get_figwidth() * figure.dpi)
 
-        filename = file + '.txt'
-        cluster_file = open(filename, 'w')
-        cluster_file.write("start, end\n")
+    for window_len, (gc_perc, _) in ladder.items():
+        axes.plot(*decimate_min_max(gc_perc, n_bins), label=f"window = {window_len}")
+    axes.set_title("GC Profile of '%s'" % (input_sequence[:20] + "..."))
+    axes.set_xlabel(f"{which_strand}")
+    axes.set_ylabel("GC percentage %")
+    axes.legend()
+    axes.grid()
 
-        clustered_regions = []
+    save_figure(figure, file)
 
-        current_region = high_gc_regions[0]
 
-        for region in high_gc_regions[1:]:
-            # print(f'current_region[0]: {current_region[0]}')
-            # print(f'current_region[1]: {current_region[1]}')
-            # print(f'region[0]: {region[0]}')
-            # print(f'region[1]: {region[1]}\n')
+class HighGCClusterIndex:
+    """
+    Sorted interval index of high GC clusters (0-based, half-open like BED)
+    Clusters do not overlap and are sorted, so starts and ends are both
+    non-decreasing and an overlap query is two binary searches, O(log n).
+    """
+
+    def __init__(self, starts, ends, chrom="target"):
+        self.starts = numpy.asarray(starts, dtype=numpy.int64)
+        self.ends = numpy.asarray(ends, dtype=numpy.int64)
+        self.chrom = chrom
+
+    @classmethod
+    def from_bed(cls, bed_file):
+        """
+        Load the clusters written by cluster_high_gc_regions
+        """
+        if os.path.getsize(bed_file) == 0:
+            return cls([], [])
+        columns = numpy.loadtxt(bed_file, dtype=str, delimiter="\t", ndmin=2, usecols=(0, 1, 2))
+        return cls(columns[:, 1].astype(numpy.int64), columns[:, 2].astype(numpy.int64), columns[0, 0])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts.tolist(), self.ends.tolist())
+
+    def overlapping(self, start, end=None):
+        """
+        Indices of clusters overlapping position start, or range [start, end)
+        Output: numpy array of cluster indices
+        """
+        if end is None:
+            end = start + 1
+        first = numpy.searchsorted(self.ends, start, side="right")
+        last = numpy.searchsorted(self.starts, end, side="left")
+        return numpy.arange(first, max(first, last))
+
+    def query(self, start, end=None):
+        """
+        Clusters overlapping position start, or range [start, end)
+        Output: list of (start, end)
+        """
+        hits = self.overlapping(start, end)
+        return list(zip(self.starts[hits].tolist(), self.ends[hits].tolist()))
+
+    def write_bed(self, bed_file):
+        """
+        Write the clusters as BED (chrom, start, end, name)
+        """
+        with open(bed_file, "w") as bed:
+            bed.writelines(
+                f"{self.chrom}\t{start}\t{end}\tgc_cluster_{n + 1}\n"
+                for n, (start, end) in enumerate(self))
+
+
+def cluster_high_gc_regions(high_gc_regions, window_len, threshold, file, merge_gap=100, flank=100, seq_len=None, chrom="target"):
+    """
+    Get list of start and end of regions that are above threshold.
+    Merge regions within merge_gap (default 100) bases of each other, pad every cluster by
+    flank (default 100) bases on both sides, within [0, seq_len], and merge clusters whose
+    padded extents overlap, so the clusters never overlap.
+    Input: high_gc_regions, a list (or n x 2 array) of start and ends where GC content is above threshold
+            window_len, the window size
+            threshold, the minimum percentage of GC content
+            seq_len, the sequence length used to clip the flanks (optional)
+            chrom, the name written in the first BED column
+    Output: a .bed file of the clusters
+            returns the clusters as a HighGCClusterIndex
+    """
+    try:
+        regions = numpy.asarray(high_gc_regions, dtype=numpy.int64).reshape(-1, 2)
+        starts, ends = regions[:, 0], regions[:, 1]
+
+        # a new cluster begins wherever the gap between two regions is larger than merge_gap
+        new_cluster = numpy.ones(len(starts), dtype=bool)
+        new_cluster[1:] = starts[1:] - ends[:-1] > merge_gap
+        first = numpy.flatnonzero(new_cluster)
 
-            if region[0] - current_region[1] <= 100:
-                current_region = (current_region[0], region[1])
-            elif region[0] - current_region[1] > 100:
-                clustered_regions.append((current_region[0], current_region[1]))
-                cluster_file.write(f"{current_region[0]}, {current_region[1]}\n")
-                current_region = (region[0], region[1])
+        cluster_starts = starts[first] - flank
+        cluster_ends = numpy.maximum.reduceat(ends, first) + flank if len(first) else ends[first]
+        numpy.maximum(cluster_starts, 0, out=cluster_starts)
+        if seq_len is not None:
+            numpy.minimum(cluster_ends, seq_len, out=cluster_ends)
 
-            # if last element, then append the final cluster
-            if region == high_gc_regions[len(high_gc_regions)-1]:
-                clustered_regions.append((current_region[0], current_region[1]))
-                cluster_file.write(f"{current_region[0]}, {current_region[1]}\n")
+        # the flanks of neighbouring clusters may overlap: those clusters are joined
+        new_cluster = numpy.ones(len(cluster_starts), dtype=bool)
+        new_cluster[1:] = cluster_starts[1:] >= numpy.maximum.accumulate(cluster_ends)[:-1]
+        first = numpy.flatnonzero(new_cluster)
+        if len(first) < len(cluster_starts):
+            cluster_ends = numpy.maximum.reduceat(cluster_ends, first)
+            cluster_starts = cluster_starts[first]
 
-        # print(clustered_regions)
-        cluster_file.close()
+        clusters = HighGCClusterIndex(cluster_starts, cluster_ends, chrom)
+        clusters.write_bed(file + '.bed')
+        return clusters
     except Exception as e:
-        print(f"Error in clustering high GC regions: {e}")
-        return None
+        log(f"Error in clustering high GC regions: {e}", level=QUIET)
+        raise
 
 
-def load_seq_file_or_meth(file, which_strand):
+def load_targets(file, which_strand):
+    """
+    Load the targets of a json target file or of a directory holding meta_targets.tsv
+    Only the gene column and the one sequence column needed are parsed; rc_seq
+    is optional and derived from seq when the column is absent.
+    Output: (names, seqs), a list of names and a list of PackedSequence
+    """
     if os.path.isfile(file):
         assert(file.endswith(".json"))
-        return pd.DataFrame([{"name": os.path.basename(file), "seq": open_json_file(file, which_strand)}])
+        return ([os.path.basename(file)], [PackedSequence.from_string(open_json_file(file, which_strand))])
     else:
-        df = pd.read_csv(file + os.sep + "meta_targets.tsv", sep="\t")
+        import pandas as pd
+
+        meta_file = file + os.sep + "meta_targets.tsv"
+        with open(meta_file) as meta:
+            columns = meta.readline().rstrip("\n").split("\t")
+        assert("seq" in columns)
+        assert("gene" in columns)
+        col_name = "rc_seq" if which_strand != "sequence" and "rc_seq" in columns else "seq"
+
+        df = pd.read_csv(meta_file, sep="\t", usecols=["gene", col_name], dtype={col_name: str})
         assert(df.shape[0] > 0)
-        assert("seq" in df.columns)
-        assert("gene" in df.columns)
-        assert("rc_seq" in df.columns)
-        col_name = "seq" if which_strand == "sequence" else "rc_seq"
-        df = df[["gene", col_name]]
-        df.columns = ["name", "seq"]
-        return df
+        seqs = [PackedSequence.from_string(seq) if isinstance(seq, str) else seq for seq in df[col_name]]
+        if which_strand != "sequence" and col_name == "seq":
+            seqs = [seq.reverse_complement() if isinstance(seq, PackedSequence) else seq for seq in seqs]
+        return (df["gene"].tolist(), seqs)
+
+
+def load_seq_file_or_meth(file, which_strand):
+    import pandas as pd
+
+    names, seqs = load_targets(file, which_strand)
+    return pd.DataFrame({"name": names, "seq": [str(seq) if isinstance(seq, PackedSequence) else seq for seq in seqs]})
+
+
+def gc_profile_ladder_run(
+        name, seq, which_strand, window_lens, threshold, circular, merge_gap=100, flank=100,
+        out_dir=DEFAULT_OUT_DIR, plot=True, cache_dir=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    Run the GC profile of one target for several window sizes
+    Input: name, the target name
+           seq, the sequence strand
+           window_lens, list of window sizes
+           cache_dir, cache_max_bytes, GC profile cache (see gc_profile_ladder)
+    Output: one plot and one multi-column csv file for all window sizes,
+            plus one high GC cluster file per window size
+    """
+    log(f'Calculating GC content for window sizes {window_lens} in one pass...\n')
+    with stage("compute", target=name):
+        ladder = gc_profile_ladder(seq, window_lens, threshold, circular, which_strand, cache_dir, cache_max_bytes)
+
+    if plot:
+        out_plot = f"{out_dir}/{name}_gc_profile_ladder"
+        with stage("render", target=name):
+            plot_gc_ladder(ladder, seq, which_strand, out_plot)
+        log(f'GC profile plot saved as {out_plot}.png and {out_plot}.pdf\n')
+
+    out_csv = f"{out_dir}/{name}_gc_values_ladder"
+    with stage("write", target=name):
+        create_ladder_csv_file(ladder, which_strand, out_csv)
+    log(f'GC values CSV file saved as {out_csv}.csv')
+
+    log(f"threshold: {threshold}")
+    with stage("write", target=name, output="clusters"):
+        for window_len, (_, (starts, ends)) in ladder.items():
+            out_regions = f"{out_dir}/{name}_w{window_len}_high_gc_regions"
+            cluster_high_gc_regions(
+                numpy.column_stack((starts, ends)), window_len, threshold, out_regions, merge_gap, flank, len(seq), name)
+            log(f"Clusters for window size {window_len} saved to {out_regions}.bed")
+
+
+def final_gc_profile_stream_command(
+        seq_file, which_strand, window_len, threshold, circular, chunk_size=DEFAULT_CHUNK_SIZE, merge_gap=100, flank=100,
+        out_dir=DEFAULT_OUT_DIR):
+    """
+    Streaming gc profile run command for chromosome-scale FASTA or sequence files
+    Input: seq_file, FASTA (plain or .gz) or plain sequence file
+           which_strand, 'sequence' (the strand in the file) or 'sequence_rc' (its reverse
+           complement, read backwards; not possible for .gz files)
+    Output: csv file of GC values written chunk by chunk and file of clustered high GC regions
+    """
+    name = os.path.basename(seq_file)
+    out_csv = f"{out_dir}/{name}_gc_values.csv"
+    out_regions = f"{out_dir}/{name}_high_gc_regions"
+
+    log(f'Streaming GC content of {window_len}-bp subsequences of {seq_file} in {chunk_size}-byte chunks...\n')
+    high_gc_regions = []
+    # reading, calculating and writing are interleaved chunk by chunk, so they are one stage
+    with stage("compute", target=name, streaming=True), open(out_csv, 'w') as csv_file:
+        csv_file.write('target_start,strand,window_length,GC_%\n')
+        for first_target_start, gc_perc, regions in gc_profile_stream(
+                read_sequence_chunks(seq_file, chunk_size, which_strand), window_len, threshold, circular):
+            rows = zip(range(first_target_start, first_target_start + len(gc_perc)), numpy.round(gc_perc, 1).tolist())
+            csv_file.write(''.join(f'{i},{which_strand},{window_len},{gc}\n' for i, gc in rows))
+            high_gc_regions.extend(regions)
+    log(f'GC values CSV file saved as {out_csv}')
+
+    log(f"threshold: {threshold}")
+    with stage("write", target=name, output="clusters"):
+        cluster_high_gc_regions(high_gc_regions, window_len, threshold, out_regions, merge_gap, flank, chrom=name)
+    log(f"Clusters saved to {out_regions}.bed")
+
+
+def ladder_unsupported_options(offset, output_format, metrics, kmer_k):
+    """
+    Options a window ladder run does not support (it writes one multi-column csv file)
+    Output: list of the option names set to something else than their default
+    """
+    unsupported = []
+    if offset:
+        unsupported.append("offset")
+    if output_format != 'csv':
+        unsupported.append("output format")
+    if metrics:
+        unsupported.append("metrics")
+    if kmer_k is not None:
+        unsupported.append("k-mer profile")
+    return unsupported
+
+
+def stream_unsupported_options(window_lens, offset, output_format, metrics, kmer_k):
+    """
+    Options a streaming run does not support (it writes one csv file, chunk by chunk, for one window size)
+    Output: list of the option names set to something else than their default
+    """
+    unsupported = ladder_unsupported_options(offset, output_format, metrics, kmer_k)
+    if len(window_lens) > 1:
+        unsupported.insert(0, "several window sizes")
+    return unsupported
+
+
+def gc_profile_target_run(
+        name, seq, which_strand, window_len, threshold, circular, offset, output_format='csv', merge_gap=100, flank=100,
+        metrics=(), cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES, out_dir=DEFAULT_OUT_DIR,
+        plot=True, kmer_k=None):
+    """
+    Run the GC profile of one target
+    Input: name, the target name (used for the output file names)
+           seq, the sequence strand
+           other parameters as final_gc_profile_run_command
+    Output: plot, csv and cluster files of the target in out_dir
+    """
+    # an empty seq cell of meta_targets.tsv is read as NaN
+    if not isinstance(seq, (str, PackedSequence)) or len(seq) == 0:
+        raise ValueError(f"missing sequence for target {name}")
+
+    # confirm sequence length
+    log(f'\nLength of target sequence is: {len(seq)}\n')
+
+    # several window sizes: compute every profile from one shared prefix sum
+    if isinstance(window_len, (list, tuple)):
+        unsupported = ladder_unsupported_options(offset, output_format, metrics, kmer_k)
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} cannot be used with several window sizes")
+        gc_profile_ladder_run(
+            name, seq, which_strand, window_len, threshold, circular, merge_gap, flank, out_dir, plot,
+            cache_dir, cache_max_bytes)
+        return
+
+    # if circular, add first window-sized subseq to end of seq
+    if circular is True:
+        seq = circularise(seq, window_len)
+        log(f'Circularising the sequence. Length of target sequence is now: {len(seq)}\n')
+
+    # calculate gc content
+    log(f'Calculating GC content of {window_len}-bp subsequence at each position of the sequence...\n')
+    with stage("compute", target=name):
+        gc_perc = cached_gc_percentages(seq, which_strand, window_len, circular, cache_dir, cache_max_bytes)
+
+        # region detection always reruns, so a threshold change reuses the cached profile
+        starts, ends = find_high_gc_regions(gc_perc, threshold)
+        high_gc_regions = numpy.column_stack((starts, ends))
+
+    # create csv (or columnar) file of gc profile (save in out_dir)
+    out_csv = f"{out_dir}/{name}_gc_values"
+    with stage("write", target=name, output=output_format):
+        if output_format == 'csv':
+            log(f'Generating CSV file of GC values of {name} at each position of the sequence...')
+            create_csv_file(seq, gc_perc, window_len, which_strand, offset, circular, out_csv)
+            log(f'GC values CSV file saved as {out_csv}.csv')
+        else:
+            log(f'Generating {output_format} file of GC values of {name} at each position of the sequence...')
+            out_file = create_columnar_file(seq, gc_perc, window_len, which_strand, offset, circular, out_csv, output_format)
+            log(f'GC values saved as {out_file}')
 
+    # other composition metrics over the same windows, if requested
+    if metrics:
+        log(f'Calculating {", ".join(metrics)} of {name} at each position of the sequence...')
+        out_composition = f"{out_dir}/{name}_composition"
+        with stage("compute", target=name, output="composition"):
+            table = composition_profile(seq, window_len, metrics)
+        with stage("write", target=name, output="composition"):
+            create_composition_csv_file(table, which_strand, window_len, out_composition)
+        log(f'Composition CSV file saved as {out_composition}.csv')
 
-def final_gc_profile_run_command(seq_file_or_meth, which_strand, window_len, threshold, circular, offset):
+    # k-mer entropy and dominant k-mer over the same windows, if requested
+    if kmer_k:
+        log(f'Calculating the {kmer_k}-mer spectrum of {name} at each position of the sequence...')
+        out_kmer = f"{out_dir}/{name}_kmer_k{kmer_k}"
+        with stage("compute", target=name, output="kmer"):
+            table = kmer_profile(seq, window_len, kmer_k)
+        with stage("write", target=name, output="kmer"):
+            create_kmer_csv_file(table, which_strand, window_len, kmer_k, out_kmer)
+        log(f'K-mer CSV file saved as {out_kmer}.csv')
+
+    # get clustered regions where GC content is above threshold
+    log(f'\nClustering high_gc_regions above threshold that are within {merge_gap} bases from each other...')
+    log(f"threshold: {threshold}")
+    out_regions = f"{out_dir}/{name}_high_gc_regions"
+    with stage("write", target=name, output="clusters"):
+        high_gc_clusters = cluster_high_gc_regions(
+            high_gc_regions, window_len, threshold, out_regions, merge_gap, flank, len(seq), name)
+    log(f"Clusters saved to {out_regions}.bed")
+
+    # plot gc profile with the clusters shaded (save in out_dir)
+    if plot:
+        log(f'\nPlotting GC profile of {name} at each position of the sequence...')
+        out_plot = f"{out_dir}/{name}_gc_profile"
+        with stage("render", target=name):
+            plot_gc_profile(gc_perc, seq, window_len, which_strand, out_plot, high_gc_clusters)
+        log(f'GC profile plot saved as {out_plot}.png and {out_plot}.pdf')
+
+
+def gc_profile_target_summary(name, seq, *args):
+    """
+    Run gc_profile_target_run and report success or failure instead of raising
+    Output: dict with name, status ('ok' or 'failed'), error message and the
+            stages timed for this target (so worker processes can pass them back)
+    """
+    first_stage = len(STAGES)
+    try:
+        gc_profile_target_run(name, seq, *args)
+        return {"name": name, "status": "ok", "error": "", "stages": STAGES[first_stage:]}
+    except Exception as e:
+        log(f"Error running gc profile of {name}: {e}", level=QUIET)
+        return {"name": name, "status": "failed", "error": str(e), "stages": STAGES[first_stage:]}
+
+
+def unique_target_names(names):
+    """
+    Make target names unique so no two targets write to the same output files
+    Repeated names get the first free _2, _3, ... suffix in input order, skipping
+    suffixed names that are already taken or appear later in the input
+    """
+    taken = set(names)
+    seen = set()
+    unique_names = []
+    for name in names:
+        if name in seen:
+            suffix = 2
+            while f"{name}_{suffix}" in taken:
+                suffix += 1
+            name = f"{name}_{suffix}"
+            taken.add(name)
+        seen.add(name)
+        unique_names.append(name)
+    return unique_names
+
+
+def final_gc_profile_run_command(
+        seq_file_or_meth, which_strand, window_len, threshold, circular, offset, workers=1, output_format='csv',
+        merge_gap=100, flank=100, metrics=(), cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+        out_dir=DEFAULT_OUT_DIR, plot=True, kmer_k=None):
     """
     Final gc profile run command
     Input: all parameters prepared by previous functions
-    Output: a plot of GC profile of input sequence
+           window_len may be a list of window sizes to run a window ladder
+           workers, number of processes the targets are spread over
+           output_format, 'csv' (legacy), 'npz' or 'parquet' for the GC values
+           merge_gap, flank, high GC cluster merge distance and padding (see cluster_high_gc_regions)
+           metrics, extra composition metrics written per target (see composition_profile)
+           cache_dir, GC profile cache directory, or None to disable it
+           cache_max_bytes, size bound of the GC profile cache
+           out_dir, directory the output files are written to
+           plot, False to skip the png/pdf plots (and the matplotlib import)
+           kmer_k, if given, also write the k-mer entropy and dominant k-mer of each window (see kmer_profile)
+    Output: a plot of GC profile of input sequence, and a json run report
+            (out_dir/gc_profile_run_report.json) with the time and peak memory of each stage
+            returns a list with one {name, status, error} summary per target
     """
     try:
-        df = load_seq_file_or_meth(seq_file_or_meth, which_strand)
-
-        for _, i in df.iterrows():
-            name = i["name"]
-            seq = i["seq"]
-
-            # confirm sequence length
-            print(f'\nLength of target sequence is: {len(seq)}\n')
-
-            # if circular, add first window-sized subseq to end of seq
-            if circular is True:
-                first_window_subseq = seq[0:window_len]
-                # print(f'first_window_subseq: {first_window_subseq}')
-                seq += first_window_subseq
-                print(f'Circularising the sequence. Length of target sequence is now: {len(seq)}\n')
-
-            # calculate gc content
-            print(f'Calculating GC content of {window_len}-bp subsequence at each position of the sequence...\n')
-            gc_value_list, high_gc_regions = gc_profile_calc(seq, window_len, threshold)
-
-            # plot gc profile (save in /gc_out folder)
-            print(f'Plotting GC profile of {name} at each position of the sequence...')
-            out_plot = f"./gc_out/{name}_gc_profile"
-            plot_gc_profile(gc_value_list, seq, window_len, which_strand, out_plot)
-            print(f'GC profile plot saved as {out_plot}.png and {out_plot}.pdf\n')
-
-            # create csv file of gc profile (save in /gc_out folder)
-            print(f'Generating CSV file of GC values of {name} at each position of the sequence...')
-            out_csv = f"./gc_out/{name}_gc_values"
-            create_csv_file(seq, gc_value_list, window_len, which_strand, offset, circular, out_csv)
-            print(f'GC values CSV file saved as {out_csv}.csv')
-
-            # get clustered regions where GC content is above threshold
-            print(f'\nClustering high_gc_regions above threshold that are within 100 bases from each other...')
-            print(f"threshold: {threshold}")
-            out_regions = f"./gc_out/{name}_high_gc_regions"
-            cluster_high_gc_regions(high_gc_regions, window_len, threshold, out_regions)
-            print(f"Clusters saved to {out_regions}.txt")
-
+        with stage("load"):
+            names, seqs = load_targets(seq_file_or_meth, which_strand)
     except Exception as e:
-        print(f"Error running final gc profile run command: {e}")
-        return None
\ No newline at end of file
+        log(f"Error loading targets from {seq_file_or_meth}: {e}", level=QUIET)
+        return None
+
+    names = unique_target_names(names)
+    args = (which_strand, window_len, threshold, circular, offset, output_format, merge_gap, flank, tuple(metrics),
+            cache_dir, cache_max_bytes, out_dir, plot, kmer_k)
+
+    jobs = [(name, seq) + args for name, seq in zip(names, seqs)]
+    summary = run_pooled(gc_profile_target_summary, jobs, names, workers)
+    for item in summary:
+        # stages timed in worker processes are not in this process's STAGES yet
+        STAGES.extend(record for record in item.pop("stages", []) if record["pid"] != os.getpid())
+
+    out_summary = f"{out_dir}/gc_profile_summary.tsv"
+    write_summary_tsv(summary, ["name", "status", "error"], out_summary)
+
+    failed = [item for item in summary if item["status"] != "ok"]
+    log(f'\nGC profile finished: {len(summary) - len(failed)} of {len(summary)} targets succeeded')
+    for item in failed:
+        log(f'    failed: {item["name"]}: {item["error"]}', level=QUIET)
+    log(f'Per-target summary saved to {out_summary}')
+
+    write_run_report(
+        f"{out_dir}/gc_profile_run_report.json", script="gc_profile.py", input=seq_file_or_meth,
+        window_len=window_len, workers=workers, targets=summary)
+    return summary
+
+
+def main(argv=None):
+    """
+    Command-line entry point, see `python gc_profile.py --help`
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="GC profile of a json target file, a meta_targets.tsv directory or (--stream) a FASTA file")
+    parser.add_argument("seq_file_or_meth", help="json target file, or directory holding meta_targets.tsv")
+    parser.add_argument("which_strand", choices=["sequence", "sequence_rc"])
+    parser.add_argument("window", help="window size, or comma-separated window sizes e.g. 20,50,100,500,1000")
+    parser.add_argument("threshold", type=float, help="minimum percentage of GC content of high GC regions")
+    parser.add_argument("--circular", action="store_true")
+    parser.add_argument("--offset", type=int, default=0)
+    parser.add_argument("--outdir", default=DEFAULT_OUT_DIR, help="directory for the output files")
+    parser.add_argument("--no-plot", action="store_true", help="skip the png/pdf plots")
+    parser.add_argument("--output-format", choices=["csv", "npz", "parquet"], default="csv",
+                        help="format of the GC values file")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream a FASTA (plain or .gz) or plain sequence file in fixed-size chunks "
+                             "(one window size, csv values and clusters only, no plot)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="number of processes for a meta_targets.tsv directory")
+    parser.add_argument("--merge-gap", type=int, default=100, help="merge high GC regions closer than this")
+    parser.add_argument("--flank", type=int, default=100, help="bases added to both ends of each high GC cluster")
+    parser.add_argument("--metrics", default="",
+                        help=f"comma-separated composition metrics to also write, from {','.join(COMPOSITION_METRICS)}")
+    parser.add_argument("--kmer", type=int, default=None, metavar="K",
+                        help=f"also write the K-mer entropy and dominant K-mer of each window (K up to {MAX_KMER_K})")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="GC profile cache directory")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_BYTES / 2**20)
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the GC profile cache")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the GC profile cache before running")
+    parser.add_argument("-q", "--quiet", action="store_const", dest="verbosity", const=QUIET, default=NORMAL,
+                        help="only print errors")
+    parser.add_argument("-v", "--verbose", action="store_const", dest="verbosity", const=VERBOSE,
+                        help="also print the time of every stage")
+    args = parser.parse_args(argv)
+
+    set_verbosity(args.verbosity)
+    reset_run_report()
+
+    if args.clear_cache:
+        clear_gc_cache(args.cache_dir)
+
+    window_lens = [int(w) for w in args.window.split(",")]
+    metrics = tuple(metric for metric in args.metrics.split(",") if metric)
+    if args.stream:
+        unsupported = stream_unsupported_options(window_lens, args.offset, args.output_format, metrics, args.kmer)
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --stream")
+        if args.seq_file_or_meth.endswith('.json') or os.path.isdir(args.seq_file_or_meth):
+            parser.error("--stream reads a FASTA or plain sequence file, not a json target file or directory")
+        if args.which_strand != 'sequence' and args.seq_file_or_meth.endswith('.gz'):
+            parser.error("--stream reads sequence_rc backwards, which needs an uncompressed file")
+    elif len(window_lens) > 1:
+        unsupported = ladder_unsupported_options(args.offset, args.output_format, metrics, args.kmer)
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with several window sizes")
+    os.makedirs(args.outdir, exist_ok=True)
+    if args.stream:
+        if not args.no_plot:
+            log("--stream keeps no GC values in memory, so no plot is written")
+        final_gc_profile_stream_command(
+            args.seq_file_or_meth, args.which_strand, window_lens[0], args.threshold, args.circular, args.chunk_size,
+            args.merge_gap, args.flank, args.outdir)
+        write_run_report(
+            f"{args.outdir}/gc_profile_run_report.json", script="gc_profile.py", input=args.seq_file_or_meth,
+            window_len=window_lens[0], streaming=True)
+        return 0
+
+    summary = final_gc_profile_run_command(
+        args.seq_file_or_meth,
+        args.which_strand,
+        window_lens if len(window_lens) > 1 else window_lens[0],
+        args.threshold,
+        args.circular,
+        args.offset,
+        args.workers,
+        args.output_format,
+        args.merge_gap,
+        args.flank,
+        metrics,
+        None if args.no_cache else args.cache_dir,
+        int(args.cache_max_mb * 2**20),
+        args.outdir,
+        not args.no_plot,
+        args.kmer)
+
+    # non-zero exit status if any target failed
+    if summary is None or any(item["status"] != "ok" for item in summary):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    sys.exit(main())
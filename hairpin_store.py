@@ -0,0 +1,201 @@
+"""
+Indexed store of RNALfold hairpins, for positional and energy range queries
+
+The hairpins of a .lfold file (see rnalfold_parser.write_hairpins) are held in
+numpy arrays sorted by start, with a second order sorted by energy, and can be
+saved to / loaded from one .npz file, so they are not re-read and re-sorted for
+every question:
+
+    index = HairpinIndex.open("RNALfold_HBB_sorted_by_pos.lfold")   (or a saved .npz)
+    index.query(100, 250, max_energy=-5)     hairpins overlapping [100, 250] with ΔG <= -5
+    index.most_stable(20, 100, 250)          the 20 most stable hairpins overlapping [100, 250]
+    index.below(-10)                         every hairpin with ΔG <= -10, most stable first
+    index.join_clusters(clusters)            hairpins overlapping each high GC cluster
+
+Hairpins overlap each other, but none is longer than the longest one (at most the
+maximum base pair span), so the hairpins overlapping a range all start in
+[start - max_len + 1, end]: two binary searches, O(log n), and a filter on the
+candidates. Positions are 1-based and inclusive, as RNALfold prints them; high
+GC clusters (gc_profile.HighGCClusterIndex, cluster_high_gc_regions .bed files)
+are 0-based and half-open, and are converted in join_clusters. Both must refer
+to the same strand of the same sequence.
+
+    Usage:  python hairpin_store.py LFOLD_OR_NPZ [--range START END] [--max-energy X] [--top N]
+                                    [--clusters BED] [--save NPZ]
+"""
+
+import sys
+
+import numpy
+
+from rnalfold_parser import Hairpin, read_hairpins
+
+
+class HairpinIndex:
+    """
+    Hairpins sorted by (start, end), with their energy order and the longest hairpin length
+    """
+
+    def __init__(self, structures, energies, starts, ends):
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+        order = numpy.lexsort((ends, starts))
+        self.structures = numpy.asarray(structures, dtype=str)[order]
+        self.energies = numpy.asarray(energies, dtype=numpy.float64)[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        # stable sort: equal energies stay in position order, as rnalfold_parser.energy_key
+        self.energy_order = numpy.argsort(self.energies, kind="stable")
+        self.sorted_energies = self.energies[self.energy_order]
+        self.max_len = int((self.ends - self.starts).max()) + 1 if len(self.starts) else 0
+
+    @classmethod
+    def from_hairpins(cls, hairpins):
+        """
+        Index of any iterable of Hairpin records
+        """
+        hairpins = list(hairpins)
+        return cls([h.structure for h in hairpins], [h.energy for h in hairpins],
+                   [h.start for h in hairpins], [h.end for h in hairpins])
+
+    @classmethod
+    def load(cls, npz_file):
+        """
+        Load an index written by save()
+        """
+        with numpy.load(npz_file, allow_pickle=False) as data:
+            return cls(data["structures"], data["energies"], data["starts"], data["ends"])
+
+    @classmethod
+    def open(cls, file):
+        """
+        Index of a saved .npz index, or of a .lfold file written by hairpins_rnalfold.py
+        """
+        if file.endswith(".npz"):
+            return cls.load(file)
+        return cls.from_hairpins(read_hairpins(file))
+
+    def save(self, npz_file):
+        """
+        Save the index as .npz (loaded without re-sorting the text file)
+        """
+        numpy.savez(npz_file, structures=self.structures, energies=self.energies, starts=self.starts,
+                    ends=self.ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return Hairpin(str(self.structures[i]), float(self.energies[i]), int(self.starts[i]), int(self.ends[i]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def overlapping(self, start, end=None, max_energy=None):
+        """
+        Indices of hairpins overlapping position start, or range [start, end] (1-based, inclusive)
+        max_energy, if given, keeps only hairpins with ΔG <= max_energy
+        Output: numpy array of hairpin indices, in position order
+        """
+        if end is None:
+            end = start
+        first = numpy.searchsorted(self.starts, start - self.max_len + 1, side="left")
+        last = numpy.searchsorted(self.starts, end, side="right")
+        hits = numpy.arange(first, max(first, last))
+        keep = self.ends[hits] >= start
+        if max_energy is not None:
+            keep &= self.energies[hits] <= max_energy
+        return hits[keep]
+
+    def query(self, start, end=None, max_energy=None):
+        """
+        Hairpins overlapping position start, or range [start, end], optionally with ΔG <= max_energy
+        Output: list of Hairpin records, in position order
+        """
+        return [self[i] for i in self.overlapping(start, end, max_energy)]
+
+    def most_stable(self, n, start=None, end=None, max_energy=None):
+        """
+        The n most stable hairpins overlapping [start, end] (default: the whole sequence)
+        max_energy, if given, keeps only hairpins with ΔG <= max_energy
+        Output: list of at most n Hairpin records, most stable first
+        """
+        if start is None:
+            return self.below(numpy.inf if max_energy is None else max_energy, n)
+        hits = self.overlapping(start, end, max_energy)
+        # hits are in position order, so a stable sort breaks energy ties by position
+        return [self[i] for i in hits[numpy.argsort(self.energies[hits], kind="stable")[:n]]]
+
+    def below(self, max_energy, n=None):
+        """
+        Every hairpin (or the n most stable) with ΔG <= max_energy, one binary search on the energy order
+        Output: list of Hairpin records, most stable first
+        """
+        n_below = numpy.searchsorted(self.sorted_energies, max_energy, side="right")
+        n = n_below if n is None else min(n, n_below)
+        return [self[i] for i in self.energy_order[:n]]
+
+    def join_clusters(self, clusters, max_energy=None):
+        """
+        Overlap join with high GC clusters
+        Input: clusters, a gc_profile.HighGCClusterIndex, or (start, end) pairs, 0-based and half-open
+               max_energy, if given, keeps only hairpins with ΔG <= max_energy
+        Output: list of ((cluster_start, cluster_end), Hairpin), by cluster then hairpin position
+        """
+        pairs = []
+        for cluster_start, cluster_end in clusters:
+            # [cluster_start, cluster_end) is [cluster_start + 1, cluster_end] in 1-based inclusive positions
+            for i in self.overlapping(cluster_start + 1, cluster_end, max_energy):
+                pairs.append(((cluster_start, cluster_end), self[i]))
+        return pairs
+
+
+def main(argv=None):
+    """
+    Command-line entry point, see `python hairpin_store.py --help`
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the hairpins of a .lfold file (or a saved .npz index)")
+    parser.add_argument("hairpins", help=".lfold file written by hairpins_rnalfold.py, or .npz saved with --save")
+    parser.add_argument("--range", nargs=2, type=int, metavar=("START", "END"),
+                        help="only hairpins overlapping [START, END] (1-based, inclusive)")
+    parser.add_argument("--max-energy", type=float, default=None, help="only hairpins with ΔG <= this value")
+    parser.add_argument("--top", type=int, default=None, help="only the N most stable hairpins")
+    parser.add_argument("--clusters", default=None,
+                        help="high GC cluster .bed file (cluster_high_gc_regions): hairpins overlapping each cluster")
+    parser.add_argument("--save", default=None, help="save the index to this .npz file")
+    args = parser.parse_args(argv)
+
+    index = HairpinIndex.open(args.hairpins)
+    if args.save:
+        index.save(args.save)
+        print(f'Index of {len(index)} hairpins saved to {args.save}')
+
+    if args.clusters:
+        # imported here, so queries without clusters do not import gc_profile
+        from gc_profile import HighGCClusterIndex
+
+        for (cluster_start, cluster_end), hairpin in index.join_clusters(
+                HighGCClusterIndex.from_bed(args.clusters), args.max_energy):
+            print(f'{cluster_start}\t{cluster_end}\t{hairpin.structure}\t{hairpin.energy:.2f}\t'
+                  f'{hairpin.start}\t{hairpin.end}')
+        return 0
+
+    start, end = args.range if args.range else (None, None)
+    if args.top is not None:
+        hairpins = index.most_stable(args.top, start, end, args.max_energy)
+    elif start is not None:
+        hairpins = index.query(start, end, args.max_energy)
+    elif args.max_energy is not None:
+        hairpins = index.below(args.max_energy)
+    else:
+        hairpins = list(index)
+
+    for hairpin in hairpins:
+        print(f'{hairpin.structure} {hairpin.energy:.2f}  {hairpin.start}-{hairpin.end}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,81 +3,301 @@ Version 1
 08/11/2023 by Kavitha Krishna Sudhakar
 
 This script uses Vienna Suite's RNAlfold to analyse hairpins in the input sequence.
-Vienna output is parsed
+Vienna output is parsed (rnalfold_parser.py), sorted by position and saved, and the
+most stable hairpins are printed.
+
+Long sequences can be folded in overlapping chunks over several processes
+(--chunk-len, --workers); local folding with a maximum base pair span only sees
+span bases, so the merged hairpins are the same as from one fold of the whole
+sequence. The folding backend is a function fold(seq, span) -> RNALfold text,
+so another RNALfold (or a stand-in) can be plugged in.
+
+Batch mode: SEQ_FILE may also be a multi-record FASTA file or a directory holding
+meta_targets.tsv (the layout gc_profile.py reads). Every record is folded, over
+--workers processes, into OUTDIR/RNALfold_<name>_sorted_by_pos.lfold, with a
+per-record summary in OUTDIR/hairpin_summary.tsv. Parsed fold results are cached
+on disk, keyed by a hash of the sequence, the span and the backend, so a rerun
+only folds the records that changed.
+
+    Usage:  python hairpins_rnalfold.py SEQ_FILE [--span 50] [--top 20] [--chunk-len N --workers W]
+            python hairpins_rnalfold.py FASTA_OR_DIR [--span 50] [--workers W] [--outdir DIR] [--no-cache]
 
 '''
 
 
-import sys
 import os
-import json
+import sys
+import time
+import hashlib
 
-from lib.vienna_api_class import ViennaAPI
+from batch_runner import atomic_write, run_pooled, write_summary_tsv
+from rnalfold_parser import parse_rnalfold, sort_hairpins, most_stable_hairpins, write_hairpins, read_hairpins
+from run_report import NORMAL, QUIET, VERBOSE, log, set_verbosity
 
-if __name__ == '__main__':
 
-    # initialise viennaAPI class object
-    vienna_api = ViennaAPI()
+def vienna_rnalfold(seq, span):
+    """
+    Folding backend: RNALfold through the ViennaAPI class of lib/
+    Output: RNALfold output text
+    """
+    # imported here, so the module can be used without ViennaRNA
+    from lib.vienna_api_class import ViennaAPI
+
+    return ViennaAPI().RNALfold(seq, span)[0]
+
+
+def rnalfold_command(seq, span):
+    """
+    Folding backend: the RNALfold program of the ViennaRNA package, on the PATH
+    Output: RNALfold output text
+    """
+    import subprocess
+
+    result = subprocess.run(
+        ["RNALfold", "-L", str(span), "--noPS"], input=seq + "\n", capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+FOLD_BACKENDS = {'vienna': vienna_rnalfold, 'rnalfold': rnalfold_command}
+
+
+def sequence_chunks(seq_len, chunk_len, margin):
+    """
+    Splits [0, seq_len) into chunks that are folded separately
+    Each chunk keeps the hairpins starting in its own chunk_len bases, and is folded
+    with margin extra bases on both sides, so every kept hairpin sees the same
+    sequence as in a fold of the whole sequence
+    Output: list of (fold_start, fold_end, keep_start, keep_end), 0-based, ends exclusive
+    """
+    chunks = []
+    for keep_start in range(0, seq_len, chunk_len):
+        keep_end = min(keep_start + chunk_len, seq_len)
+        chunks.append((max(keep_start - margin, 0), min(keep_end + margin, seq_len), keep_start, keep_end))
+    return chunks
+
+
+def fold_chunk(backend, seq, span, fold_start, keep_start, keep_end):
+    """
+    Folds one chunk and shifts its hairpins back to whole-sequence coordinates
+    Input: seq, the chunk sequence (seq[fold_start:fold_end] of the whole sequence)
+    Output: list of Hairpin records whose 0-based start is in [keep_start, keep_end)
+    """
+    return [
+        hairpin for hairpin in parse_rnalfold(backend(seq, span), offset=fold_start)
+        if keep_start < hairpin.start <= keep_end
+    ]
+
 
-    SEQ_FILE = sys.argv[1]
+def fold_hairpins(seq, span, backend=vienna_rnalfold, chunk_len=None, workers=1, margin=None):
+    """
+    Hairpins of a sequence, folded in one piece or in overlapping chunks
+    Input: seq, the sequence
+           span, maximum base pair span
+           backend, fold(seq, span) -> RNALfold output text (a module-level function when workers > 1)
+           chunk_len, bases kept per chunk (None: fold the whole sequence at once)
+           workers, number of processes the chunks are folded in
+           margin, bases folded on both sides of each chunk (at least span; default 2 * span)
+    Output: list of Hairpin records sorted by position (1-based, as RNALfold)
+    """
+    if chunk_len is None or chunk_len >= len(seq):
+        return sort_hairpins(parse_rnalfold(backend(seq, span)), by='position')
 
-    seq_file = open(SEQ_FILE)
-    # sequences = json.load(seq_file)
-    # seq = sequences['sequence']
-    seq = seq_file.readline()
+    margin = max(margin or 2 * span, span)
+    chunks = sequence_chunks(len(seq), chunk_len, margin)
+    jobs = [(backend, seq[fold_start:fold_end], span, fold_start, keep_start, keep_end)
+            for fold_start, fold_end, keep_start, keep_end in chunks]
 
-    # print(seq)
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
 
-    lfold_result = vienna_api.RNALfold(seq, 50)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_hairpins = list(executor.map(fold_chunk, *zip(*jobs)))
+    else:
+        chunk_hairpins = [fold_chunk(*job) for job in jobs]
 
-    vienna_result = lfold_result[0].split('\n')
+    # each start belongs to one chunk; identical records are dropped all the same
+    merged = set()
+    for hairpins in chunk_hairpins:
+        merged.update(hairpins)
+    return sort_hairpins(merged, by='position')
 
 
-    del vienna_result[-1]
-    del vienna_result[-1]
-    del vienna_result[-1]
+# content-addressed cache of parsed fold results, so reruns only fold changed sequences
+DEFAULT_FOLD_CACHE_DIR = './fold_cache'
+DEFAULT_BATCH_OUT_DIR = './hairpin_out'
+HAIRPIN_SUMMARY_FIELDS = ["name", "status", "length", "hairpins", "cached", "seconds", "lfold", "error"]
 
-    # print("======================after deleting=====================")
-    # print(vienna_result)
 
-    # create new file to copy lfold results into
-    filename = "RNALfold_" + SEQ_FILE + '.lfold'
-    lfold_result_file = open(filename, 'w')
+def fold_cache_key(seq, span, backend):
+    """
+    Hash of everything the hairpins depend on: sequence, maximum span and folding backend
+    (chunking does not change the hairpins, so it is not part of the key)
+    Output: hex digest used as the cache file name
+    """
+    digest = hashlib.sha256()
+    digest.update(seq.encode("ascii"))
+    digest.update(f"|{span}|{backend.__module__}.{backend.__qualname__}".encode())
+    return digest.hexdigest()
 
-    # split each line of lfold result and remove blank spcaes and brackets
-    for i in range(len(vienna_result)):
-        vienna_split = vienna_result[i].split()
-        # print(vienna_split)
 
-        # each vienna_split should have 3 elements
-        # as deltaG < '( -9.9)' introduces an unwanted blank space
-        if len(vienna_split) == 4:
-            if vienna_split[1] == '(':
-                del vienna_split[1]
+def cached_fold_hairpins(seq, span, backend=vienna_rnalfold, chunk_len=None, workers=1,
+                         cache_dir=DEFAULT_FOLD_CACHE_DIR):
+    """
+    fold_hairpins(), read from the fold cache when available
+    Input: cache_dir, fold cache directory, or None to disable the cache
+           other inputs as fold_hairpins
+    Output: (hairpins, cached), the hairpins sorted by position and whether they came from the cache
+    """
+    if cache_dir is None:
+        return (fold_hairpins(seq, span, backend, chunk_len, workers), False)
 
-        # print (vienna_split)
+    cache_file = os.path.join(cache_dir, fold_cache_key(seq, span, backend) + '.lfold')
+    try:
+        return (list(read_hairpins(cache_file)), True)
+    except (OSError, ValueError):
+        pass
 
-        # extract lfold elements of each line 
-        lfold_dot_bracket_notation = vienna_split[0]
-        lfold_free_energy = vienna_split[1].strip('(').strip(')').strip()
-        lfold_start_pos = vienna_split[2]
+    hairpins = fold_hairpins(seq, span, backend, chunk_len, workers)
+    try:
+        atomic_write(cache_file, lambda tmp_file: write_hairpins(hairpins, tmp_file))
+    except OSError as e:
+        log(f"Could not write fold cache entry {cache_file}: {e}", level=QUIET)
+    return (hairpins, False)
 
-        # print (lfold_dot_bracket_notation, lfold_free_energy, lfold_start_pos)
 
-        # saving lfold results to file
-        lfold_result_file.write('{} {}  {}\n'.format(lfold_dot_bracket_notation, lfold_free_energy, lfold_start_pos))
+def load_hairpin_records(seq_file):
+    """
+    Records of a multi-record FASTA file or of a directory holding meta_targets.tsv
+    (the seq column, as gc_profile.load_targets reads it)
+    Output: (names, seqs), a list of unique names and a list of sequence strings
+    """
+    # imported here, so single-sequence runs do not need numpy and pandas
+    from gc_profile import PackedSequence, load_targets, read_fasta_records, unique_target_names
 
-    
-    # sorting lfold results file by highest delta G to lowest delta G
-    # os.system('seq_file=SEQ_FILE')
-    print('\n=================================== SORTING RNALFOLD LINES =====================================\n')
-    # os.system('touch RNALfold_result_sorted.lfold')
-    # os.system('cat - RNALfold_STAT3_sequence.txt.lfold | sort -n -k3 > RNALfold_result_sorted.lfold')
-    os.system('sort -n -k3 RNALfold_STAT3_plus_GH17J042386.txt.lfold > RNALfold_STAT3_plus_GH17J042386_sorted_by_pos.lfold')
-    os.system('head -n 237 RNALfold_STAT3_plus_GH17J042386_sorted_by_pos.lfold | sort -n -k2')
-    
+    if os.path.isdir(seq_file):
+        names, seqs = load_targets(seq_file, 'sequence')
+        # missing sequences (empty cells) are reported as failed records
+        seqs = [str(seq) if isinstance(seq, PackedSequence) else '' for seq in seqs]
+    else:
+        names, seqs = [], []
+        for name, seq in read_fasta_records(seq_file):
+            names.append(name)
+            seqs.append(seq)
+    return (unique_target_names([str(name) for name in names]), seqs)
 
 
+def is_batch_input(seq_file):
+    """
+    True for a directory (meta_targets.tsv) or a FASTA file, False for a one-line sequence file
+    """
+    if os.path.isdir(seq_file):
+        return True
+    from gc_profile import is_fasta_file
 
+    if is_fasta_file(seq_file):
+        return True
+    with open(seq_file) as f:
+        return f.read(1) == '>'
 
 
+def fold_record_summary(name, seq, span, backend, chunk_len, cache_dir, out_dir):
+    """
+    Folds one record of a batch (or reads it from the cache) and saves its hairpins
+    Output: dict summary (see HAIRPIN_SUMMARY_FIELDS); failures are reported, not raised
+    """
+    start_time = time.time()
+    summary = {"name": name, "status": "failed", "length": len(seq), "hairpins": "", "cached": "",
+               "seconds": 0, "lfold": "", "error": ""}
+    try:
+        if not seq:
+            raise ValueError("empty sequence")
+        hairpins, cached = cached_fold_hairpins(seq, span, backend, chunk_len, 1, cache_dir)
+        lfold_file = os.path.join(out_dir, f"RNALfold_{name}_sorted_by_pos.lfold")
+        summary.update(status="ok", hairpins=write_hairpins(hairpins, lfold_file), cached=cached, lfold=lfold_file)
+    except Exception as e:
+        summary["error"] = f'{type(e).__name__}: {e}'
+    summary["seconds"] = round(time.time() - start_time, 3)
+    return summary
+
+
+def fold_hairpins_batch(names, seqs, span, backend=vienna_rnalfold, chunk_len=None, workers=1,
+                        cache_dir=DEFAULT_FOLD_CACHE_DIR, out_dir=DEFAULT_BATCH_OUT_DIR):
+    """
+    Folds every record of a batch over a pool of worker processes
+    Input: names, seqs, the records (names must be unique, see gc_profile.unique_target_names)
+           workers, number of records folded at the same time
+           cache_dir, fold cache directory, or None to disable it
+           out_dir, directory the .lfold files and hairpin_summary.tsv are written to
+           other inputs as fold_hairpins
+    Output: list with one summary dict per record, in input order
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(name, seq, span, backend, chunk_len, cache_dir, out_dir) for name, seq in zip(names, seqs)]
+
+    summary = run_pooled(fold_record_summary, jobs, names, workers)
+
+    out_summary = os.path.join(out_dir, "hairpin_summary.tsv")
+    write_summary_tsv(summary, HAIRPIN_SUMMARY_FIELDS, out_summary)
+
+    failed = [item for item in summary if item["status"] != "ok"]
+    n_folded = sum(1 for item in summary if item["status"] == "ok" and not item["cached"])
+    log(f'Hairpins of {len(summary) - len(failed)} of {len(summary)} records saved to {out_dir} '
+        f'({n_folded} folded, {len(summary) - len(failed) - n_folded} from the fold cache)')
+    for item in failed:
+        log(f'    failed: {item["name"]}: {item["error"]}', level=QUIET)
+    log(f'Per-record summary saved to {out_summary}')
+    return summary
+
+
+def main(argv=None):
+    """
+    Command-line entry point, see `python hairpins_rnalfold.py --help`
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hairpins of a sequence with Vienna Suite's RNALfold")
+    parser.add_argument("seq_file", help="file whose first line is the sequence; or, for a batch, "
+                                         "a multi-record FASTA file or a directory holding meta_targets.tsv")
+    parser.add_argument("--span", type=int, default=50, help="maximum base pair span (RNALfold -L)")
+    parser.add_argument("--top", type=int, default=20, help="number of most stable hairpins to print")
+    parser.add_argument("--backend", choices=sorted(FOLD_BACKENDS), default="vienna",
+                        help="vienna: lib/vienna_api_class.py; rnalfold: the RNALfold program")
+    parser.add_argument("--chunk-len", type=int, default=None,
+                        help="fold in overlapping chunks of this many bases (default: the whole sequence at once)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the chunks (or, for a batch, the records) are folded in")
+    parser.add_argument("--outdir", default=DEFAULT_BATCH_OUT_DIR, help="batch output directory")
+    parser.add_argument("--cache-dir", default=DEFAULT_FOLD_CACHE_DIR, help="fold cache directory (batch mode)")
+    parser.add_argument("--no-cache", action="store_true", help="fold every record, without the fold cache")
+    parser.add_argument("-q", "--quiet", action="store_const", dest="verbosity", const=QUIET, default=NORMAL,
+                        help="only print errors")
+    parser.add_argument("-v", "--verbose", action="store_const", dest="verbosity", const=VERBOSE,
+                        help="also print debugging output")
+    args = parser.parse_args(argv)
+    set_verbosity(args.verbosity)
+
+    if is_batch_input(args.seq_file):
+        names, seqs = load_hairpin_records(args.seq_file)
+        summary = fold_hairpins_batch(
+            names, seqs, args.span, FOLD_BACKENDS[args.backend], args.chunk_len, args.workers,
+            None if args.no_cache else args.cache_dir, args.outdir)
+        return 0 if all(item["status"] == "ok" for item in summary) else 1
+
+    with open(args.seq_file) as seq_file:
+        seq = seq_file.readline().strip()
+
+    hairpins = fold_hairpins(seq, args.span, FOLD_BACKENDS[args.backend], args.chunk_len, args.workers)
+
+    # saving lfold results, sorted by position, to file
+    filename = "RNALfold_" + os.path.basename(args.seq_file) + '_sorted_by_pos.lfold'
+    n_hairpins = write_hairpins(hairpins, filename)
+    log(f'{n_hairpins} RNALfold hairpins saved to {filename}')
+
+    log(f'\n=================================== {args.top} MOST STABLE HAIRPINS =====================================\n')
+    for hairpin in most_stable_hairpins(hairpins, args.top):
+        log(f'{hairpin.structure} {hairpin.energy:.2f}  {hairpin.start}-{hairpin.end}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
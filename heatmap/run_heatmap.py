@@ -2,8 +2,9 @@
 This is the top 'wrapper' script for the heatmap module
 All user interaction occurs here, to protect the code from unintended meddling
 Usage: 'python3 run_heatmap.py <experiment name>'
-    # nb: if using Docker, instead use: 
-    docker run -v ${PWD}:/src --rm -t heatmap python3 run_heatmap.py <data>
+       'python3 run_heatmap.py <experiments.tsv or experiments.json>' (batch mode, see src/heatmap_batch.py)
+    # nb: if using Docker, instead use (from the heatmap directory, which holds every module it needs):
+    cd heatmap && docker run -v ${PWD}:/src --rm -t heatmap python3 run_heatmap.py <data>
 
 """
 
@@ -13,6 +14,7 @@ import time
 
 sys.path.append('./src/') # This is so we have access to the other scripts
 from heatmap import final_heatmap_run_command
+from run_report import QUIET, NORMAL, VERBOSE, log, set_verbosity
 
 ############################################################
 # Adjust input parameters here #############################
@@ -32,6 +34,21 @@ Y_AXIS_TICKS = 20
 # COL_NAMES = "1, 2, 3" # SV40_short_test_file2"
 # todo automate
 
+# heatmap renderer: "python" (in-process, no R needed) or "r" (Rscript with ComplexHeatmap)
+RENDERER = "python"
+
+# long targets: pool rows ("mean" or "min" per bin) to at most this many heatmap rows
+# (None: one row per target position)
+HEATMAP_MAX_ROWS = None
+ROW_POOLING = "mean"
+
+# console output: QUIET (errors only), NORMAL, or VERBOSE (also the target sequence and stage times)
+# the time and peak memory of each stage are always saved in out/heatmap_run_report_<experiment>.json
+VERBOSITY = NORMAL
+
+# batch mode: number of experiments run at the same time
+BATCH_WORKERS = 4
+
 # dummy/test data files (only relevant if running code from IDE not from terminal)
 DEBUG_MODE = 'Terminal'
 # DEBUG_MODE = 'Interactive' # use this to run from IDE like VSCode
@@ -46,24 +63,35 @@ if __name__ == "__main__":
     START_TIME_TOTAL = time.time()
 
     MODULE_NAME = "heatmap.py"
+    set_verbosity(VERBOSITY)
 
     # Where to find the input CSV files?
     len_args = len(sys.argv)
     for i in range(len_args):
-        print(f'i: {i}; sys.argv[{i}]: {sys.argv[i]}')
+        log(f'i: {i}; sys.argv[{i}]: {sys.argv[i]}', level=VERBOSE)
 
     # Normal mode is to run via Terminal
     if DEBUG_MODE == 'Terminal':
         INPUT_DIR_NAME = sys.argv[1]
     elif DEBUG_MODE == 'Interactive':
         pass
-    print(f'Debug: running in {DEBUG_MODE} mode; will use test data in {INPUT_DIR_NAME} directory')
+    log(f'Debug: running in {DEBUG_MODE} mode; will use test data in {INPUT_DIR_NAME} directory')
 
     if not os.path.exists(INPUT_DIR_NAME):
         raise FileNotFoundError("Can't find INPUT_DIR_NAME (argv[1]): {INPUT_DIR_NAME}")
 
     os.system("mkdir -p out")
 
+    # Batch mode: argv[1] is a manifest of experiments instead of an input directory
+    if os.path.isfile(INPUT_DIR_NAME):
+        from heatmap_batch import run_heatmap_batch
+
+        run_heatmap_batch(INPUT_DIR_NAME, workers=BATCH_WORKERS)
+
+        ELAPSED_TIME_TOTAL = time.time() - START_TIME_TOTAL
+        log(f'\n>>> Total Elapsed time for {MODULE_NAME}: {ELAPSED_TIME_TOTAL:.4f} sec ({ELAPSED_TIME_TOTAL:.2E})')
+        sys.exit(0)
+
     (csv_file_name, r_script_name, heatmap_pdf_name) = \
         final_heatmap_run_command(
         MODULE_NAME,
@@ -71,16 +99,19 @@ if __name__ == "__main__":
         TARGET_NAME,
         INPUT_DIR_NAME,
         Y_AXIS_LAB,
-        Y_AXIS_TICKS
+        Y_AXIS_TICKS,
+        renderer=RENDERER,
+        max_heatmap_rows=HEATMAP_MAX_ROWS,
+        row_pooling=ROW_POOLING
     )
 
     check_pdf_size = os.path.getsize(heatmap_pdf_name)
     if check_pdf_size < 10000 :
-        print(f'Expecting larger PDF size (PDF is {check_pdf_size/1000} KB). Check RScript in "/out" for any issues.')
+        log(f'Expecting larger PDF size (PDF is {check_pdf_size/1000} KB). Check {r_script_name or "the output"} in "/out" for any issues.', level=QUIET)
     else :
-        print('Successfuly generated heatmaps and stored in "/out".')
+        log('Successfuly generated heatmaps and stored in "/out".')
 
     END_TIME_TOTAL = time.time()
     ELAPSED_TIME_TOTAL = END_TIME_TOTAL - START_TIME_TOTAL
-    print(f'\n>>> Total Elapsed time for {MODULE_NAME}: {ELAPSED_TIME_TOTAL:.4f} sec ({ELAPSED_TIME_TOTAL:.2E})')
-    print(40 * '-' + '\n')
+    log(f'\n>>> Total Elapsed time for {MODULE_NAME}: {ELAPSED_TIME_TOTAL:.4f} sec ({ELAPSED_TIME_TOTAL:.2E})')
+    log(40 * '-' + '\n')
@@ -22,21 +22,35 @@ FUNCTION 2: run_prepare_heatmap_files (return: probe_array)
         Opens each csv file
         Extracts the relevant ΔG column
         Writes that ΔG column into a new csv file
+        (extracted columns are cached per input file in out/extraction_cache;
+        a rerun only parses csv files that are new or changed)
     output: new CSV file containing the relevant ΔG columns from each separate BoAB Finder file
 
 FUNCTION 3: final_heatmap_run_command
 4. Final function, which is called from run_heatmap.py code
     input: returns from previous 3 functions and other inputs specified in run_heatmaps.py
-    output: R, csv and heatmap pdf files
+    output: csv and heatmap pdf files, rendered in Python (heatmap_renderer.py) or by an R script
 
 
 """
 
 import os
 import csv
+import hashlib
+import io
 import json
 import pathlib
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+import pandas as pd
+
+# target_json, batch_runner and run_report are copies of the modules at the top of the repository
+# (shared with gc_profile.py), so heatmap/ runs on its own, e.g. mounted alone in Docker
+from target_json import load_json_key, load_json_key_length
+from batch_runner import atomic_write
+from run_report import QUIET, VERBOSE, log, reset_run_report, stage, write_run_report
 
 
 def sorted_nicely(alpha_num_list):
@@ -61,57 +75,169 @@ def determine_target_length_and_seq(
     Input: file is your chosen target file in json format
     Returns: list containing tuples (len_target, target sequence)
     """
-    with open(file, 'r') as local_file:
-        json_data = json.load(local_file)
-    len_target = len(json_data["sequence"])
-    target_sequence = json_data["sequence"]
-    print(f'Target sequence is: {target_sequence}')
+    target_sequence = load_json_key(file, "sequence")
+    len_target = len(target_sequence)
+    log(f'Target sequence is: {target_sequence}', level=VERBOSE)
     return (len_target, target_sequence)
 
 
+# Per-input-directory cache of what was extracted from each input file, so a rerun
+# only parses files that are new or changed. The manifest records the size, mtime
+# and sha256 of every file; the extracted columns are stored as <sha256>.npz
+EXTRACTION_CACHE_VERSION = 1
+
+
+def file_sha256(file_name, block_size=1 << 20):
+    """
+    sha256 hex digest of the content of a file
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extraction_manifest_file(cache_dir, input_dir_name):
+    """
+    Path of the manifest of one input directory inside cache_dir
+    """
+    dir_key = hashlib.sha256(os.path.abspath(input_dir_name).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'manifest_{dir_key}.json')
+
+
+def load_extraction_manifest(cache_dir, input_dir_name):
+    """
+    Loads the manifest of input_dir_name
+    Returns: dict {file name: record}; empty when there is no (valid) manifest yet
+    """
+    if cache_dir is None:
+        return {}
+    try:
+        with open(extraction_manifest_file(cache_dir, input_dir_name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != EXTRACTION_CACHE_VERSION:
+        return {}
+    return manifest['files']
+
+
+def save_extraction_manifest(cache_dir, input_dir_name, files):
+    """
+    Writes the manifest of input_dir_name (batch_runner.atomic_write)
+    """
+    if cache_dir is None:
+        return
+    manifest_file = extraction_manifest_file(cache_dir, input_dir_name)
+
+    def write(tmp_file):
+        with open(tmp_file, 'w') as w:
+            json.dump({'version': EXTRACTION_CACHE_VERSION, 'input_dir': os.path.abspath(input_dir_name),
+                       'files': files}, w, indent=1)
+
+    try:
+        atomic_write(manifest_file, write)
+    except OSError as e:
+        log(f'Could not write extraction cache manifest {manifest_file}: {e}', level=QUIET)
+
+
+def cached_record(files, full_file_name):
+    """
+    Record of full_file_name in the manifest if the file is unchanged, else None
+
+    Size and mtime are checked first; if either differs, the content hash decides,
+    so a file that was only touched or copied is not parsed again
+    Returns: tuple (record, sha256); sha256 is None when it was not needed
+    """
+    stat = os.stat(full_file_name)
+    record = files.get(os.path.basename(full_file_name))
+    if record is not None and record['size'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns:
+        return (record, record['sha256'])
+
+    sha256 = file_sha256(full_file_name)
+    if record is not None and record['sha256'] == sha256:
+        record = dict(record, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        files[os.path.basename(full_file_name)] = record
+        return (record, sha256)
+    return (None, sha256)
+
+
+def new_record(full_file_name, sha256, **extracted):
+    """
+    Manifest record of a freshly parsed file
+    """
+    stat = os.stat(full_file_name)
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256, **extracted)
+
+
+def list_target_json_files(dir_name):
+    """
+    Target files of a directory: json files with 'target' in their name
+    (hidden files skipped), in sorted_nicely order
+    """
+    target_files = []
+
+    # iterative search through directory, looking for .json files with search string 'target'
+    for which_file in sorted_nicely(os.listdir(dir_name)):
+        # skip hidden files (startswith ".")
+        if which_file.startswith('.'):
+            continue
+
+        # skip non-.json files
+        file_extension = pathlib.Path(which_file).suffix
+        if file_extension != '.json':
+            continue
+
+        search_string = "target"
+        if search_string not in which_file:
+            continue
+
+        # joining path to easily identify it
+        full_json_file_name = os.path.join(dir_name, which_file)
+        assert os.path.exists(full_json_file_name), print(f'Cannot find file: {full_json_file_name}')
+        target_files.append(full_json_file_name)
+
+    return target_files
+
+
 def find_target_file(
-    dir_name
+    dir_name,
+    cache_dir = None
     ):
     """
     Iterates through a directory, and determines length of target(s) from the json file(s)
 
     Input: dir_name is directory holding target files in json format
+    - cache_dir: extraction cache directory (None: always read the json files)
     Returns: list containing tuples(file_name, len_target)
     """
-    print(f'\nStep 1: Determining the length of target used from json target file in {dir_name}')
+    log(f'\nStep 1: Determining the length of target used from json target file in {dir_name}')
     assert os.path.exists(dir_name), f"Can't find directory of input files in {dir_name}"
 
     # initialise list_of_file_and_length to hold the info to be returned
     list_of_file_and_length = []
+    cached_files = load_extraction_manifest(cache_dir, dir_name)
 
-    # iterative search through directory, looking for .json files with search string 'target'
-    # for which_file in sorted(os.listdir(dir_name)):
-    for which_file in sorted_nicely(os.listdir(dir_name)):
-        # print(f'Debug: processing {which_file}')
-
-        # skip hidden files (startswith ".")
-        if not which_file.startswith('.'):
-
-            # skip non-.json files
-            file_extension = pathlib.Path(which_file).suffix
-            if file_extension != '.json':
-                continue
-
-            search_string = "target"
-            if search_string not in which_file:
-                continue
+    for full_json_file_name in list_target_json_files(dir_name):
+        which_file = os.path.basename(full_json_file_name)
 
-            # joining path to easily identify it
-            full_json_file_name = os.path.join(dir_name, which_file)
-            assert os.path.exists(full_json_file_name), print(f'Cannot find file: {full_json_file_name}')
+        # only the length is needed: count it without loading the sequence
+        (record, sha256) = cached_record(cached_files, full_json_file_name) if cache_dir else (None, None)
+        if record is not None and 'len_target' in record:
+            len_target = record['len_target']
+        else:
+            len_target = load_json_key_length(full_json_file_name, "sequence")
+            if cache_dir is not None:
+                cached_files[which_file] = new_record(full_json_file_name, sha256, len_target=len_target)
+        pair = [full_json_file_name, len_target]
+        list_of_file_and_length.append(pair)
 
-            len_target = determine_target_length_and_seq(full_json_file_name)[0]
-            pair = [full_json_file_name, len_target]
-            list_of_file_and_length.append(pair)
+        # temp print statement (could be removed from production version?)
+        log(f"The length of the target ({which_file}) is: {len_target}.")
+        log("Storing file name and length as variable, 'list_of_file_and_length'", level=VERBOSE)
 
-            # temp print statement (could be removed from production version?)
-            print(f"The length of the target ({which_file}) is: {len_target}.")
-            print("Storing file name and length as variable, 'list_of_file_and_length'")
+    save_extraction_manifest(cache_dir, dir_name, cached_files)
 
     # finished - make sure there was some work actually done
     if not list_of_file_and_length:
@@ -126,159 +252,235 @@ def find_target_file(
     return len_target
 
 
-def transpose_array(
-        data_array
-    ):
+def allocate_delta_g_matrix(n_rows, n_cols, memmap_file=None):
     """
-    Function to transpose columns->rows, rows->columns
+    Preallocates the ΔG matrix (rows: target positions, columns: probe files)
 
-    Input: data_array as columns
-    Returns: transposed_array which has been transposed to rows
+    Input: n_rows, n_cols, the matrix dimensions
+    - memmap_file: if given, the matrix is a disk-backed memmap at that path
+    Returns: float32 matrix filled with NaN (written as "NA")
     """
+    if memmap_file is None:
+        return numpy.full((n_rows, n_cols), numpy.nan, dtype=numpy.float32)
 
-    print(f'Reached transpose_array; Data_array is size {len(data_array)}')
+    # Fortran order: each probe column is contiguous on disk, so it is filled in one write
+    matrix = numpy.lib.format.open_memmap(
+        memmap_file, mode='w+', dtype=numpy.float32, shape=(n_rows, n_cols), fortran_order=True)
+    matrix[:] = numpy.nan
+    return matrix
 
-    # (preparatory step): set max_row and max_col to 0 to ensure dim > 0,0
-    max_row = 0
-    max_col = 0
 
-    # determine the dimensions of input matrix
-    for nrow, row in enumerate(data_array):
-        if nrow > max_row:
-            max_row = nrow
+def remove_delta_g_memmap(out):
+    """
+    Deletes the disk-backed ΔG matrix of prepare_heatmap (out + '.npy'), if there is one,
+    once the heatmap csv and pdf are written
+    """
+    if os.path.exists(out + '.npy'):
+        os.remove(out + '.npy')
 
-        for ncol, col in enumerate(row):
-            if ncol > max_col:
-                max_col = ncol
 
-    print(f'max_row: {max_row}; max_col: {max_col}')
+def save_delta_g_matrix_to_csv(col_names, matrix, out, block_rows=1 << 16):
+    """
+    Receives the ΔG matrix
+    Opens a csv file in the default output directory ./out/
+    Writes the column names, then the matrix block by block ("NA" for padding)
+    """
+    with open(out, 'w', newline='') as w:
+        csv.writer(w).writerow(col_names)
+        for block_start in range(0, matrix.shape[0], block_rows):
+            block_text = io.StringIO()
+            numpy.savetxt(block_text, matrix[block_start:block_start + block_rows], fmt='%.6g', delimiter=',')
+            w.write(block_text.getvalue().replace('nan', 'NA'))
 
-    # build output matrix
-    transposed_array = []
 
-    for ncol in range(max_col + 1):
-        transposed_array.append([])
-        for nrow in range(max_row + 1):
-            transposed_array[ncol].append("NA")
+# columns of a BoAB finder csv file that the heatmap uses (Python n)
+TARGET_START_COL = 8
+TARGET_END_COL = 9
+DELTA_G_COL = 13
 
-    # now populate the matrix
-    for nrow, row in enumerate(data_array):
-        for ncol, col in enumerate(row):
-            transposed_array[ncol][nrow] = data_array[nrow][ncol]
 
-    return transposed_array
+def list_finder_csv_files(input_dir_name):
+    """
+    Finder csv files of the input directory, in sorted_nicely order (hidden files skipped)
+    """
+    csv_files = []
+    for which_file in sorted_nicely(os.listdir(input_dir_name)):
+        # Skip hidden files (startswith ".")
+        if which_file.startswith('.'):
+            log(f'found a dot_file: {which_file}; skipping...', level=VERBOSE)
+            continue
+        # Skip non-csv files
+        if pathlib.Path(which_file).suffix != '.csv':
+            continue
+        csv_files.append(os.path.join(input_dir_name, which_file))
+    return csv_files
 
 
-def save_transposed_data_array_to_csv(transposed_array, out):
+def parse_finder_csv(full_input_csv_file):
     """
-    Receives transposed_array
-    Opens a csv file in the default output directory ./out/
-    Writes the data array into that file
+    Reads only the ΔG and target coordinate columns of one BoAB finder csv file
+
+    Returns: tuple (delta_G, target_start, target_end)
+    - delta_G: float64 numpy array of the duplex ΔG of every row
+    - target_start, target_end: int64 numpy arrays of the target coordinates
     """
+    df = pd.read_csv(
+        full_input_csv_file,
+        quotechar='"',
+        usecols=[TARGET_START_COL, TARGET_END_COL, DELTA_G_COL],
+    )
+    # usecols keeps the file's column order: start, end, ΔG
+    assert df.columns[2] == 'duplex deltaG', print(f'Missing header in {full_input_csv_file}')
 
-    with open(out, 'w') as w:
-        csv_file_writer = csv.writer(w)
-        csv_file_writer.writerows(transposed_array)
+    delta_G = df.iloc[:, 2].to_numpy(dtype=numpy.float64)
+    target_start = df.iloc[:, 0].to_numpy(dtype=numpy.int64)
+    target_end = df.iloc[:, 1].to_numpy(dtype=numpy.int64)
+    return (delta_G, target_start, target_end)
 
 
-def prepare_heatmap(input_dir_name, len_target, out, target_from, target_to):
+def load_finder_columns(full_input_csv_file, cached_files=None, cache_dir=None):
+    """
+    ΔG and target coordinate columns of one finder csv file, from the extraction
+    cache when the file is unchanged, else parsed (and added to the cache)
+
+    Input: cached_files, manifest records of the input directory (updated in place)
+    Returns: tuple (delta_G, target_start, target_end), as parse_finder_csv()
+    """
+    if cache_dir is None:
+        return parse_finder_csv(full_input_csv_file)
+
+    (record, sha256) = cached_record(cached_files, full_input_csv_file)
+    columns_file = os.path.join(cache_dir, f'{sha256}.npz')
+    # entries are keyed by content, so a new file identical to a cached one is not parsed either
+    try:
+        with numpy.load(columns_file) as columns:
+            delta_G = columns['delta_G']
+            if record is None:
+                cached_files[os.path.basename(full_input_csv_file)] = new_record(
+                    full_input_csv_file, sha256, rows=len(delta_G))
+            return (delta_G, columns['target_start'], columns['target_end'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    (delta_G, target_start, target_end) = parse_finder_csv(full_input_csv_file)
+    try:
+        # numpy.savez adds .npz to any other file name, so the temporary file ends in .npz too
+        atomic_write(columns_file, lambda tmp_file: numpy.savez(
+            tmp_file, delta_G=delta_G, target_start=target_start, target_end=target_end), suffix='.npz')
+        cached_files[os.path.basename(full_input_csv_file)] = new_record(
+            full_input_csv_file, sha256, rows=len(delta_G))
+    except OSError as e:
+        log(f'Could not write extraction cache entry {columns_file}: {e}', level=QUIET)
+    return (delta_G, target_start, target_end)
+
+
+def read_finder_csv(full_input_csv_file, target_from, target_to, cached_files=None, cache_dir=None):
+    """
+    ΔG column and coordinate bounds of one BoAB finder csv file, restricted to a window
+
+    Input: full_input_csv_file, path of the csv file
+    - target_from, target_to: only rows inside these bounds are kept
+    - cached_files, cache_dir: extraction cache (see load_finder_columns)
+    Returns: tuple (file_name, delta_G, n_file_rows, min_target_start, max_target_end)
+    - delta_G: float64 numpy array of the duplex ΔG of the rows inside the window
+    - n_file_rows: number of rows of the whole file (gives the probe length)
+    """
+    file_name = pathlib.Path(full_input_csv_file).stem
+    (delta_G, target_start, target_end) = load_finder_columns(full_input_csv_file, cached_files, cache_dir)
+
+    # Inside the boundary?
+    inside = (target_start >= target_from) & (target_end <= target_to)
+    min_target_start = target_start[inside].min() if inside.any() else float("inf")
+    max_target_end = target_end[inside].max() if inside.any() else 0
+
+    # rows outside the window never reach the ΔG matrix
+    window_delta_G = delta_G if inside.all() else delta_G[inside]
+
+    return (file_name, window_delta_G, len(delta_G), min_target_start, max_target_end)
+
+
+def prepare_heatmap(
+        input_dir_name, len_target, out, target_from, target_to, workers=4, max_matrix_bytes=1 << 30, cache_dir=None):
     """
     Iterates through a directory, finds csv files from a boab_finder analysis
-    Opens boab_finder json files, extracts the ΔG of all alignments
+    Opens boab_finder csv files, extracts the ΔG of all alignments
     Returns these ΔG, plus also the length of the (calculated) probe
 
     Input: 3 inputs
-    - input_dir_name: location of the json files
+    - input_dir_name: location of the csv files
     - len_target: the (fixed) length of the target region
     - out: the name of the csv file holding the detla G values for each experiment
+    - workers: number of threads the csv files are parsed with
+    - max_matrix_bytes: above this size the ΔG matrix is a disk-backed memmap (out + '.npy')
+    - cache_dir: extraction cache directory; only new or changed csv files are parsed (None: parse all)
+    - target_from, target_to: only alignments inside these target coordinates are kept
 
     Returns: list containing tuple (data_array, probe_array)
-    - data_list: list of ΔGs from multiple probe vs target boab_finder run
+    - data_array: float32 ΔG matrix, one column per probe file (NaN padded)
     - probe_array: list of length of probes used
     """
-
-    # initialise data array. This will hold the lists of delta_G values from the csv files
-    data_array = []  # This will hold the ΔG values
-    probe_array = []  # This will hold the (file_name, probe_length) list of tuples
-
-    min_target_start = float("inf")
-    max_target_end = 0
-
     # access input files in input directory
-    print(f'\nStep 2: Determining the length of the probe in each csv file in {input_dir_name}')
+    log(f'\nStep 2: Determining the length of the probe in each csv file in {input_dir_name}')
     assert os.path.exists(input_dir_name), f"Can't find directory of input files {input_dir_name}"
 
-    # For each finder algorithm's output in the input directory
-    for which_file in sorted_nicely(os.listdir(input_dir_name)):
-        # Skip hidden files (startswith ".")
-        if not which_file.startswith('.'):
-            # Skip non-csv files
-            file_extension = pathlib.Path(which_file).suffix
-            if file_extension != '.csv':
-                continue
-
-            # Remaining files must be csv files
-            full_input_csv_file = os.path.join(input_dir_name, which_file)
-            assert os.path.exists(full_input_csv_file), print(f'Cannot find file: {full_input_csv_file}')
-
-            # Initialise data_list to store the delta G scores for each csv file
-            file_name = pathlib.Path(which_file).stem
-            data_list = [file_name]
-
-            # Open the csv file and read it
-            with open(full_input_csv_file, newline='') as csv_file:
-                csv_file_contents = csv.reader(csv_file, quotechar='"')
-
-                # Now go through the file, row by row, and extract the ΔG from column 13
-                for i_row, row in enumerate(csv_file_contents):
-                    nrows_in_file = i_row
-                    
-                    # Extract ΔG for duplex structure. This is located in column 14 (Python n=13)
-                    delta_G_duplex = row[13]
-
-                    if i_row == 0:
-                        assert delta_G_duplex == 'duplex deltaG', print(
-                            f'Missing header in row" {nrows_in_file}"'
-                            )
-                    else:
-                        data_list.append(delta_G_duplex)
-
-                        target_start = int(row[8])
-                        target_end = int(row[9])
-
-                        # Outside the boundary?
-                        if target_start < target_from or target_end > target_to:
-                            continue
-
-                        min_target_start = min(min_target_start, target_start)
-                        max_target_end = max(max_target_end, target_end)
-
-                # Calculate the length of the probe
-                len_probe = abs(len_target - nrows_in_file)
-
-                # Add to probe_array
-                new_entry_for_list = (file_name, len_probe)
-                probe_array.append(new_entry_for_list)
-
-            data_array.append(data_list)
-        else:
-            # skip hidden files
-            print(f'found a dot_file: {which_file}; skipping...')
+    csv_files = list_finder_csv_files(input_dir_name)
+    assert len(csv_files) > 0, print('There is no data to transpose or process')
 
-    size_of_array = len(data_array)
-    print(f'array size is {size_of_array}')
+    # Each file has at most one row per target position (inside the window)
+    n_cols = len(csv_files)
+    max_rows = len_target if target_to == float("inf") else min(len_target, int(target_to - target_from) + 1)
+    max_rows = max(max_rows, 0)
+    out_of_core = max_rows * n_cols * 4 > max_matrix_bytes
+    if out_of_core:
+        log(f'ΔG matrix is larger than {max_matrix_bytes} bytes; assembling it on disk in {out}.npy')
+    data_array = allocate_delta_g_matrix(max_rows, n_cols, out + '.npy' if out_of_core else None)
 
-    print('\nFinal results returned in probe_array are:')
+    col_names = []  # This will hold the file names, as header of the output csv file
+    probe_array = []  # This will hold the (file_name, probe_length) list of tuples
+    min_target_start = float("inf")
+    max_target_end = 0
+    n_rows = 0
+    cached_files = load_extraction_manifest(cache_dir, input_dir_name)
+
+    # Parse the finder files in parallel, a batch of `workers` files at a time,
+    # so only that many ΔG columns are held in memory besides the matrix
+    workers = max(workers, 1)
+    with stage("transpose", files=n_cols), ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_start in range(0, n_cols, workers):
+            batch = csv_files[batch_start:batch_start + workers]
+            parsed_files = executor.map(
+                lambda csv_file: read_finder_csv(csv_file, target_from, target_to, cached_files, cache_dir), batch)
+
+            for ncol, (file_name, delta_G, n_file_rows, file_min_target_start, file_max_target_end) in enumerate(
+                    parsed_files, start=batch_start):
+                if len(delta_G) > data_array.shape[0]:
+                    assert not out_of_core, print(f'{file_name} has more rows than the target length {len_target}')
+                    padding = numpy.full((len(delta_G) - data_array.shape[0], n_cols), numpy.nan, dtype=numpy.float32)
+                    data_array = numpy.vstack((data_array, padding))
+                data_array[:len(delta_G), ncol] = delta_G
+                n_rows = max(n_rows, len(delta_G))
+
+                # Calculate the length of the probe (from all rows of the file, not only the window)
+                len_probe = abs(len_target - n_file_rows)
+                probe_array.append((file_name, len_probe))
+                col_names.append(file_name)
+
+                min_target_start = min(min_target_start, file_min_target_start)
+                max_target_end = max(max_target_end, file_max_target_end)
+
+    save_extraction_manifest(cache_dir, input_dir_name, cached_files)
+
+    data_array = data_array[:n_rows]
+    log(f'array size is {data_array.shape[1]}')
+
+    log('\nFinal results returned in probe_array are:')
     for nitem, item in enumerate(probe_array):
-        print(f'nitem: {nitem+1} : file_name: {item[0]}, probe length: {item[1]}')
-
-    # Transpose data array
-    print('\nStep 3: Generating an input file for heatmaps from several BoAB Finder output csv files')
-    assert len(data_list) > 0, print('There is no data to transpose or process')
-    transposed_array = transpose_array(data_array)
+        log(f'nitem: {nitem+1} : file_name: {item[0]}, probe length: {item[1]}')
 
     # Write data array into output file
-    save_transposed_data_array_to_csv(transposed_array, out)
+    log('\nStep 3: Generating an input file for heatmaps from several BoAB Finder output csv files')
+    with stage("write", rows=data_array.shape[0]):
+        save_delta_g_matrix_to_csv(col_names, data_array, out)
 
     return (data_array, probe_array, min_target_start, max_target_end)
 
@@ -288,7 +490,7 @@ def probe_vector(input_probe_variable):
     Builds the probe_vector
     """
     probe_vector_variable = [item[1] for item in input_probe_variable]
-    print(f'probe vector is: {probe_vector_variable}')
+    log(f'probe vector is: {probe_vector_variable}')
     return probe_vector_variable
 
 
@@ -300,11 +502,28 @@ def final_heatmap_run_command(
     y_axis,
     y_axis_ticks,
     target_from = 0,
-    target_to = float("inf")):
+    target_to = float("inf"),
+    workers = 4,
+    renderer = "python",
+    cache_dir = "out/extraction_cache",
+    target_len = None,
+    max_heatmap_rows = None,
+    row_pooling = "mean"):
     """
-    The actual module where the R script is edited, constructed and executed
+    The actual module where the heatmaps are generated
+    workers: number of threads the finder csv files are parsed with
+    cache_dir: extraction cache, so reruns only parse new or changed input files (None: disabled)
+    target_len: length of the target, when already known (e.g. shared by a batch); else read from the json file
+    target_from, target_to: target coordinate window; alignments outside it are dropped while parsing
+    max_heatmap_rows, row_pooling: pool rows ("mean" or "min" per bin) down to at most max_heatmap_rows
+              before rendering (python renderer only; None: one row per target position)
+    renderer: "python" renders the heatmaps in-process (heatmap_renderer.py),
+              "r" edits, constructs and executes the R script as before
+    A json run report with the time and peak memory of each stage is written to
+    out/heatmap_run_report_<experiment>.json
     """
-    print(f'=== {module_name} ====')
+    reset_run_report()
+    log(f'=== {module_name} ====')
     assert os.path.exists(input_directory_name), print(f'Unable to find input directory {input_directory_name}')
 
     # Setting up experiment
@@ -317,7 +536,8 @@ def final_heatmap_run_command(
     os.system("mkdir -p out")
     TMP_CSV_FILE = f'out/heatmap_csv_input_{experiment_name}.csv'
 
-    TARGET_LEN = find_target_file(input_directory_name)
+    with stage("load"):
+        TARGET_LEN = target_len if target_len is not None else find_target_file(input_directory_name, cache_dir)
 
     # Generate a CSV file for running heatmap in R
     (data_array, probe_array, min_target_start, max_target_end) = prepare_heatmap(
@@ -325,26 +545,62 @@ def final_heatmap_run_command(
         TARGET_LEN,
         TMP_CSV_FILE,
         target_from,
-        target_to)
+        target_to,
+        workers,
+        cache_dir=cache_dir)
 
     PROBE_VECTOR_AS_STR = str(probe_vector(probe_array))[1:-1]
-    print("\nStep 4: Creating Heatmaps")
+    log("\nStep 4: Creating Heatmaps")
     assert os.path.exists(TMP_CSV_FILE), print(f'Cannot find TMP_CSV_FILE {TMP_CSV_FILE}')
 
-    # Where the temporary R-scipt file will goto
-    TMP_R_FILE = f'out/heatmap_script_{experiment_name}.R'
-
-    # Generate the heatmap visualization in R
     pdf_name = f'out/heatmap_pdf_output_{experiment_name}.pdf'
+    report_name = f'out/heatmap_run_report_{experiment_name}.json'
+    report = dict(script=module_name, experiment=experiment_name, input_dir=input_directory_name,
+                  renderer=renderer, probes=data_array.shape[1], rows=data_array.shape[0])
 
     col_names = []
-    for i in range(len(data_array)):
+    for i in range(data_array.shape[1]):
         col_names.append(str(i + 1))
-    col_names = ", ".join(col_names)
-    
+
     # Estimated y-axis increments to the specified number of ticks
     y_axis_increment = int((max_target_end - min_target_start) / y_axis_ticks)
 
+    # with a window the means are taken over the rows inside it, not the whole target
+    rows_by_probe = None
+    if target_from > 0 or target_to < float("inf"):
+        rows_by_probe = numpy.count_nonzero(~numpy.isnan(data_array), axis=0)
+
+    # Generate the heatmap visualization in Python, without starting R
+    if renderer == "python":
+        from heatmap_renderer import render_heatmap_pdf
+
+        try:
+            with stage("render"):
+                render_heatmap_pdf(
+                    data_array,
+                    probe_vector(probe_array),
+                    TARGET_LEN,
+                    min_target_start,
+                    max_target_end,
+                    probes_name,
+                    y_axis,
+                    y_axis_increment,
+                    col_names,
+                    pdf_name,
+                    max_rows=max_heatmap_rows,
+                    pooling=row_pooling,
+                    rows_by_probe=rows_by_probe)
+        finally:
+            remove_delta_g_memmap(TMP_CSV_FILE)
+        write_run_report(report_name, **report)
+        return (TMP_CSV_FILE, None, pdf_name)
+
+    # Where the temporary R-scipt file will goto
+    TMP_R_FILE = f'out/heatmap_script_{experiment_name}.R'
+
+    # Generate the heatmap visualization in R
+    col_names = ", ".join(col_names)
+
     with open("./src/rscript_automated_heatmap.R") as r:
         code = r.read()
         assert "<<INPUT_CSV>>" in code, print(
@@ -354,6 +610,9 @@ def final_heatmap_run_command(
         #assert os.path.exists(TMP_CSV_FILE), print(f'Cannot find TMP_CSV_FILE {TMP_CSV_FILE}')
         code = code.replace("<<INPUT_LEN_TARGET>>", str(TARGET_LEN))
         code = code.replace("<<PROBE_VECTOR_FOR_R>>", PROBE_VECTOR_AS_STR)
+        # empty: the template divides by len_target - probe length, as for the whole target
+        code = code.replace(
+            "<<ROWS_BY_PROBE_FOR_R>>", "" if rows_by_probe is None else ", ".join(str(n) for n in rows_by_probe))
         code = code.replace("<<PROBE_NAME>>", probes_name)
         code = code.replace("<<NAME_PDF_OUTPUT>>", pdf_name)
         code = code.replace("<<INPUT_TARGET_START>>", str(min_target_start))
@@ -366,7 +625,10 @@ def final_heatmap_run_command(
         with open(TMP_R_FILE, "w") as w:
             w.write(code)
 
-    # Run the R script
-    os.system(f"Rscript {TMP_R_FILE}")
+    # Run the R script (it reads the csv file, not the ΔG matrix)
+    remove_delta_g_memmap(TMP_CSV_FILE)
+    with stage("subprocess", command="Rscript"):
+        os.system(f"Rscript {TMP_R_FILE}")
 
+    write_run_report(report_name, **report)
     return (TMP_CSV_FILE, TMP_R_FILE, pdf_name)
@@ -0,0 +1,209 @@
+"""
+Batch mode for the heatmap module: many probe/target experiments in one process
+
+The experiments are listed in a manifest, either
+- a tsv file with a header line, one experiment per row, or
+- a json file holding a list of objects (one per experiment)
+with the fields:
+    probes_name, target_name, input_dir, y_axis    (required)
+    y_axis_ticks, target_from, target_to, renderer, max_rows, pooling (optional)
+
+Each experiment runs final_heatmap_run_command in a pool of worker processes.
+Target files are read once per distinct target (by content), and the length is
+shared with every experiment using that target. Every experiment logs to its own
+file in out/. One summary (outputs, timings, failures) is written to
+out/heatmap_batch_summary.tsv.
+"""
+
+import os
+import csv
+import json
+import pathlib
+import time
+import traceback
+from contextlib import redirect_stdout
+
+from heatmap import (file_sha256, final_heatmap_run_command, list_target_json_files,
+                     find_target_file)
+from batch_runner import run_pooled, write_summary_tsv
+from run_report import QUIET, log
+
+
+REQUIRED_FIELDS = ("probes_name", "target_name", "input_dir", "y_axis")
+DEFAULT_Y_AXIS_TICKS = 20
+SMALL_PDF_BYTES = 10000
+SUMMARY_FIELDS = ["experiment", "status", "seconds", "csv", "pdf", "pdf_kb", "log", "error"]
+
+
+def load_experiment_manifest(manifest_file):
+    """
+    Reads the list of experiments from a tsv or json manifest
+
+    Input: manifest_file, path of the .tsv or .json manifest
+    Returns: list of dicts, one per experiment (optional fields filled in)
+    """
+    if pathlib.Path(manifest_file).suffix == '.json':
+        with open(manifest_file) as f:
+            experiments = json.load(f)
+    else:
+        with open(manifest_file, newline='') as f:
+            experiments = [row for row in csv.DictReader(f, delimiter='\t') if any(row.values())]
+
+    names = set()
+    for nrow, experiment in enumerate(experiments, start=1):
+        missing = [field for field in REQUIRED_FIELDS if not experiment.get(field)]
+        if missing:
+            raise ValueError(f'Experiment {nrow} of {manifest_file} is missing {", ".join(missing)}')
+
+        experiment["y_axis_ticks"] = int(experiment.get("y_axis_ticks") or DEFAULT_Y_AXIS_TICKS)
+        experiment["target_from"] = int(experiment.get("target_from") or 0)
+        experiment["target_to"] = float(experiment.get("target_to") or "inf")
+        experiment["renderer"] = experiment.get("renderer") or "python"
+        experiment["max_rows"] = int(experiment["max_rows"]) if experiment.get("max_rows") else None
+        experiment["pooling"] = experiment.get("pooling") or "mean"
+
+        # the output files are named after the experiment, so they must not collide
+        name = f'{experiment["probes_name"]}_{experiment["target_name"]}'
+        if name in names:
+            raise ValueError(f'Experiment {name} is listed more than once in {manifest_file}')
+        names.add(name)
+
+    return experiments
+
+
+def target_file_key(target_file):
+    """
+    Identity of a target file without reading it: real path, size and modification time
+    """
+    stat = os.stat(target_file)
+    return (os.path.realpath(target_file), stat.st_size, stat.st_mtime_ns)
+
+
+def shared_target_length(input_dir, cache_dir, lengths, digests):
+    """
+    Length of the target of one input directory, reusing the length of a target already read
+
+    Input: lengths, {target_file_key: length} of the targets read so far (updated in place)
+    - digests: {target_file_key: sha256}, computed only for files of the same size (updated in place)
+    Returns: the target length, or None if the directory does not hold exactly one target file
+    """
+    target_files = list_target_json_files(input_dir)
+    if len(target_files) != 1:
+        return None
+    key = target_file_key(target_files[0])
+    if key in lengths:
+        return lengths[key]
+
+    # another file of the same size may be a copy of a target already read: compare the content
+    for other in [other for other in lengths if other[1] == key[1]]:
+        for file_key in (key, other):
+            if file_key not in digests:
+                digests[file_key] = file_sha256(file_key[0])
+        if digests[key] == digests[other]:
+            lengths[key] = lengths[other]
+            return lengths[key]
+
+    lengths[key] = find_target_file(input_dir, cache_dir)
+    return lengths[key]
+
+
+def shared_target_lengths(experiments, cache_dir):
+    """
+    Length of the target of every experiment, reading each distinct target file once
+
+    Experiments whose input directories hold the same target json file (same path,
+    size and modification time, or identical content) share one length; reading the
+    file also goes through the extraction cache. Errors are not raised here: the
+    experiment gets None and reports its own missing or unreadable target.
+    Returns: list with the target length (or None) of each experiment
+    """
+    lengths_by_file = {}
+    digests = {}
+    lengths = []
+    for experiment in experiments:
+        try:
+            lengths.append(shared_target_length(experiment["input_dir"], cache_dir, lengths_by_file, digests))
+        except Exception:
+            lengths.append(None)
+    return lengths
+
+
+def run_experiment(experiment, target_len, parse_workers, cache_dir):
+    """
+    Runs one experiment of the batch, logging to its own file in out/
+
+    Returns: dict summary (see SUMMARY_FIELDS); failures are reported, not raised
+    """
+    name = f'{experiment["probes_name"]}_{experiment["target_name"]}'
+    log_file = f'out/heatmap_log_{name}.txt'
+    summary = {"experiment": name, "status": "failed", "seconds": 0, "csv": "", "pdf": "", "pdf_kb": "",
+               "log": log_file, "error": ""}
+    start_time = time.time()
+
+    with open(log_file, 'w') as log_handle, redirect_stdout(log_handle):
+        try:
+            (csv_file_name, r_script_name, heatmap_pdf_name) = final_heatmap_run_command(
+                "heatmap.py",
+                experiment["probes_name"],
+                experiment["target_name"],
+                experiment["input_dir"],
+                experiment["y_axis"],
+                experiment["y_axis_ticks"],
+                target_from=experiment["target_from"],
+                target_to=experiment["target_to"],
+                workers=parse_workers,
+                renderer=experiment["renderer"],
+                cache_dir=cache_dir,
+                target_len=target_len,
+                max_heatmap_rows=experiment["max_rows"],
+                row_pooling=experiment["pooling"])
+
+            pdf_size = os.path.getsize(heatmap_pdf_name) if os.path.exists(heatmap_pdf_name) else 0
+            summary.update(csv=csv_file_name, pdf=heatmap_pdf_name, pdf_kb=round(pdf_size / 1000, 1))
+            if pdf_size < SMALL_PDF_BYTES:
+                summary.update(status="small_pdf", error=f'Expecting larger PDF size; check {r_script_name or log_file}')
+            else:
+                summary["status"] = "ok"
+        except Exception as e:
+            traceback.print_exc(file=log_handle)
+            summary["error"] = f'{type(e).__name__}: {e}'
+
+    summary["seconds"] = round(time.time() - start_time, 3)
+    return summary
+
+
+def run_heatmap_batch(manifest_file, workers=4, parse_workers=1, cache_dir="out/extraction_cache"):
+    """
+    Runs every experiment of a manifest over a pool of worker processes
+
+    Input: manifest_file, tsv or json list of experiments (see module docstring)
+    - workers: number of processes running experiments at the same time
+    - parse_workers: threads each experiment parses its finder csv files with
+    - cache_dir: extraction cache shared by all experiments (None: disabled)
+    Returns: list with one summary dict per experiment, in manifest order
+    """
+    experiments = load_experiment_manifest(manifest_file)
+    os.makedirs("out", exist_ok=True)
+    log(f'Running {len(experiments)} heatmap experiments from {manifest_file} with {workers} workers')
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        target_lengths = shared_target_lengths(experiments, cache_dir)
+
+    jobs = [(experiment, target_len, parse_workers, cache_dir)
+            for experiment, target_len in zip(experiments, target_lengths)]
+
+    names = [f'{experiment["probes_name"]}_{experiment["target_name"]}' for experiment in experiments]
+    summary = run_pooled(run_experiment, jobs, names, workers, name_field="experiment")
+
+    out_summary = "out/heatmap_batch_summary.tsv"
+    write_summary_tsv(summary, SUMMARY_FIELDS, out_summary)
+
+    failed = [item for item in summary if item["status"] != "ok"]
+    log(f'\nHeatmap batch finished: {len(summary) - len(failed)} of {len(summary)} experiments succeeded')
+    for item in summary:
+        log(f'    {item["status"]:>9}  {item.get("seconds", ""):>8}s  {item["experiment"]}  {item.get("pdf", "")}')
+    for item in failed:
+        log(f'    {item["status"]}: {item["experiment"]}: {item["error"]}', level=QUIET)
+    log(f'Per-experiment summary saved to {out_summary}')
+
+    return summary
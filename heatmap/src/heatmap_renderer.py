@@ -0,0 +1,242 @@
+"""
+Python renderer for the heatmaps, in place of rscript_automated_heatmap.R
+
+Performs the same steps as the R template, in NumPy:
+1. corrects the ΔG matrix for the length of each probe
+2. calculates the mean of each probe and the mean of the whole matrix
+3. clips values above the respective mean to that mean (2 matrices)
+4. prepares the row labels (start, end and increments) and column labels
+5. optionally pools rows (mean or min per bin) down to a display resolution,
+   so long targets do not render one image row per target position
+6. draws both heatmaps into one PDF (one page each)
+
+matplotlib is imported only when rendering, so heatmap.py stays quick to import.
+"""
+
+import numpy
+
+from run_report import log
+
+
+HEATMAP_UNITS = "kcal/mol/nt"
+N_COLOURS = 10
+
+
+def heatmap_means(matrix, probe_vector, len_target, rows_by_probe=None):
+    """
+    Means of the probe-length corrected ΔG matrix, one column at a time
+
+    Input: matrix, float32 ΔG matrix (rows: target positions, columns: probes; NaN for NA),
+      possibly a disk-backed memmap
+    - probe_vector: length of each probe
+    - len_target: length of the target
+    - rows_by_probe: number of rows each mean is taken over; default as the R
+      template (len_target - probe length), which assumes the whole target is shown
+    Returns: tuple (means_by_probe, mean_whole_matrix)
+    """
+    probe_vector = numpy.asarray(probe_vector, dtype=numpy.float64)
+
+    # correcting for probe length, summed in float64 one column at a time
+    sums_by_probe = numpy.array([
+        numpy.nansum(matrix[:, ncol], dtype=numpy.float64) / probe_vector[ncol] for ncol in range(matrix.shape[1])])
+    if rows_by_probe is None:
+        means_by_probe = sums_by_probe / (len_target - probe_vector)
+        mean_whole_matrix = sums_by_probe.sum() / (len_target * matrix.shape[1] - probe_vector.sum())
+    else:
+        rows_by_probe = numpy.asarray(rows_by_probe, dtype=numpy.float64)
+        means_by_probe = sums_by_probe / rows_by_probe
+        mean_whole_matrix = sums_by_probe.sum() / rows_by_probe.sum()
+
+    return (means_by_probe, mean_whole_matrix)
+
+
+def clipped_matrix(matrix, probe_vector, means):
+    """
+    Probe-length corrected ΔG matrix with values above the mean set to that mean
+
+    Input: matrix, float32 ΔG matrix (NaN for NA), as heatmap_means
+    - probe_vector: length of each probe
+    - means: one mean per probe, or one mean for the whole matrix
+    Returns: float32 matrix, filled one column at a time (the only full-size copy)
+    """
+    means = numpy.broadcast_to(numpy.asarray(means, dtype=numpy.float32), (matrix.shape[1],))
+    clipped = numpy.empty(matrix.shape, dtype=numpy.float32, order="F")
+    for ncol in range(matrix.shape[1]):
+        column = clipped[:, ncol]
+        numpy.divide(matrix[:, ncol], numpy.float32(probe_vector[ncol]), out=column)
+        # minimum keeps NaN, so NA stays NA as in R
+        numpy.minimum(column, means[ncol], out=column)
+    return clipped
+
+
+def pool_rows(matrix, bin_size, pooling="mean"):
+    """
+    Reduces the matrix to one row per bin_size rows
+
+    Input: matrix, 2D array (NaN for NA)
+    - bin_size: number of consecutive rows pooled into one
+    - pooling: "mean" or "min" (min keeps the strongest binding, most negative ΔG, visible)
+    Returns: pooled float64 matrix, built one column at a time; a bin with only NA stays NA
+    """
+    if pooling not in ("mean", "min"):
+        raise ValueError(f'Unknown row pooling {pooling!r}; use "mean" or "min"')
+    n_rows, n_cols = matrix.shape
+    if bin_size <= 1 or n_rows == 0:
+        return matrix
+
+    n_bins = -(-n_rows // bin_size)
+    pooled = numpy.empty((n_bins, n_cols))
+    padded = numpy.empty(n_bins * bin_size)
+    for ncol in range(n_cols):
+        padded[:n_rows] = matrix[:, ncol]
+        padded[n_rows:] = numpy.nan
+        bins = padded.reshape(n_bins, bin_size)
+
+        values = numpy.isfinite(bins)
+        if pooling == "mean":
+            sums = numpy.where(values, bins, 0).sum(axis=1)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                pooled[:, ncol] = sums / values.sum(axis=1)
+        else:
+            pooled[:, ncol] = numpy.where(values, bins, numpy.inf).min(axis=1)
+            pooled[~values.any(axis=1), ncol] = numpy.nan
+    return pooled
+
+
+def heatmap_row_labels(n_rows, target_start, target_end, y_axis_increment, bin_size=1):
+    """
+    Row labels as in the R template: "Start: ..." on the first row, "End: ..." on
+    the last, and "==position=>" every y_axis_increment rows in between
+
+    Input: n_rows, number of rows before pooling
+    - bin_size: rows per displayed row (see pool_rows); labels move to the displayed row
+    Returns: dict {row index: label} (unlabelled rows are left out)
+    """
+    y_axis_increment = max(int(y_axis_increment), 1)
+    labels = {}
+
+    if target_start < target_end:
+        target_end = target_start + n_rows - 1
+        for n, row in enumerate(range(0, n_rows, y_axis_increment), start=1):
+            labels[row] = f"=={target_start + n * y_axis_increment}=>"
+    else:
+        target_end = target_start - n_rows + 1
+        for n, row in enumerate(range(y_axis_increment - 1, n_rows, y_axis_increment), start=1):
+            labels[row] = f"=={target_start - n * y_axis_increment}=>"
+
+    if n_rows:
+        labels[0] = f"Start: {target_start}"
+        labels[n_rows - 1] = f"End: {target_end}"
+
+    if bin_size > 1:
+        pooled_labels = {}
+        for row, label in sorted(labels.items()):
+            pooled_labels.setdefault(row // bin_size, label)
+        pooled_labels[0] = labels[0]
+        pooled_labels[(n_rows - 1) // bin_size] = labels[n_rows - 1]
+        return pooled_labels
+    return labels
+
+
+def draw_heatmap(pdf, matrix, title, legend_name, y_axis_label, col_labels, row_labels, bottom_labels=None):
+    """
+    Draws one heatmap as a page of pdf (a matplotlib PdfPages)
+    """
+    from matplotlib import colormaps
+    from matplotlib.colors import LinearSegmentedColormap
+    from matplotlib.figure import Figure
+
+    # ComplexHeatmap interpolates between the colours of viridis(10)
+    cmap = LinearSegmentedColormap.from_list("viridis_10", colormaps["viridis"](numpy.linspace(0, 1, N_COLOURS)))
+    cmap.set_bad("grey")
+
+    figure = Figure(figsize=(7, 7))
+    axes = figure.add_subplot()
+    image = axes.imshow(
+        numpy.ma.masked_invalid(matrix), aspect="auto", interpolation="nearest", cmap=cmap)
+
+    # white gaps between columns, as column_split does
+    for boundary in numpy.arange(1, matrix.shape[1]) - 0.5:
+        axes.axvline(boundary, color="white", linewidth=3)
+
+    axes.set_title(title, fontsize=16)
+    axes.set_ylabel(y_axis_label, fontsize=14)
+    axes.set_yticks(list(row_labels.keys()), list(row_labels.values()), fontsize=6)
+    axes.set_xticks(numpy.arange(matrix.shape[1]), col_labels, fontsize=8)
+    axes.tick_params(length=0)
+
+    if bottom_labels is not None:
+        for ncol, label in enumerate(bottom_labels):
+            axes.annotate(
+                label, (ncol, 0), xycoords=("data", "axes fraction"), xytext=(0, -22),
+                textcoords="offset points", ha="center", va="top", fontsize=8)
+
+    colorbar = figure.colorbar(image, ax=axes)
+    colorbar.ax.set_title(legend_name, fontsize=8)
+
+    figure.tight_layout()
+    pdf.savefig(figure)
+
+
+def render_heatmap_pdf(
+        matrix,
+        probe_vector,
+        len_target,
+        target_start,
+        target_end,
+        probe_name,
+        y_axis_label,
+        y_axis_increment,
+        col_labels,
+        pdf_name,
+        max_rows=None,
+        pooling="mean",
+        rows_by_probe=None):
+    """
+    Renders the two heatmaps of the R template into pdf_name
+
+    Input: matrix, float32 ΔG matrix from prepare_heatmap (rows: target positions, columns: probes),
+      read one column at a time; only one clipped float32 copy is in memory at a time
+    - probe_vector: length of each probe
+    - max_rows: if given, rows are pooled (pooling: "mean" or "min") to at most max_rows
+      displayed rows; means and clipping are still calculated on the full matrix
+    - rows_by_probe: see heatmap_means
+    - other inputs as the placeholders of rscript_automated_heatmap.R
+    Returns: tuple (means_by_probe, mean_whole_matrix)
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    (means_by_probe, mean_whole_matrix) = heatmap_means(matrix, probe_vector, len_target, rows_by_probe)
+    log("Corrected for length of probe")
+    for i, mean in enumerate(means_by_probe):
+        log(f"    -> mean of probe {i + 1} is: {round(mean, 2)}")
+    log(f"And -> mean of entire matrix is: {round(mean_whole_matrix, 2)}")
+
+    bin_size = 1
+    if max_rows is not None and matrix.shape[0] > max_rows:
+        bin_size = -(-matrix.shape[0] // max_rows)
+        log(f"Pooling every {bin_size} rows ({pooling}) into {-(-matrix.shape[0] // bin_size)} displayed rows")
+
+    row_labels = heatmap_row_labels(matrix.shape[0], target_start, target_end, y_axis_increment, bin_size)
+    title_each_probe_mean = f"Heatmap of {y_axis_label} \nand {probe_name} (mean of each probe)"
+    title_matrix_mean = f"Heatmap of {y_axis_label} \nand {probe_name} (mean of all probes)"
+
+    def display_matrix(means):
+        # one clipped matrix at a time, pooled to the displayed rows
+        clipped = clipped_matrix(matrix, probe_vector, means)
+        if bin_size > 1:
+            clipped = pool_rows(clipped, bin_size, pooling)
+        return clipped
+
+    with PdfPages(pdf_name) as pdf:
+        draw_heatmap(
+            pdf, display_matrix(means_by_probe), title_each_probe_mean, HEATMAP_UNITS, y_axis_label, col_labels,
+            row_labels, bottom_labels=[f"(µ = {round(mean, 2)})" for mean in means_by_probe])
+        log("Generated a heatmap displaying the mean of each probe")
+
+        draw_heatmap(
+            pdf, display_matrix(mean_whole_matrix), title_matrix_mean,
+            f"{HEATMAP_UNITS}\n(µ= {round(mean_whole_matrix, 2)})", y_axis_label, col_labels, row_labels)
+        log("Generated a heatmap displaying the mean of entire matrix")
+
+    return (means_by_probe, mean_whole_matrix)
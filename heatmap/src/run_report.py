@@ -0,0 +1,122 @@
+"""
+Stage timing, peak memory and progress messages shared by gc_profile and heatmap
+
+    with stage("compute", target=name):   times a named stage of the run
+        ...
+    log(message)                          progress message, printed if verbosity allows
+    write_run_report(file, **metadata)    json report of every stage recorded so far
+
+Stage names used by the scripts: load, compute, transpose, write, render, subprocess.
+Each process records its own stages (worker processes return theirs to the parent).
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows: no peak memory in the report
+    resource = None
+
+
+# verbosity levels: QUIET only prints errors, VERBOSE adds debugging output (e.g. whole sequences)
+QUIET = 0
+NORMAL = 1
+VERBOSE = 2
+
+VERBOSITY = NORMAL
+STAGES = []
+RUN_START = time.time()
+
+
+def set_verbosity(level):
+    """
+    Sets the level of the messages printed by log() (QUIET, NORMAL or VERBOSE)
+    """
+    global VERBOSITY
+    VERBOSITY = int(level)
+
+
+def log(*message, level=NORMAL):
+    """
+    print() if the verbosity is at least level
+    Errors use level=QUIET, so they are always printed
+    """
+    if VERBOSITY >= level:
+        print(*message)
+
+
+def peak_memory_mb(who="self"):
+    """
+    Peak resident memory of this process ("self") or of its finished subprocesses ("children")
+    Output: MB, or None where the resource module is not available
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    divisor = 2**20 if sys.platform == "darwin" else 2**10
+    return round(usage.ru_maxrss / divisor, 1)
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Times the enclosed block as a stage of the run
+    Input: name, the stage name (load, compute, transpose, write, render, subprocess)
+           labels, extra fields stored with the stage (e.g. target=name)
+    """
+    record = dict(stage=name, **labels)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        record["peak_memory_mb"] = peak_memory_mb("children" if name == "subprocess" else "self")
+        record["pid"] = os.getpid()
+        STAGES.append(record)
+        log(f'[{name}] {record["seconds"]:.3f} sec', level=VERBOSE)
+
+
+def reset_run_report():
+    """
+    Forgets the stages recorded so far and restarts the run clock
+    """
+    global RUN_START
+    STAGES.clear()
+    RUN_START = time.time()
+
+
+def run_report(**metadata):
+    """
+    Report of the run as a dict: metadata, total time, peak memory, stages and per-stage totals
+    """
+    totals = {}
+    for record in STAGES:
+        totals[record["stage"]] = round(totals.get(record["stage"], 0) + record["seconds"], 6)
+    return {
+        **metadata,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(RUN_START)),
+        "total_seconds": round(time.time() - RUN_START, 6),
+        "peak_memory_mb": peak_memory_mb(),
+        "stage_totals": totals,
+        "stages": STAGES,
+    }
+
+
+def write_run_report(report_file, **metadata):
+    """
+    Writes run_report() as json to report_file
+    Output: the report dict
+    """
+    report = run_report(**metadata)
+    try:
+        with open(report_file, "w") as w:
+            json.dump(report, w, indent=1, default=str)
+        log(f"Run report saved to {report_file}")
+    except OSError as e:
+        log(f"Could not write run report {report_file}: {e}", level=QUIET)
+    return report
@@ -0,0 +1,122 @@
+"""
+Streaming parser for RNALfold output
+
+RNALfold prints one locally stable structure per line,
+
+    .((((....)))).  ( -3.40)    12
+
+(dot-bracket structure, free energy in kcal/mol, 1-based start), followed by
+the input sequence and the free energy of the whole sequence. The parser reads
+the lines one at a time and yields typed Hairpin records; any line that is not a
+structure line (sequence, total energy, blank lines) is skipped. It needs only
+the text, not ViennaRNA itself.
+
+    parse_rnalfold(lines)                 Hairpin records, in file order
+    sort_hairpins(hairpins, by)           sorted by 'position' or 'energy'
+    most_stable_hairpins(hairpins, k)     the k lowest-energy hairpins, O(n log k)
+    write_hairpins(hairpins, file)        text file, one hairpin per line
+    read_hairpins(file)                   Hairpin records of a file written by write_hairpins
+"""
+
+import heapq
+import re
+from typing import NamedTuple
+
+
+# structure, energy (the number may be padded inside the brackets, e.g. "( -9.90)"), start
+RNALFOLD_LINE = re.compile(r'^\s*([.()]+)\s+\(\s*([-+]?\d+(?:\.\d+)?)\s*\)\s+(\d+)')
+
+
+class Hairpin(NamedTuple):
+    """
+    One locally stable structure predicted by RNALfold
+    start and end are 1-based and inclusive, on the folded sequence
+    """
+    structure: str
+    energy: float
+    start: int
+    end: int
+
+
+def parse_rnalfold(lines, offset=0):
+    """
+    Parse RNALfold output one line at a time
+    Input: lines, RNALfold output as a string or any iterable of lines (e.g. an open file)
+           offset, added to every start and end (to place the hairpins of a subsequence)
+    Output: generator of Hairpin records, in the order of the output
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
+    for line in lines:
+        match = RNALFOLD_LINE.match(line)
+        if match is None:
+            continue
+        structure, energy, start = match.groups()
+        start = int(start) + offset
+        yield Hairpin(structure, float(energy), start, start + len(structure) - 1)
+
+
+def position_key(hairpin):
+    """
+    Sort key: by start, then end
+    """
+    return (hairpin.start, hairpin.end)
+
+
+def energy_key(hairpin):
+    """
+    Sort key: most stable (lowest energy) first, then by position
+    """
+    return (hairpin.energy, hairpin.start, hairpin.end)
+
+
+SORT_KEYS = {'position': position_key, 'energy': energy_key}
+
+
+def sort_hairpins(hairpins, by='position'):
+    """
+    Sort hairpins by 'position' (start, end) or by 'energy' (lowest first)
+    Output: list of Hairpin records
+    """
+    if by not in SORT_KEYS:
+        raise ValueError(f"Unknown sort order {by!r}; use one of {', '.join(SORT_KEYS)}")
+    return sorted(hairpins, key=SORT_KEYS[by])
+
+
+def most_stable_hairpins(hairpins, k):
+    """
+    The k most stable (lowest energy) hairpins, most stable first
+    Only k records are held at a time, so hairpins can be a stream of any length
+    Output: list of at most k Hairpin records
+    """
+    return heapq.nsmallest(k, hairpins, key=energy_key)
+
+
+def write_hairpins(hairpins, file):
+    """
+    Writes hairpins to a text file: structure, energy and start on each line
+    (the layout of the .lfold files written by hairpins_rnalfold.py)
+    Output: number of hairpins written
+    """
+    n_hairpins = 0
+    with open(file, 'w') as w:
+        for hairpin in hairpins:
+            w.write(f'{hairpin.structure} {hairpin.energy:.2f}  {hairpin.start}\n')
+            n_hairpins += 1
+    return n_hairpins
+
+
+def read_hairpins(file):
+    """
+    Reads a file written by write_hairpins
+    Output: generator of Hairpin records, in file order
+    """
+    with open(file) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            structure, energy, start = fields
+            start = int(start)
+            yield Hairpin(structure, float(energy), start, start + len(structure) - 1)
@@ -0,0 +1,222 @@
+"""
+Incremental loading of single keys from target json files
+
+Target json files hold both strands plus metadata, but callers usually need
+one field, or only its length. These functions scan the file in chunks and
+decode only the requested key, skipping over every other value without
+building the whole document.
+
+    load_json_key(json_file, key)         value of one top-level key
+    load_json_key_length(json_file, key)  len() of that value, without keeping it
+"""
+
+import codecs
+import json
+import re
+
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = b" \t\r\n"
+
+# next character that changes the nesting inside an object/array, or ends a scalar
+CONTAINER_TOKEN = re.compile(rb'["{}\[\]]')
+SCALAR_END = re.compile(rb'[,}\]\s]')
+
+
+class KeyScanner:
+    """
+    Minimal incremental json reader over a binary file handle
+    Only what is needed to find a top-level key and read or skip values.
+    """
+
+    def __init__(self, handle, chunk_size=CHUNK_SIZE):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.pos = 0
+
+    def fill(self):
+        """
+        Drop the consumed part of the buffer and read the next chunk
+        """
+        data = self.handle.read(self.chunk_size)
+        if not data:
+            raise ValueError('unexpected end of json file')
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def next_char(self):
+        """
+        Skip whitespace and return the next character, without consuming it
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, char):
+        """
+        Consume char, which must be the next non-whitespace character
+        """
+        found = self.next_char()
+        if found != char:
+            raise ValueError(f'malformed json file: expected {char!r}, found {found!r}')
+        self.pos += 1
+
+    def string(self, sink):
+        """
+        Consume the rest of a string whose opening quote was already consumed
+        Input: sink, called with each raw (still escaped) piece of the string
+        Output: True if the string contained escapes
+        """
+        escaped = False
+        while True:
+            quote = self.buf.find(b'"', self.pos)
+            end = len(self.buf) if quote == -1 else quote
+            backslash = self.buf.find(b'\\', self.pos, end)
+            if backslash != -1:
+                escaped = True
+                if backslash + 1 >= len(self.buf):
+                    # escape split over two chunks
+                    sink(self.buf[self.pos:backslash])
+                    self.pos = backslash
+                    self.fill()
+                else:
+                    sink(self.buf[self.pos:backslash + 2])
+                    self.pos = backslash + 2
+                continue
+
+            sink(self.buf[self.pos:end])
+            self.pos = end
+            if quote == -1:
+                self.fill()
+                continue
+            self.pos += 1
+            return escaped
+
+    def value(self, sink):
+        """
+        Consume one json value, passing its raw text to sink
+        """
+        char = self.next_char()
+        self.pos += 1
+        sink(char)
+
+        if char == b'"':
+            self.string(sink)
+            sink(b'"')
+            return
+
+        if char in (b'{', b'['):
+            depth = 1
+            while depth:
+                match = CONTAINER_TOKEN.search(self.buf, self.pos)
+                if match is None:
+                    sink(self.buf[self.pos:])
+                    self.pos = len(self.buf)
+                    self.fill()
+                    continue
+                sink(self.buf[self.pos:match.end()])
+                self.pos = match.end()
+                token = match.group()
+                if token == b'"':
+                    self.string(sink)
+                    sink(b'"')
+                elif token in (b'{', b'['):
+                    depth += 1
+                else:
+                    depth -= 1
+            return
+
+        # number, true, false or null
+        while True:
+            match = SCALAR_END.search(self.buf, self.pos)
+            if match is not None:
+                sink(self.buf[self.pos:match.start()])
+                self.pos = match.start()
+                return
+            sink(self.buf[self.pos:])
+            self.pos = len(self.buf)
+            try:
+                self.fill()
+            except ValueError:
+                return
+
+    def find_key(self, key):
+        """
+        Position the scanner at the value of top-level key
+        Raises KeyError if the key is not in the document
+        """
+        self.expect(b'{')
+        if self.next_char() == b'}':
+            raise KeyError(key)
+
+        while True:
+            self.expect(b'"')
+            pieces = []
+            escaped = self.string(pieces.append)
+            name = b''.join(pieces)
+            name = json.loads(b'"' + name + b'"') if escaped else name.decode('utf-8')
+            self.expect(b':')
+            if name == key:
+                return
+
+            self.value(lambda piece: None)
+            if self.next_char() == b'}':
+                raise KeyError(key)
+            self.expect(b',')
+
+
+def load_json_key(json_file, key, chunk_size=CHUNK_SIZE):
+    """
+    Load the value of one top-level key of a json file
+    Input: json_file, path of the json file
+           key, the top-level key (e.g. "sequence")
+    Output: the decoded value
+    """
+    with open(json_file, 'rb') as handle:
+        scanner = KeyScanner(handle, chunk_size)
+        scanner.find_key(key)
+
+        # strings (the sequences) are joined and decoded directly
+        if scanner.next_char() == b'"':
+            scanner.pos += 1
+            pieces = []
+            escaped = scanner.string(pieces.append)
+            raw = b''.join(pieces)
+            return json.loads(b'"' + raw + b'"') if escaped else raw.decode('utf-8')
+
+        pieces = []
+        scanner.value(pieces.append)
+        return json.loads(b''.join(pieces))
+
+
+def load_json_key_length(json_file, key, chunk_size=CHUNK_SIZE):
+    """
+    Length of the value of one top-level key, without keeping the value in memory
+    Input: json_file, path of the json file
+           key, the top-level key (e.g. "sequence")
+    Output: len() of the decoded value
+    """
+    with open(json_file, 'rb') as handle:
+        scanner = KeyScanner(handle, chunk_size)
+        scanner.find_key(key)
+        if scanner.next_char() != b'"':
+            pieces = []
+            scanner.value(pieces.append)
+            return len(json.loads(b''.join(pieces)))
+
+        scanner.pos += 1
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        length = 0
+
+        def count(piece):
+            nonlocal length
+            length += len(decoder.decode(piece))
+
+        if scanner.string(count):
+            # escapes change the decoded length; rare in target files
+            return len(load_json_key(json_file, key, chunk_size))
+        return length
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the scripts are run from their own directories, not installed: import them from the tree
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "heatmap", "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
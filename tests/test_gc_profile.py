@@ -0,0 +1,219 @@
+import numpy
+import pytest
+
+import gc_profile
+from gc_profile import (circularise, encode_sequence, gc_percentages, gc_profile_calc, gc_profile_stream,
+                        read_sequence_chunks, reverse_complement)
+
+
+def random_sequence(rng, length, alphabet="ACGTNSWacgtn"):
+    return "".join(rng.choice(list(alphabet), length))
+
+
+def gc_profile_calc_loop(input_sequence, window_len, threshold):
+    """
+    gc_profile_calc before the numpy engine (one gc_fraction call per window), kept as the reference
+    """
+    from Bio.SeqUtils import gc_fraction
+
+    gc_values = []
+    high_gc_regions = []
+    region_start = None
+    region_end = None
+
+    for i in range(len(input_sequence) - window_len + 1):
+        subseq = input_sequence[i: i + window_len]
+        gc_perc_subseq = gc_fraction(subseq) * 100
+        gc_values.append(gc_perc_subseq)
+
+        if region_start is None and gc_perc_subseq >= threshold:
+            region_start = i
+            region_end = None
+
+        if region_end is None and region_start is not None and gc_perc_subseq < threshold:
+            region_end = i
+            high_gc_regions.append((region_start, region_end))
+            region_start = None
+
+    return (gc_values, high_gc_regions)
+
+
+@pytest.mark.parametrize("threshold", [0, 37.5, 50, 100])
+def test_gc_profile_calc_matches_loop(threshold):
+    pytest.importorskip("Bio.SeqUtils")
+    rng = numpy.random.default_rng(0)
+    for _ in range(40):
+        length = int(rng.integers(1, 120))
+        alphabet = rng.choice(["ACGT", "ACGTNSWacgtn", "GCSgcs", "ATWNatn", "ACGTRYKMBDHVN"])
+        seq = random_sequence(rng, length, alphabet)
+        for window_len in sorted({1, 2, 5, length, length + 1, int(rng.integers(1, length + 1))}):
+            gc_values, high_gc_regions = gc_profile_calc(seq, window_len, threshold)
+            expected_values, expected_regions = gc_profile_calc_loop(seq, window_len, threshold)
+            numpy.testing.assert_allclose(gc_values, expected_values, rtol=0, atol=1e-9)
+            assert high_gc_regions == expected_regions
+
+
+def streamed_gc(seq_file, which_strand, window_len, circular, chunk_size):
+    values = [gc_perc for _, gc_perc, _ in gc_profile_stream(
+        read_sequence_chunks(str(seq_file), chunk_size, which_strand), window_len, 50, circular)]
+    return numpy.concatenate(values)
+
+
+@pytest.mark.parametrize("fasta", [False, True])
+@pytest.mark.parametrize("circular", [False, True])
+def test_stream_sequence_rc_is_reverse_complement(tmp_path, fasta, circular):
+    rng = numpy.random.default_rng(1)
+    seq = random_sequence(rng, 1000)
+    if fasta:
+        seq_file = tmp_path / "target.fa"
+        lines = [seq[i:i + 60] for i in range(0, len(seq), 60)]
+        seq_file.write_text(">target first\n" + "\n".join(lines) + "\n>second\nGGGGGGGGGG\n")
+    else:
+        seq_file = tmp_path / "target.txt"
+        seq_file.write_text(seq + "\n")
+
+    for which_strand, strand in (("sequence", seq), ("sequence_rc", reverse_complement(seq))):
+        expected = gc_percentages(encode_sequence(circularise(strand, 20) if circular else strand), 20)
+        if circular:
+            expected = expected[:len(seq) + 1]
+        for chunk_size in (7, 64, 1 << 20):
+            numpy.testing.assert_allclose(
+                streamed_gc(seq_file, which_strand, 20, circular, chunk_size), expected)
+
+
+def test_stream_sequence_rc_rejects_gzip(tmp_path):
+    with pytest.raises(ValueError):
+        list(gc_profile.read_reverse_complement_chunks(str(tmp_path / "target.fa.gz")))
+
+
+def clusters_loop(regions, merge_gap, flank, seq_len):
+    """
+    Reference clustering: merge regions within merge_gap, pad, then join overlapping padded clusters
+    """
+    merged = []
+    for start, end in regions:
+        if merged and start - merged[-1][1] <= merge_gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    clusters = []
+    for start, end in merged:
+        start, end = max(start - flank, 0), min(end + flank, seq_len)
+        if clusters and start < clusters[-1][1]:
+            clusters[-1][1] = max(clusters[-1][1], end)
+        else:
+            clusters.append([start, end])
+    return [tuple(cluster) for cluster in clusters]
+
+
+def test_high_gc_clusters_merge_on_raw_gap(tmp_path):
+    clusters = gc_profile.cluster_high_gc_regions([(0, 10), (310, 320)], 20, 50, str(tmp_path / "clusters"))
+    assert list(clusters) == [(0, 110), (210, 420)]
+    clusters = gc_profile.cluster_high_gc_regions([(0, 10), (100, 110)], 20, 50, str(tmp_path / "clusters"))
+    assert list(clusters) == [(0, 210)]
+    # regions 150 bases apart are not merged, but their padded extents overlap
+    clusters = gc_profile.cluster_high_gc_regions([(0, 10), (160, 170)], 20, 50, str(tmp_path / "clusters"))
+    assert list(clusters) == [(0, 270)]
+
+    rng = numpy.random.default_rng(2)
+    for _ in range(200):
+        edges = numpy.sort(rng.choice(5000, size=2 * int(rng.integers(1, 30)), replace=False))
+        merge_gap, flank = (int(n) for n in rng.integers(0, 150, 2))
+        clusters = gc_profile.cluster_high_gc_regions(
+            edges.reshape(-1, 2), 20, 50, str(tmp_path / "clusters"), merge_gap, flank, seq_len=5000)
+        assert list(clusters) == clusters_loop(edges.reshape(-1, 2).tolist(), merge_gap, flank, 5000)
+        assert (clusters.starts[1:] >= clusters.ends[:-1]).all()
+
+
+def test_target_summary_reports_failed_bed_write(tmp_path):
+    # a directory where the .bed file should go makes the cluster write fail
+    (tmp_path / "t1_high_gc_regions.bed").mkdir()
+    args = ("sequence", 20, 50, False, 0, "csv", 100, 100, (), None, 1 << 20, str(tmp_path), False, None)
+
+    summary = gc_profile.gc_profile_target_summary("t1", "GCGCATAT" * 50, *args)
+    assert summary["status"] == "failed"
+    assert summary["error"]
+    assert gc_profile.gc_profile_target_summary("t2", "GCGCATAT" * 50, *args)["status"] == "ok"
+
+
+def test_errors_are_raised(tmp_path):
+    with pytest.raises(Exception):
+        gc_profile.open_json_file(str(tmp_path / "missing.json"), "sequence")
+    with pytest.raises(Exception):
+        gc_profile.gc_profile_calc(None, 20, 50)
+    with pytest.raises(OSError):
+        gc_profile.cluster_high_gc_regions([(0, 10)], 20, 50, str(tmp_path / "missing_dir" / "clusters"))
+
+
+@pytest.mark.parametrize("circular", [False, True])
+def test_ladder_shares_cache_with_single_windows(tmp_path, circular):
+    rng = numpy.random.default_rng(3)
+    seq = random_sequence(rng, 500)
+    cache_dir = str(tmp_path / "cache")
+
+    single = gc_profile.cached_gc_percentages(circularise(seq, 50) if circular else seq, "sequence", 50, circular,
+                                              cache_dir)
+    n_entries = len(list((tmp_path / "cache").iterdir()))
+    ladder = gc_profile.gc_profile_ladder(seq, [20, 50, 100], 50, circular, "sequence", cache_dir)
+
+    # the 50-bp window was read from the cache, the other two were added
+    assert len(list((tmp_path / "cache").iterdir())) == n_entries + 2
+    numpy.testing.assert_array_equal(ladder[50][0], single)
+    uncached = gc_profile.gc_profile_ladder(seq, [20, 50, 100], 50, circular)
+    for window_len in (20, 50, 100):
+        numpy.testing.assert_allclose(ladder[window_len][0], uncached[window_len][0])
+        numpy.testing.assert_allclose(
+            gc_profile.gc_profile_ladder(seq, [20, 50, 100], 50, circular, "sequence", cache_dir)[window_len][0],
+            uncached[window_len][0])
+
+
+@pytest.mark.parametrize("option", [["--output-format", "npz"], ["--offset", "5"], ["--metrics", "gc_skew"],
+                                    ["--kmer", "3"]])
+def test_ladder_rejects_unsupported_options(tmp_path, option):
+    seq_file = tmp_path / "target.json"
+    seq_file.write_text('{"sequence": "ACGTGGCC"}')
+    with pytest.raises(SystemExit):
+        gc_profile.main([str(seq_file), "sequence", "2,4", "50", "--outdir", str(tmp_path), "--no-plot"] + option)
+
+    with pytest.raises(ValueError):
+        gc_profile.gc_profile_target_run(
+            "t", "ACGTGGCC", "sequence", [2, 4], 50, False, 5 if "--offset" in option else 0,
+            "npz" if "--output-format" in option else "csv", 100, 100,
+            ("gc_skew",) if "--metrics" in option else (), None, 1 << 20, str(tmp_path), False,
+            3 if "--kmer" in option else None)
+
+
+@pytest.mark.parametrize("argv", [["20,50"], ["20", "--output-format", "npz"], ["20", "--offset", "5"],
+                                  ["20", "--metrics", "gc_skew"], ["20", "--kmer", "3"]])
+def test_stream_rejects_unsupported_options(tmp_path, argv):
+    seq_file = tmp_path / "target.fa"
+    seq_file.write_text(">target\nACGTGGCCACGTGGCCACGTGGCC\n")
+    with pytest.raises(SystemExit):
+        gc_profile.main([str(seq_file), "sequence", argv[0], "50", "--stream", "--outdir", str(tmp_path)] + argv[1:])
+    assert not (tmp_path / "target.fa_gc_values.csv").exists()
+
+
+def test_stream_rejects_json(tmp_path):
+    seq_file = tmp_path / "target.json"
+    seq_file.write_text('{"sequence": "ACGTGGCC"}')
+    with pytest.raises(SystemExit):
+        gc_profile.main([str(seq_file), "sequence", "4", "50", "--stream", "--outdir", str(tmp_path)])
+
+
+@pytest.mark.parametrize("names, expected", [
+    (["g0", "g0", "g0_2"], ["g0", "g0_3", "g0_2"]),
+    (["a", "a", "a"], ["a", "a_2", "a_3"]),
+    (["a_2", "a", "a"], ["a_2", "a", "a_3"]),
+])
+def test_unique_target_names(names, expected):
+    assert gc_profile.unique_target_names(names) == expected
+
+
+def test_missing_sequence_is_reported(tmp_path):
+    meth_dir = tmp_path / "targets"
+    meth_dir.mkdir()
+    (meth_dir / "meta_targets.tsv").write_text("gene\tseq\ng0\tACGTGGCCACGTGGCC\ng1\t\n")
+    summary = gc_profile.final_gc_profile_run_command(
+        str(meth_dir), "sequence", 4, 50, False, 0, out_dir=str(tmp_path), cache_dir=None, plot=False)
+    assert [item["status"] for item in summary] == ["ok", "failed"]
+    assert "missing sequence" in summary[1]["error"]
@@ -0,0 +1,99 @@
+import csv
+
+import numpy
+import pytest
+
+import hairpins_rnalfold
+from batch_runner import atomic_write
+from hairpins_rnalfold import fold_hairpins, fold_hairpins_batch
+from rnalfold_parser import read_hairpins
+
+COMPLEMENT = {"A": "U", "U": "A", "G": "C", "C": "G"}
+
+
+def stem_loop_fold(seq, span):
+    """
+    Stand-in for RNALfold: a 4-bp stem closing a loop wherever the sequence allows, within span
+    """
+    lines = []
+    for i in range(len(seq) - 1, -1, -1):
+        stem = seq[i:i + 4]
+        if len(stem) < 4:
+            continue
+        j = seq.find("".join(COMPLEMENT[base] for base in reversed(stem)), i + 7, min(i + span, len(seq)))
+        if j < 0:
+            continue
+        length = j + 4 - i
+        energy = -(stem.count("G") + stem.count("C")) * 1.1 - 0.3 * (length % 5)
+        lines.append(f"{'((((' + '.' * (length - 8) + '))))'} ({energy:6.2f}) {i + 1:5d}")
+    return "\n".join(lines + [seq, " (-99.00)"]) + "\n"
+
+
+def read_summary(summary_file):
+    with open(summary_file, newline="") as f:
+        return {row["name"]: row for row in csv.DictReader(f, delimiter="\t")}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("chunk_len", [37, 100, 256, 500])
+def test_chunked_fold_matches_single_fold(chunk_len, workers):
+    rng = numpy.random.default_rng(1)
+    seq = "".join(rng.choice(list("ACGU"), 1000))
+    span = 50
+    whole = fold_hairpins(seq, span, stem_loop_fold)
+    chunked = fold_hairpins(seq, span, stem_loop_fold, chunk_len=chunk_len, workers=workers, margin=span)
+
+    assert chunked == whole
+    # the sequence must exercise stems that cross a chunk boundary (1-based start, inclusive end)
+    boundaries = numpy.arange(chunk_len, len(seq), chunk_len)
+    assert any(((boundaries >= hairpin.start) & (boundaries < hairpin.end)).any() for hairpin in whole)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_refolds_only_changed_records(tmp_path, workers):
+    rng = numpy.random.default_rng(0)
+    names = ["g0", "g1", "g2"]
+    seqs = ["".join(rng.choice(list("ACGU"), 600)) for _ in names]
+    cache_dir, out_dir = str(tmp_path / "cache"), str(tmp_path / "out")
+
+    fold_hairpins_batch(names, seqs, 50, stem_loop_fold, workers=workers, cache_dir=cache_dir, out_dir=out_dir)
+    seqs[1] = seqs[1][::-1]
+    summary = fold_hairpins_batch(names, seqs, 50, stem_loop_fold, workers=workers, cache_dir=cache_dir,
+                                  out_dir=out_dir)
+
+    assert [item["cached"] for item in summary] == [True, False, True]
+    rows = read_summary(tmp_path / "out" / "hairpin_summary.tsv")
+    assert [rows[name]["status"] for name in names] == ["ok"] * 3
+    for name, seq in zip(names, seqs):
+        expected = [hairpin._replace(energy=round(hairpin.energy, 2))
+                    for hairpin in fold_hairpins(seq, 50, stem_loop_fold)]
+        assert list(read_hairpins(rows[name]["lfold"])) == expected
+
+
+def test_batch_reports_empty_record(tmp_path):
+    summary = fold_hairpins_batch(["a", "b"], ["GGGGAAAACCCC", ""], 50, stem_loop_fold, cache_dir=None,
+                                  out_dir=str(tmp_path))
+    assert [item["status"] for item in summary] == ["ok", "failed"]
+
+
+def test_atomic_write_leaves_no_partial_file(tmp_path):
+    target = tmp_path / "entry.lfold"
+
+    def failing_write(tmp_file):
+        with open(tmp_file, "w") as f:
+            f.write("partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(str(target), failing_write)
+    assert list(tmp_path.iterdir()) == []
+
+    atomic_write(str(target), lambda tmp_file: open(tmp_file, "w").close())
+    assert [path.name for path in tmp_path.iterdir()] == ["entry.lfold"]
+
+
+def test_fold_cache_key_depends_on_parameters():
+    key = hairpins_rnalfold.fold_cache_key("ACGU", 50, stem_loop_fold)
+    assert key != hairpins_rnalfold.fold_cache_key("ACGU", 60, stem_loop_fold)
+    assert key != hairpins_rnalfold.fold_cache_key("ACGU", 50, hairpins_rnalfold.rnalfold_command)
+    assert key != hairpins_rnalfold.fold_cache_key("ACGA", 50, stem_loop_fold)
@@ -0,0 +1,94 @@
+import os
+
+import numpy
+import pytest
+
+from heatmap import final_heatmap_run_command
+from test_heatmap_batch import TARGET_LEN, write_experiment_input
+
+
+def r_template_value(r_file, name):
+    """
+    Value assigned to name in a generated R script, e.g. str_rows_by_probe <- "..."
+    """
+    with open(r_file) as f:
+        for line in f:
+            if line.startswith(f"{name} <- "):
+                return line.split("<-", 1)[1].strip().strip('"')
+    raise KeyError(name)
+
+
+def test_r_renderer_gets_window_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # the R template is read from ./src, as when run from heatmap/
+    os.symlink(os.path.dirname(os.path.abspath(final_heatmap_run_command.__code__.co_filename)), tmp_path / "src")
+    # no Rscript run: only the generated script is checked
+    monkeypatch.setattr(os, "system", lambda command: 0)
+    (tmp_path / "out").mkdir()
+    write_experiment_input(tmp_path / "input", probe_lens=(20, 25))
+
+    _, r_file, _ = final_heatmap_run_command(
+        "heatmap.py", "probes", "target", str(tmp_path / "input"), "target position", 5,
+        target_from=30, target_to=90, workers=1, renderer="r", cache_dir=None)
+    rows = [int(n) for n in r_template_value(r_file, "str_rows_by_probe").split(", ")]
+
+    csv_values = numpy.genfromtxt(tmp_path / "out" / "heatmap_csv_input_probes_target.csv", delimiter=",",
+                                  skip_header=1)
+    assert rows == numpy.count_nonzero(~numpy.isnan(csv_values), axis=0).tolist()
+    assert all(n < TARGET_LEN - 25 for n in rows)
+
+    _, r_file, _ = final_heatmap_run_command(
+        "heatmap.py", "probes", "target", str(tmp_path / "input"), "target position", 5,
+        workers=1, renderer="r", cache_dir=None)
+    assert r_template_value(r_file, "str_rows_by_probe") == ""
+
+
+@pytest.mark.parametrize("module", ["target_json.py", "run_report.py", "batch_runner.py"])
+def test_vendored_modules_match_repository(module):
+    # heatmap/ is run on its own (Docker mounts only heatmap/), so it carries copies of the shared modules
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, module)) as shared, open(os.path.join(root, "heatmap", "src", module)) as vendored:
+        assert vendored.read() == shared.read()
+
+
+def test_python_renderer_removes_memmap(tmp_path, monkeypatch):
+    import heatmap
+
+    monkeypatch.chdir(tmp_path)
+    write_experiment_input(tmp_path / "input", probe_lens=(20, 25))
+    prepare_heatmap = heatmap.prepare_heatmap
+    memmaps = []
+
+    def prepare_out_of_core(*args, **kwargs):
+        # every matrix is larger than 0 bytes, so it is assembled in out + '.npy'
+        result = prepare_heatmap(*args, **dict(kwargs, max_matrix_bytes=0))
+        memmaps.append(os.path.exists(args[2] + ".npy"))
+        return result
+
+    monkeypatch.setattr(heatmap, "prepare_heatmap", prepare_out_of_core)
+    csv_file, _, pdf_name = final_heatmap_run_command(
+        "heatmap.py", "probes", "target", str(tmp_path / "input"), "target position", 5, workers=1, cache_dir=None,
+        max_heatmap_rows=10)
+
+    assert memmaps == [True]
+    assert os.path.exists(pdf_name) and os.path.exists(csv_file)
+    assert not os.path.exists(csv_file + ".npy")
+
+
+def test_clipped_matrix_stays_float32():
+    from heatmap_renderer import clipped_matrix, heatmap_means
+
+    rng = numpy.random.default_rng(0)
+    matrix = rng.normal(-20, 5, (300, 4)).astype(numpy.float32)
+    matrix[rng.random(matrix.shape) < 0.2] = numpy.nan
+    probe_vector = [20, 25, 30, 22]
+
+    means_by_probe, mean_whole_matrix = heatmap_means(matrix, probe_vector, 320)
+    corrected = matrix.astype(numpy.float64) / probe_vector
+    numpy.testing.assert_allclose(means_by_probe, numpy.nansum(corrected, axis=0) / (320 - numpy.array(probe_vector)))
+    for means in (means_by_probe, mean_whole_matrix):
+        clipped = clipped_matrix(matrix, probe_vector, means)
+        assert clipped.dtype == numpy.float32
+        with numpy.errstate(invalid="ignore"):
+            expected = numpy.where(corrected > means, means, corrected)
+        numpy.testing.assert_allclose(clipped, expected, rtol=1e-6)
@@ -0,0 +1,70 @@
+import csv
+import json
+
+import numpy
+import pytest
+
+from heatmap_batch import run_heatmap_batch, shared_target_lengths
+
+
+TARGET_LEN = 120
+FINDER_HEADER = [f"col{i}" for i in range(8)] + ["target start", "target end"] + \
+    [f"col{i}" for i in range(10, 13)] + ["duplex deltaG"]
+
+
+def write_experiment_input(input_dir, probe_lens=(20, 25), seed=0):
+    """
+    A target json file and one BoAB finder csv file per probe
+    """
+    rng = numpy.random.default_rng(seed)
+    input_dir.mkdir()
+    with open(input_dir / "target.json", "w") as f:
+        json.dump({"sequence": "ACGU" * (TARGET_LEN // 4)}, f)
+    for n, probe_len in enumerate(probe_lens, start=1):
+        with open(input_dir / f"probe{n}.csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(FINDER_HEADER)
+            for start in range(1, TARGET_LEN - probe_len + 1):
+                writer.writerow(["x"] * 8 + [start, start + probe_len - 1] + ["x"] * 3
+                                + [round(-rng.uniform(5, 30), 2)])
+
+
+def write_manifest(manifest_file, input_dirs):
+    with open(manifest_file, "w", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["probes_name", "target_name", "input_dir", "y_axis"])
+        for n, input_dir in enumerate(input_dirs, start=1):
+            writer.writerow([f"probes{n}", "target", input_dir, "target position"])
+
+
+def read_summary(summary_file):
+    with open(summary_file, newline="") as f:
+        return {row["experiment"]: row for row in csv.DictReader(f, delimiter="\t")}
+
+
+def test_bad_experiment_does_not_abort_batch(tmp_path, monkeypatch):
+    pytest.importorskip("matplotlib")
+    monkeypatch.chdir(tmp_path)
+    write_experiment_input(tmp_path / "good")
+    write_manifest(tmp_path / "manifest.tsv", [str(tmp_path / "good"), str(tmp_path / "nodir")])
+
+    summary = run_heatmap_batch(str(tmp_path / "manifest.tsv"), workers=1, cache_dir=None)
+
+    assert [item["experiment"] for item in summary] == ["probes1_target", "probes2_target"]
+    rows = read_summary(tmp_path / "out" / "heatmap_batch_summary.tsv")
+    assert rows["probes1_target"]["status"] in ("ok", "small_pdf")
+    assert rows["probes1_target"]["pdf"]
+    assert rows["probes2_target"]["status"] == "failed"
+    assert rows["probes2_target"]["error"]
+    assert "nodir" in (tmp_path / rows["probes2_target"]["log"]).read_text()
+
+
+def test_shared_target_lengths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_experiment_input(tmp_path / "a")
+    write_experiment_input(tmp_path / "b")
+    (tmp_path / "bad").mkdir()
+    (tmp_path / "bad" / "target.json").write_text('{"sequence": ')
+    experiments = [{"input_dir": str(tmp_path / name)} for name in ("a", "b", "bad", "nodir", "a")]
+
+    assert shared_target_lengths(experiments, None) == [TARGET_LEN, TARGET_LEN, None, None, TARGET_LEN]